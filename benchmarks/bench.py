@@ -0,0 +1,234 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+
+from tadek.core import config
+config.setProgramName("tadekd")
+
+from tadek.connection import protocol
+from tadek.connection import server
+
+#: A directory of daemon sources
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, "src")
+
+# A script that runs a daemon of the given configuration file
+_DAEMON_SCRIPT = '''
+import sys
+sys.path.insert(0, %r)
+from tadek.core import config
+config.setProgramName("tadekd")
+import daemon
+daemon.main(conf=sys.argv[1], startup=False)
+'''
+
+def terminator():
+    '''
+    Returns a terminator of messages used by daemons.
+
+    :rtype: string
+    '''
+    a, b = socket.socketpair()
+    handler = server.Handler(a, None)
+    try:
+        return handler.get_terminator()
+    finally:
+        handler.close()
+        b.close()
+
+def parseAddress(address):
+    '''
+    Parses the given address of a daemon, a path of a Unix domain socket
+    prefixed with unix: or host:port.
+
+    :param address: An address of a daemon
+    :type address: string
+    :return: A path or a tuple of a host and a port
+    :rtype: string or tuple
+    '''
+    if address.startswith("unix:"):
+        return address[5:]
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class Client(object):
+    '''
+    A simple blocking client of a daemon.
+    '''
+    def __init__(self, address, timeout=10.0):
+        '''
+        Connects to a daemon and receives its information response.
+
+        :param address: A path of a Unix domain socket or a tuple of a host
+            and a port
+        :type address: string or tuple
+        '''
+        if isinstance(address, tuple):
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(address)
+        self._terminator = terminator()
+        self._buffer = ''
+        self.info = self.receive()
+
+    def send(self, data):
+        '''
+        Sends the given marshalled request.
+        '''
+        self._sock.sendall(data + self._terminator)
+
+    def receive(self):
+        '''
+        Receives a marshalled response.
+
+        :rtype: string
+        '''
+        while self._terminator not in self._buffer:
+            data = self._sock.recv(65536)
+            if not data:
+                raise socket.error("Connection closed by daemon")
+            self._buffer += data
+        data, self._buffer = self._buffer.split(self._terminator, 1)
+        return data
+
+    def request(self, data):
+        '''
+        Sends the given marshalled request and returns its marshalled
+        response.
+
+        :rtype: string
+        '''
+        self.send(data)
+        return self.receive()
+
+    def close(self):
+        self._sock.close()
+
+
+def request(target, name, **params):
+    '''
+    Returns a marshalled request of the given target, name and parameters.
+
+    :rtype: string
+    '''
+    return protocol.create(protocol.MSG_TYPE_REQUEST, target, name,
+                           **params).marshal()
+
+def spawnDaemon(sections, timeout=10.0):
+    '''
+    Runs a daemon of daemon sources in a new process. The daemon is
+    configured by the given sections of options as {section: {option: value}}.
+    It returns when the daemon accepts connections.
+
+    :return: A daemon process and a list of its addresses
+    :rtype: tuple
+    '''
+    fd, conf = tempfile.mkstemp(prefix="tadekd-bench-", suffix=".conf")
+    lines = []
+    for section, options in sections.iteritems():
+        lines.append("[%s]" % section)
+        for option, value in options.iteritems():
+            lines.append("%s=%s" % (option, value))
+        lines.append("")
+    os.write(fd, "\n".join(lines))
+    os.close(fd)
+    script = _DAEMON_SCRIPT % os.path.abspath(SRC_DIR)
+    process = subprocess.Popen([sys.executable, "-c", script, conf],
+                               stdout=open(os.devnull, 'w'))
+    connection = sections.get("connection", {})
+    addresses = []
+    if connection.get("tcp", "yes") == "yes":
+        addresses.append((connection.get("address", "127.0.0.1"),
+                          int(connection["port"])))
+    if connection.get("unix_socket"):
+        addresses.append(connection["unix_socket"])
+    start = time.time()
+    for address in addresses:
+        while True:
+            try:
+                Client(address).close()
+                break
+            except socket.error:
+                if process.poll() is not None or time.time() - start > timeout:
+                    process.kill()
+                    raise RuntimeError("Daemon did not start")
+                time.sleep(0.05)
+    os.remove(conf)
+    return process, addresses
+
+def freePort():
+    '''
+    Returns a free TCP port of the local host.
+
+    :rtype: integer
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def percentile(values, fraction):
+    '''
+    Returns a percentile of the given sorted values.
+    '''
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def summary(durations):
+    '''
+    Returns a summary of the given durations in seconds as a string of
+    milliseconds.
+
+    :rtype: string
+    '''
+    durations = sorted(durations)
+    mean = sum(durations) / max(len(durations), 1)
+    return ("mean %.3f  p50 %.3f  p90 %.3f  p99 %.3f ms"
+            % (mean * 1000, percentile(durations, 0.5) * 1000,
+               percentile(durations, 0.9) * 1000,
+               percentile(durations, 0.99) * 1000))
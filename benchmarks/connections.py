@@ -0,0 +1,179 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import time
+import socket
+import resource
+import optparse
+import threading
+
+import bench
+
+from tadek.connection import protocol
+from tadek.core.accessible import Path
+
+USAGE = '''%prog [OPTION]...'''
+
+DESC = '''Measures throughput and latency of active clients of a daemon while
+thousands of idle clients are connected. By default daemons of the source
+tree are started with each given core of waiting for socket events,
+otherwise a given running daemon is measured.
+'''
+
+def raiseFileLimit(needed):
+    '''
+    Raises the limit of open files of the process and its children as far
+    as possible, returns the limit.
+    '''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    return soft
+
+def connectIdle(address, clients, count):
+    '''
+    Opens idle connections until there are the given number of them.
+    '''
+    while len(clients) < count:
+        clients.append(bench.Client(address))
+
+def runActive(address, data, count, duration):
+    '''
+    Connects the given number of clients those send the request one by one
+    for the given time and returns durations of all round trips.
+    '''
+    durations = []
+    errors = []
+    clients = []
+    def run(client):
+        try:
+            end = time.time() + duration
+            while time.time() < end:
+                start = time.time()
+                client.request(data)
+                durations.append(time.time() - start)
+        except socket.error, err:
+            errors.append(err)
+    try:
+        for i in xrange(count):
+            clients.append(bench.Client(address))
+        threads = [threading.Thread(target=run, args=(client,))
+                   for client in clients]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            thread.join(duration + 30.0)
+    finally:
+        for client in clients:
+            client.close()
+    if errors:
+        raise errors[0]
+    return durations
+
+def measure(name, address, process, data, idleCounts, active, duration):
+    '''
+    Measures a daemon of the given address for all numbers of idle clients.
+    '''
+    idle = []
+    try:
+        for count in idleCounts:
+            label = "%-8s idle %-6d active %-4d" % (name, count, active)
+            try:
+                connectIdle(address, idle, count)
+                durations = runActive(address, data, active, duration)
+            except socket.error, err:
+                if process is not None:
+                    # Give the daemon time to exit, e.g. out of select()
+                    for i in xrange(20):
+                        if process.poll() is not None:
+                            break
+                        time.sleep(0.05)
+                if process is not None and process.poll() is not None:
+                    print "%s daemon failed" % label
+                else:
+                    print "%s error: %s" % (label, err)
+                return
+            print "%s %8.0f req/s  %s" % (label, len(durations) / duration,
+                                         bench.summary(durations))
+    finally:
+        for client in idle:
+            client.close()
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage=USAGE, description=DESC)
+    parser.add_option("-a", "--address", dest="address", metavar="ADDRESS",
+                      help="address of a running daemon, host:port or "
+                           "unix:path")
+    parser.add_option("-p", "--pollers", dest="pollers",
+                      default="select,poll,epoll",
+                      help="comma-separated cores of started daemons")
+    parser.add_option("-i", "--idle", dest="idle", default="0,1000,4000",
+                      help="comma-separated numbers of idle clients")
+    parser.add_option("-c", "--active", dest="active", type="int",
+                      default=20, help="number of active clients")
+    parser.add_option("-d", "--duration", dest="duration", type="float",
+                      default=3.0, help="time in seconds of each measurement")
+    opts, args = parser.parse_args()
+    idleCounts = sorted([int(n) for n in opts.idle.split(',') if n])
+    limit = raiseFileLimit(max(idleCounts) + opts.active + 64)
+    if limit < max(idleCounts) + opts.active + 64:
+        print "Warning: the limit of open files is %d" % limit
+    data = bench.request(protocol.MSG_TARGET_ACCESSIBILITY,
+                         protocol.MSG_NAME_GET, path=Path(), depth=0,
+                         include=["count"])
+    if opts.address:
+        measure("daemon", bench.parseAddress(opts.address), None, data,
+                idleCounts, opts.active, opts.duration)
+    else:
+        for poller in opts.pollers.split(','):
+            process, addresses = bench.spawnDaemon({
+                "connection": {
+                    "address": "127.0.0.1",
+                    "port": bench.freePort()
+                },
+                "loop": {
+                    "poller": poller
+                }
+            })
+            try:
+                measure(poller, addresses[0], process, data, idleCounts,
+                        opts.active, opts.duration)
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
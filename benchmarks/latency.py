@@ -0,0 +1,132 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+
+import bench
+
+from tadek.connection import protocol
+from tadek.core.accessible import Path
+
+USAGE = '''%prog [OPTION]...'''
+
+DESC = '''Measures latency of small PUT and EXEC requests sent to a daemon over
+TCP and over a Unix domain socket. By default a daemon of the source tree
+listening on both is started, otherwise given addresses are measured.
+'''
+
+def measure(addresses, data, count, warmup):
+    '''
+    Sends the given request one by one to all the addresses in turn and
+    returns durations of round trips in seconds for each address. Requests
+    are interleaved, so all the addresses are measured under the same load
+    of the host.
+    '''
+    clients = []
+    try:
+        for address in addresses:
+            clients.append(bench.Client(address))
+        for i in xrange(warmup):
+            for client in clients:
+                client.request(data)
+        durations = [[] for client in clients]
+        for i in xrange(count):
+            for client, times in zip(clients, durations):
+                start = time.time()
+                client.request(data)
+                times.append(time.time() - start)
+    finally:
+        for client in clients:
+            client.close()
+    return durations
+
+def describe(address):
+    if isinstance(address, tuple):
+        return "tcp %s:%d" % address
+    return "unix %s" % address
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage=USAGE, description=DESC)
+    parser.add_option("-a", "--address", dest="addresses", action="append",
+                      metavar="ADDRESS", default=[],
+                      help="address of a running daemon, host:port or "
+                           "unix:path, can be given many times")
+    parser.add_option("-n", "--count", dest="count", type="int",
+                      default=5000, help="number of requests of each kind")
+    parser.add_option("-w", "--warmup", dest="warmup", type="int",
+                      default=200, help="number of warm-up requests")
+    parser.add_option("-p", "--path", dest="path", default="0,0",
+                      help="comma-separated path of a target accessible")
+    opts, args = parser.parse_args()
+    path = Path(*[int(index) for index in opts.path.split(',') if index])
+    requests = [
+        ("PUT text", bench.request(protocol.MSG_TARGET_ACCESSIBILITY,
+                                   protocol.MSG_NAME_PUT, path=path,
+                                   text=u"x")),
+        ("EXEC action", bench.request(protocol.MSG_TARGET_ACCESSIBILITY,
+                                      protocol.MSG_NAME_EXEC, path=path,
+                                      action=u"FOCUS"))
+    ]
+    process = None
+    tmpdir = None
+    if opts.addresses:
+        addresses = [bench.parseAddress(a) for a in opts.addresses]
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="tadekd-bench-")
+        process, addresses = bench.spawnDaemon({
+            "connection": {
+                "address": "127.0.0.1",
+                "port": bench.freePort(),
+                "unix_socket": os.path.join(tmpdir, "tadekd.sock")
+            }
+        })
+    try:
+        for name, data in requests:
+            durations = measure(addresses, data, opts.count, opts.warmup)
+            for address, times in zip(addresses, durations):
+                print "%-12s %-44s %s" % (name, describe(address),
+                                          bench.summary(times))
+    finally:
+        if process is not None:
+            process.kill()
+            process.wait()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
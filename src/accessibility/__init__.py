@@ -58,14 +58,89 @@ def all():
         _load()
     return _cache
 
+#: Wrapping order of child-list snapshots, they are applied closest to
+#: implementations
+SNAPSHOT_ORDER = -10
+
+class SnapshotAccessibility(object):
+    '''
+    A proxy of an accessibility implementation that serves children() and
+    countChildren() from child-list snapshots, like getChild(). Backends
+    implement these methods directly, so they are routed through snapshots
+    of the implementation by the proxy.
+    '''
+    def __init__(self, a11y):
+        self._a11y = a11y
+
+    def __getattr__(self, name):
+        attr = getattr(self._a11y, name)
+        if callable(attr):
+            # Cache the method to skip __getattr__ on next calls
+            self.__dict__[name] = attr
+        return attr
+
+    def children(self, parent=None):
+        return iter(self._a11y.getChildren(parent))
+    children.__doc__ = IAccessibility.children.__doc__
+
+    def countChildren(self, parent=None):
+        return self._a11y.childCount(parent)
+    countChildren.__doc__ = IAccessibility.countChildren.__doc__
+
+    def __repr__(self):
+        return "<SnapshotAccessibility of %r>" % self._a11y
+
+
 # An accessibility implementations cache
 _cache = None
+# Loaded accessibility implementations, not wrapped
+_implementations = None
+# Wrappers of accessibilities as [(order, wrapper)]
+_wrappers = [(SNAPSHOT_ORDER, SnapshotAccessibility)]
+
+def wrap(wrapper, order=0):
+    '''
+    Wraps all available accessibilities using the given wrapper, e.g.
+    a proxy class that takes an accessibility as its only argument.
+    Wrappers of lower order are applied closer to implementations.
+
+    :param wrapper: A wrapper of accessibilities
+    :type wrapper: callable
+    :param order: An order of the wrapper
+    :type order: integer
+    '''
+    all()
+    _wrappers.append((order, wrapper))
+    _wrappers.sort(key=lambda item: item[0])
+    _wrap()
+
+def expireSnapshots(all=False):
+    '''
+    Removes expired child-list snapshots of all accessibilities or all of
+    them if all is True.
+
+    :param all: True if all snapshots should be removed
+    :type all: boolean
+    '''
+    for a11y in _implementations or ():
+        a11y.expireSnapshots(all)
+
+def setSnapshotTTL(ttl):
+    '''
+    Sets time to live of child-list snapshots of accessibilities.
+
+    :param ttl: Time to live in seconds, if 0 then snapshots are kept only
+        during a request
+    :type ttl: float
+    '''
+    IAccessibility.snapshotTTL = ttl
+    expireSnapshots(True)
 
 def _load():
     '''
     Loads all available accessibility implementations.
     '''
-    global _cache
+    global _implementations
     mdls = []
     a11ies = {}
     for file in os.listdir(os.path.dirname(__file__)):
@@ -88,5 +163,18 @@ def _load():
                         break
                 if a11y and a11y.name not in a11ies:
                     a11ies[a11y.name] = a11y
-    _cache = tuple([a11ies[name] for name in sorted(a11ies)])
+    _implementations = tuple([a11ies[name] for name in sorted(a11ies)])
+    _wrap()
+
+def _wrap():
+    '''
+    Wraps loaded accessibility implementations using all wrappers.
+    '''
+    global _cache
+    a11ies = []
+    for a11y in _implementations:
+        for item in _wrappers:
+            a11y = item[1](a11y)
+        a11ies.append(a11y)
+    _cache = tuple(a11ies)
 
@@ -37,11 +37,17 @@
 __all__ = ["decodeResult", "encodeLastArg",
            "IAccessibility", "AccessibilityError"]
 
+import time
 import inspect
+import threading
+from collections import OrderedDict
 
 from tadek.core.utils import encode, decode
 from constants import *
 
+# A lock of child-list snapshots of all accessibilities
+_snapshotLock = threading.RLock()
+
 def decodeResult(encoding=None):
     '''
     A decorator that decodes result of a decorated function.
@@ -104,6 +110,9 @@ class IAccessibility:
 
     #: A name of an accessibility implementation
     name = None
+    #: True if accessible objects of different applications can be accessed
+    #: from different threads at the same time
+    concurrent = False
     actionset = None
     buttonset = None
     keyset = None
@@ -274,11 +283,17 @@ class IAccessibility:
         :return: Child accessible object
         :rtype: Accessible
         '''
-        n = self.countChildren(parent)
+        snapshot = self._snapshot(parent)
+        if snapshot is None:
+            n = self.countChildren(parent)
+        else:
+            n = snapshot[1]
         if index >= n or index < -n:
             return None
         elif index < 0:
             index += n
+        if snapshot is not None and snapshot[2] is not None:
+            return snapshot[2][index]
         return self._getChild(parent, index)
 
     def _getChild(self, parent, index):
@@ -287,6 +302,114 @@ class IAccessibility:
         '''
         raise NotImplementedError
 
+# Child-list snapshots:
+    #: Time to live in seconds of child-list snapshots, if 0 then snapshots
+    #: are kept only until expireSnapshots() is called when a request, or
+    #: a task or deferred response of it, starts or finishes
+    snapshotTTL = 0
+    #: A maximum number of parents of which snapshots are kept
+    maxSnapshots = 1024
+
+    def getChildren(self, parent=None):
+        '''
+        Gets a list of all children of the given accessible parent object.
+        The list is fetched at once and kept as a snapshot, which is used
+        also by getChild() and childCount() until it expires.
+
+        :param parent: Parent accessible object or None
+        :type parent: Accessible
+        :return: A list of child accessible objects
+        :rtype: list
+        '''
+        snapshot = self._snapshot(parent)
+        if snapshot is not None and snapshot[2] is not None:
+            return snapshot[2]
+        children = self._fetchChildren(parent)
+        self._storeSnapshot(parent, len(children), children)
+        return children
+
+    def childCount(self, parent=None):
+        '''
+        Returns number of children of the given accessible parent object
+        using a snapshot of its children, if any.
+
+        :param parent: Parent accessible object or None
+        :type parent: Accessible
+        :return: Number of children
+        :rtype: integer
+        '''
+        snapshot = self._snapshot(parent)
+        if snapshot is not None:
+            return snapshot[1]
+        n = self.countChildren(parent)
+        self._storeSnapshot(parent, n, None)
+        return n
+
+    def expireSnapshots(self, all=False):
+        '''
+        Removes expired child-list snapshots or all of them if all is True.
+
+        :param all: True if all snapshots should be removed
+        :type all: boolean
+        '''
+        with _snapshotLock:
+            snapshots = self.__dict__.get("_snapshots")
+            if not snapshots:
+                return
+            if all or not self.snapshotTTL:
+                snapshots.clear()
+                return
+            now = time.time()
+            for parent, snapshot in snapshots.items():
+                if snapshot[0] <= now:
+                    del snapshots[parent]
+
+    def _fetchChildren(self, parent):
+        '''
+        Fetches a list of all children of the given accessible parent object
+        at once. Implementations with a native bulk children API should
+        override this method.
+        '''
+        return [self._getChild(parent, i)
+                for i in xrange(self.childCount(parent))]
+
+    def _snapshot(self, parent):
+        '''
+        Returns a valid snapshot of children of the given parent as
+        [expiration time, count, children or None] or None.
+        '''
+        with _snapshotLock:
+            snapshots = self.__dict__.get("_snapshots")
+            if not snapshots:
+                return None
+            try:
+                snapshot = snapshots.get(parent)
+            except TypeError:
+                return None
+            if snapshot is None:
+                return None
+            if self.snapshotTTL and snapshot[0] <= time.time():
+                del snapshots[parent]
+                return None
+            return snapshot
+
+    def _storeSnapshot(self, parent, count, children):
+        '''
+        Stores a snapshot of children of the given parent.
+        '''
+        with _snapshotLock:
+            snapshots = self.__dict__.get("_snapshots")
+            if snapshots is None:
+                snapshots = self.__dict__["_snapshots"] = OrderedDict()
+            try:
+                snapshots.pop(parent, None)
+            except TypeError:
+                return
+            while len(snapshots) >= self.maxSnapshots:
+                snapshots.popitem(last=False)
+            snapshots[parent] = [time.time() + self.snapshotTTL, count,
+                                 children]
+
     def getParent(self, accessible):
         '''
         Gets a parent of the given accessible object.
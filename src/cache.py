@@ -0,0 +1,346 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from tadek.core import log
+from tadek.core import config
+
+import stats
+import spatial
+import providers
+import accessibility
+
+#: Cached accessibility methods as {method: field}
+FIELDS = {
+    "getName": "name",
+    "getDescription": "description",
+    "getRoleName": "role",
+    "getPosition": "position",
+    "getSize": "size",
+    "getAttributes": "attributes",
+    "getText": "text",
+    "getValue": "value",
+    "childCount": "count",
+    "actionNames": "actions",
+    "states": "states"
+}
+
+#: Default time to live in milliseconds of cached fields
+DEFAULT_TTLS = {
+    "name": 2000,
+    "description": 30000,
+    "role": 60000,
+    "position": 1000,
+    "size": 1000,
+    "attributes": 10000,
+    "text": 500,
+    "value": 500,
+    "count": 500,
+    "actions": 10000,
+    "states": 500
+}
+
+#: Fields those may change as a side effect of any input event or action
+VOLATILE = frozenset(["name", "position", "size", "text", "value",
+                      "count", "states"])
+
+#: Default maximum number of cached accessible objects
+DEFAULT_MAX_ENTRIES = 10000
+#: Default maximum approximate size in bytes of cached values
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+#: Wrapping order of the cache, it is applied above instrumented proxies
+ORDER = 10
+
+
+class PropertyCache(object):
+    '''
+    A cache of properties of accessible objects shared by all connections of
+    the daemon. Each field has its own time to live. The number of cached
+    objects and the approximate size of their values are limited and least
+    recently used objects are evicted first.
+    '''
+    def __init__(self, ttls, maxEntries, maxBytes=DEFAULT_MAX_BYTES):
+        '''
+        Initializes a property cache.
+
+        :param ttls: Time to live in seconds of fields as {field: ttl}
+        :type ttls: dictionary
+        :param maxEntries: A maximum number of cached objects
+        :type maxEntries: integer
+        :param maxBytes: A maximum approximate size in bytes of cached values
+        :type maxBytes: integer
+        '''
+        self.ttls = ttls
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        # Approximate sizes in bytes of entries as {key: size}
+        self._sizes = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        # A generation of volatile fields, entries of older generations
+        # are not used
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, field):
+        '''
+        Gets a cached value of the given field of an object of the given key.
+
+        :return: A found flag and a value
+        :rtype: tuple
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            item = entry.get(field)
+            if item is None:
+                return False, None
+            expires, generation, value, size = item
+            if (expires < time.time() or
+                (generation != self._generation and field in VOLATILE)):
+                del entry[field]
+                self._sizes[key] -= size
+                self.bytes -= size
+                return False, None
+            # Mark the entry as recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            return True, value
+
+    def set(self, key, field, value):
+        '''
+        Caches a value of the given field of an object of the given key.
+        '''
+        with self._lock:
+            ttl = self.ttls.get(field, 0)
+            if ttl <= 0:
+                return
+            size = sizeof(value)
+            if size > self.maxBytes:
+                return
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = {}
+                self._sizes[key] = 0
+            item = entry.get(field)
+            if item is not None:
+                self._sizes[key] -= item[3]
+                self.bytes -= item[3]
+            while self._entries and (len(self._entries) >= self.maxEntries or
+                                     self.bytes + size > self.maxBytes):
+                self._evict()
+            entry[field] = (time.time() + ttl, self._generation, value, size)
+            self._entries[key] = entry
+            self._sizes[key] += size
+            self.bytes += size
+
+    def _evict(self):
+        '''
+        Evicts the least recently used entry.
+        '''
+        key, entry = self._entries.popitem(last=False)
+        self.bytes -= self._sizes.pop(key)
+        stats.count("cache_evictions_total")
+
+    def _drop(self, key):
+        '''
+        Drops an entry of the given key.
+        '''
+        if self._entries.pop(key, None) is not None:
+            self.bytes -= self._sizes.pop(key)
+
+    def invalidate(self, key=None, volatile=False):
+        '''
+        Invalidates cached properties. If key is given then all fields of its
+        object are dropped. If volatile is True then volatile fields of all
+        objects are invalidated.
+        '''
+        with self._lock:
+            if key is not None:
+                self._drop(key)
+            if volatile:
+                self._generation += 1
+
+    def clear(self):
+        '''
+        Drops all cached properties.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+
+# The shared property cache or None if caching is disabled
+_cache = None
+
+def sizeof(value):
+    '''
+    Returns an approximate size in bytes of the given value including sizes
+    of items of containers.
+
+    :rtype: integer
+    '''
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum([sizeof(item) for item in value])
+    elif isinstance(value, dict):
+        size += sum([sizeof(k) + sizeof(v) for k, v in value.iteritems()])
+    return size
+
+def _key(a11y, obj):
+    '''
+    Returns a cache key of the given accessible object or None if the object
+    cannot be used as a key.
+    '''
+    key = (a11y.name, obj)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def invalidate(a11y, obj, volatile=False):
+    '''
+    Invalidates cached properties of the given accessible object after it was
+    changed. If volatile is True then volatile fields, child-list snapshots,
+    memoised paths and spatial indexes of all objects are invalidated as well,
+    e.g. after an action or an input event.
+
+    :param a11y: An accessibility of the object
+    :type a11y: IAccessibility
+    :param obj: An accessible object or None
+    :type obj: accessible
+    :param volatile: True if volatile fields of all objects are invalidated
+    :type volatile: boolean
+    '''
+    if volatile:
+        accessibility.expireSnapshots(True)
+        providers.paths.clear()
+        spatial.indexes.clear()
+    if _cache is None:
+        return
+    key = None
+    if a11y is not None and obj is not None:
+        key = _key(a11y, obj)
+    _cache.invalidate(key, volatile)
+
+
+class CachedAccessibility(object):
+    '''
+    A proxy of an accessibility implementation that serves properties of
+    accessible objects from the shared property cache.
+    '''
+    def __init__(self, a11y):
+        self._a11y = a11y
+
+    def __getattr__(self, name):
+        attr = getattr(self._a11y, name)
+        field = FIELDS.get(name)
+        if field is None or not callable(attr):
+            return attr
+        a11y = self._a11y
+        def cached(obj=None):
+            key = _key(a11y, obj) if obj is not None else None
+            if key is None:
+                return attr(obj)
+            found, value = _cache.get(key, field)
+            if found:
+                stats.count("cache_hits_total", (("field", field),))
+            else:
+                stats.count("cache_misses_total", (("field", field),))
+                value = attr(obj)
+                if field in ("actions", "states"):
+                    value = list(value)
+                _cache.set(key, field, value)
+            if field in ("actions", "states"):
+                return iter(value)
+            return value
+        cached.__name__ = name
+        cached.__doc__ = attr.__doc__
+        self.__dict__[name] = cached
+        return cached
+
+    def inState(self, obj, state):
+        '''
+        Checks if the given accessible object is in the specified state using
+        cached states of the object.
+        '''
+        return state in list(self.states(obj))
+
+    def __repr__(self):
+        return "<CachedAccessibility of %r>" % self._a11y
+
+
+def enable():
+    '''
+    Enables the shared property cache configured in the [cache] section of
+    the daemon configuration.
+    '''
+    global _cache
+    if _cache is not None:
+        return
+    ttls = {}
+    for field, ttl in DEFAULT_TTLS.iteritems():
+        value = config.getInt('daemon', 'cache', field)
+        if value is None:
+            value = ttl
+        ttls[field] = value / 1000.0
+    maxEntries = config.getInt('daemon', 'cache', 'max_entries')
+    if maxEntries is None:
+        maxEntries = DEFAULT_MAX_ENTRIES
+    maxBytes = config.getInt('daemon', 'cache', 'max_bytes')
+    if maxBytes is None:
+        maxBytes = DEFAULT_MAX_BYTES
+    _cache = PropertyCache(ttls, max(maxEntries, 1), max(maxBytes, 1))
+    accessibility.wrap(CachedAccessibility, ORDER)
+    log.info("Enabled property cache of %d objects and %d bytes"
+             % (_cache.maxEntries, _cache.maxBytes))
+
+stats.gauge("cache_entries", lambda: len(_cache or ()))
+stats.gauge("cache_bytes", lambda: _cache.bytes if _cache else 0)
+stats.describe("cache_hits_total", "Number of property cache hits")
+stats.describe("cache_misses_total", "Number of property cache misses")
+stats.describe("cache_evictions_total", "Number of evicted cache entries")
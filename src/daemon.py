@@ -36,16 +36,35 @@
 
 import os
 import sys
+import errno
+import stat
 import locale
+import signal
+import socket
+import asyncore
 
 from tadek.core import log
 from tadek.core import config
-from tadek.connection import run
 from tadek.connection import server
 from tadek.connection import protocol
 
+import loop
+import pool
+import cache
+import image
+import stats
+import monitor
 import handler
+import spatial
 import startup
+import providers
+import tracing
+import isolation
+import timeline
+import scheduler
+import singleflight
+import instrument
+import accessibility
 
 #: Default IP address of daemons
 DEFAULT_IP = '0.0.0.0'
@@ -58,6 +77,12 @@ class Daemon(server.Server):
     connections.
     '''
     handlerClass = handler.DaemonHandler
+    #: A configuration section of the listening address
+    section = 'connection'
+    #: A default port number of the listening address
+    defaultPort = DEFAULT_PORT
+    #: True if accessibility requests are processed by the daemon itself
+    local = True
 
     def __init__(self, conf=None):
         '''
@@ -72,19 +97,38 @@ class Daemon(server.Server):
             else:
                 log.warning("Configuration file %s does not exist."
                             " Skipped" % conf)
-        port = config.getInt('daemon', 'connection', 'port')
-        ip = config.get('daemon', 'connection', 'address')
-        if ip is None:
-            log.warning("No attribute IP in daemon configuration file. "
-                        "Using default value %s" % DEFAULT_IP)
-            config.set('daemon', 'connection', 'address', DEFAULT_IP)
-            ip = DEFAULT_IP
-        if port is None:
-            log.warning("No attribute port in daemon configuration file. "
-                        "Using default value %d" % DEFAULT_PORT)
-            config.set('daemon', 'connection', 'port', DEFAULT_PORT)
-            port = DEFAULT_PORT
-        server.Server.__init__(self, (ip, port))
+                conf = None
+        self._conf = conf
+        self._configure()
+        tcp = config.getBool('daemon', self.section, 'tcp')
+        path = config.get('daemon', self.section, 'unix_socket')
+        if tcp is None:
+            tcp = True
+        elif not (tcp or path):
+            log.warning("No Unix domain socket in daemon configuration file. "
+                        "Listening on TCP")
+            tcp = True
+        self.address = None
+        if tcp:
+            port = config.getInt('daemon', self.section, 'port')
+            ip = config.get('daemon', self.section, 'address')
+            if ip is None:
+                log.warning("No attribute IP in daemon configuration file. "
+                            "Using default value %s" % DEFAULT_IP)
+                config.set('daemon', self.section, 'address', DEFAULT_IP)
+                ip = DEFAULT_IP
+            if port is None:
+                log.warning("No attribute port in daemon configuration file. "
+                            "Using default value %d" % self.defaultPort)
+                config.set('daemon', self.section, 'port', self.defaultPort)
+                port = self.defaultPort
+            server.Server.__init__(self, (ip, port))
+        else:
+            # Listen only on the Unix domain socket
+            asyncore.dispatcher.__init__(self)
+        self._unix = None
+        if path:
+            self._unix = UnixListener(path, self)
         info = protocol.create(protocol.MSG_TYPE_RESPONSE,
                                protocol.MSG_TARGET_SYSTEM,
                                protocol.MSG_NAME_INFO,
@@ -93,6 +137,12 @@ class Daemon(server.Server):
                                extensions=protocol.getExtensions(),
                                status=True)
         self._infoData = info.marshal()
+        stats.start()
+        if config.getBool('daemon', 'cache', 'enabled'):
+            cache.enable()
+        if self.local and config.getBool('daemon', 'accessibility',
+                                         'isolation'):
+            isolation.start(self._conf)
 
     def handle_accept(self):
         '''
@@ -103,7 +153,40 @@ class Daemon(server.Server):
         except:
             log.exception("Error while accepting connection")
         else:
-            handler.push(''.join([self._infoData, handler.get_terminator()]))
+            handler.pushMessage(self._infoData)
+
+    def readable(self):
+        '''
+        Stops accepting connections while the maximum number of connections
+        is open, pending connections wait in the listen queue.
+        '''
+        return handler.accepting() and server.Server.readable(self)
+
+    def accepted(self, sock, client):
+        '''
+        Handles a client connection accepted by another listener of
+        the daemon and sends an information response to the client.
+
+        :param sock: A socket of the connection
+        :type sock: socket
+        :param client: A client address
+        :type client: string
+        '''
+        handler = self.handlerClass(sock, client)
+        handler.pushMessage(self._infoData)
+
+    def addresses(self):
+        '''
+        Returns descriptions of addresses the daemon listens on.
+
+        :rtype: list
+        '''
+        addresses = []
+        if self.address is not None:
+            addresses.append("%s:%d" % self.address)
+        if self._unix is not None:
+            addresses.append("unix:%s" % self._unix.path)
+        return addresses
 
     def onClose(self):
         '''
@@ -120,13 +203,134 @@ class Daemon(server.Server):
         '''
         log.exception(exception)
 
+    def _configure(self):
+        '''
+        Applies runtime settings of the daemon configuration.
+        '''
+        configure()
+
+    def reload(self, *args):
+        '''
+        Reloads the daemon configuration file and applies its runtime
+        settings, e.g. tracing levels. It is called on the SIGHUP signal.
+        '''
+        log.info("Reloading daemon configuration")
+        if self._conf is not None:
+            config.update('daemon', self._conf)
+        self._configure()
+
     def run(self):
         '''
-        Starts asyncore.loop().
+        Starts the event loop.
         '''
-        log.info("Starting daemon at %s:%d" % self.address)
-        run()
+        log.info("Starting daemon at %s" % ", ".join(self.addresses()))
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGTERM, self.terminate)
+        try:
+            loop.run()
+        finally:
+            isolation.stop()
+
+    def terminate(self, *args):
+        '''
+        Stops the event loop. It is called on the SIGTERM signal.
+        '''
+        log.info("Stopping daemon")
+        raise SystemExit(0)
+
 
+class UnixListener(asyncore.dispatcher):
+    '''
+    A listener of client connections on a Unix domain socket, e.g. for
+    clients running on the same host. Accepted connections are handled by
+    the daemon the same way as TCP ones.
+    '''
+    def __init__(self, path, daemon):
+        '''
+        Initializes a listener and binds it to the given path.
+
+        :param path: A path of the socket
+        :type path: string
+        :param daemon: A daemon handling accepted connections
+        :type daemon: Daemon
+        '''
+        asyncore.dispatcher.__init__(self)
+        self.path = path
+        self._daemon = daemon
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise socket.error("Not a socket: %s" % path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+            except socket.error, err:
+                if err.errno != errno.ECONNREFUSED:
+                    raise
+                # A socket left by a previous daemon
+                os.remove(path)
+            else:
+                raise socket.error(errno.EADDRINUSE,
+                                   "Socket in use: %s" % path)
+            finally:
+                sock.close()
+        self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.bind(path)
+        self.listen(socket.SOMAXCONN)
+
+    def readable(self):
+        '''
+        Stops accepting connections while the maximum number of connections
+        of the daemon is open.
+        '''
+        return handler.accepting() and asyncore.dispatcher.readable(self)
+
+    def handle_accept(self):
+        '''
+        Accepts a client connection and passes it to the daemon.
+        '''
+        try:
+            pair = self.accept()
+            if pair is None:
+                return
+            self._daemon.accepted(pair[0], self.path)
+        except:
+            log.exception("Error while accepting connection")
+
+    def close(self):
+        '''
+        Closes the listener and removes its socket file.
+        '''
+        asyncore.dispatcher.close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def configure():
+    '''
+    Applies runtime settings of the daemon configuration. It is used by
+    the daemon and its worker processes.
+    '''
+    loop.configure()
+    handler.configure()
+    tracing.configure()
+    timeline.configure()
+    singleflight.configure()
+    spatial.configure()
+    pool.configure()
+    scheduler.configure()
+    ttl = config.getInt('daemon', 'accessibility', 'snapshot_ttl')
+    accessibility.setSnapshotTTL((ttl or 0) / 1000.0)
+    size = config.getInt('daemon', 'accessibility', 'path_memo')
+    if size is None:
+        size = providers.DEFAULT_MAX_PATHS
+    providers.paths.resize(size)
+    if (config.getBool('daemon', 'accessibility', 'instrument') or
+        timeline.enabled):
+        instrument.enable()
+    monitor.start()
 
 def runScripts():
     '''
@@ -168,6 +372,6 @@ def main(conf=None, startup=True):
         print >> sys.stderr, msg
         log.exception(msg)
         sys.exit(1)
-    print "Daemon is running at %s:%d" % d.address
+    print "Daemon is running at %s" % ", ".join(d.addresses())
     d.run()
 
@@ -0,0 +1,436 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import sys
+import time
+import socket
+from collections import deque
+
+from tadek.core import log
+from tadek.core import config
+from tadek.connection import protocol
+from tadek.connection import server
+
+import loop
+import stats
+import daemon
+import handler
+import isolation
+
+#: Default port number of gateways
+DEFAULT_PORT = 8090
+#: Default number of persistent connections to each daemon
+DEFAULT_CONNECTIONS = 2
+#: Default time in milliseconds a daemon can spend on a request
+DEFAULT_TIMEOUT = 30000
+#: Default delay in milliseconds of reconnecting to a daemon
+DEFAULT_RECONNECT = 1000
+
+# Request parameters those select daemons of a request
+ROUTING_PARAMS = ("node", "nodes")
+
+# Downstream daemons as {name: node}
+_nodes = {}
+# Names of downstream daemons in configuration order
+_names = []
+
+
+class Connection(server.Handler):
+    '''
+    A persistent connection to a downstream daemon. The connection is
+    established in the background and requests are queued until the daemon
+    sends its information response, then the daemon responds in request
+    order.
+    '''
+    def __init__(self, node):
+        server.Handler.__init__(self, None, node.address)
+        self.node = node
+        self.ready = False
+        self._input = []
+        self._queue = []
+        # Deferred responses as (time, deferred)
+        self.pending = deque()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(node.address)
+        except:
+            self.close()
+            raise
+
+    def forward(self, data):
+        '''
+        Forwards the given marshalled request to the daemon.
+
+        :param data: Request data
+        :type data: string
+        :return: A deferred response data or None if the request fails
+        :rtype: loop.Deferred
+        '''
+        deferred = loop.Deferred()
+        self.pending.append((time.time(), deferred))
+        if self.ready:
+            self.push(data)
+            self.push(self.get_terminator())
+        else:
+            self._queue.append(data)
+        return deferred
+
+    def handle_connect(self):
+        log.info("Connected to daemon %s" % self.node.name)
+
+    def collect_incoming_data(self, data):
+        self._input.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self._input)
+        self._input = []
+        if not self.ready:
+            # The information response of the daemon
+            self.ready = True
+            for request in self._queue:
+                self.push(request)
+                self.push(self.get_terminator())
+            self._queue = []
+            return
+        if not self.pending:
+            log.warning("Unexpected response of daemon %s" % self.node.name)
+            return
+        self.pending.popleft()[1].callback(data)
+
+    def handle_error(self):
+        # Failures of connecting are reported by the node
+        report = log.warning if self.ready else log.debug
+        report("Connection to daemon %s failed: %s"
+               % (self.node.name, sys.exc_info()[1]))
+        self.handle_close()
+
+    def handle_close(self):
+        self.close()
+        self.node.lost(self)
+        self.ready = False
+        self._queue = []
+        while self.pending:
+            self.pending.popleft()[1].callback(None)
+
+    def onRequest(self, data):
+        return None, None
+
+    def onClose(self):
+        pass
+
+    def onError(self, exception):
+        log.exception(exception)
+
+
+class Node(object):
+    '''
+    A downstream daemon with a pool of persistent connections. Requests are
+    forwarded over the connection with the fewest pending requests.
+    '''
+    def __init__(self, name, address, connections=DEFAULT_CONNECTIONS,
+                 reconnect=DEFAULT_RECONNECT / 1000.0):
+        self.name = name
+        self.address = address
+        self.connections = max(connections, 1)
+        self.reconnect = reconnect
+        self._pool = []
+        self._timer = None
+
+    def connected(self):
+        '''
+        Checks if any connection to the daemon is ready.
+
+        :rtype: boolean
+        '''
+        for connection in self._pool:
+            if connection.ready:
+                return True
+        return False
+
+    def connect(self, *args):
+        '''
+        Opens missing connections to the daemon.
+        '''
+        self._timer = None
+        while len(self._pool) < self.connections:
+            try:
+                self._pool.append(Connection(self))
+            except socket.error, err:
+                log.warning("Connecting to daemon %s failed: %s"
+                            % (self.name, err))
+                self._retry()
+                break
+
+    def lost(self, connection):
+        '''
+        Removes the given closed connection and reconnects later.
+        '''
+        if connection in self._pool:
+            self._pool.remove(connection)
+            if connection.ready:
+                log.warning("Lost connection to daemon %s" % self.name)
+                stats.count("gateway_disconnects_total",
+                            (("node", self.name),))
+        self._retry()
+
+    def _retry(self):
+        '''
+        Schedules reconnecting to the daemon.
+        '''
+        if self._timer is None:
+            self._timer = loop.callLater(self.reconnect, self.connect)
+
+    def forward(self, data):
+        '''
+        Forwards the given marshalled request to the daemon.
+
+        :param data: Request data
+        :type data: string
+        :return: A deferred response data or None if the request fails
+        :rtype: loop.Deferred
+        '''
+        if not self._pool:
+            self.connect()
+        if not self._pool:
+            deferred = loop.Deferred()
+            deferred.callback(None)
+            return deferred
+        connection = min(self._pool, key=lambda c: len(c.pending))
+        stats.count("gateway_requests_total", (("node", self.name),))
+        return connection.forward(data)
+
+    def check(self, timeout):
+        '''
+        Closes connections whose oldest pending request exceeded the given
+        time, its requests fail.
+        '''
+        for connection in list(self._pool):
+            if (connection.pending and
+                connection.pending[0][0] + timeout < time.time()):
+                log.error("Daemon %s is not responding" % self.name)
+                connection.handle_close()
+
+def _check(timeout, timer):
+    '''
+    Checks all downstream daemons.
+    '''
+    for node in _nodes.itervalues():
+        node.check(timeout)
+
+def configure():
+    '''
+    Creates downstream daemons given in the [gateway] section as
+    a comma-separated list of host:port addresses.
+    '''
+    connections = config.getInt('daemon', 'gateway', 'connections')
+    if connections is None:
+        connections = DEFAULT_CONNECTIONS
+    reconnect = config.getInt('daemon', 'gateway', 'reconnect')
+    if reconnect is None:
+        reconnect = DEFAULT_RECONNECT
+    for name in (config.get('daemon', 'gateway', 'daemons') or '').split(','):
+        name = name.strip()
+        if not name or name in _nodes:
+            continue
+        host, sep, port = name.rpartition(':')
+        if not sep:
+            host, port = name, daemon.DEFAULT_PORT
+        try:
+            address = (host, int(port))
+        except ValueError:
+            log.error("Invalid daemon address: %s" % name)
+            continue
+        _nodes[name] = Node(name, address, connections, reconnect / 1000.0)
+        _names.append(name)
+
+def nodes():
+    '''
+    Returns names of all downstream daemons.
+
+    :rtype: list
+    '''
+    return list(_names)
+
+
+class GatewayHandler(handler.DaemonHandler):
+    '''
+    A class of client connections of a gateway. A request with the node
+    parameter is forwarded to the given daemon and its response is relayed
+    as is. Other requests are broadcast to daemons given by the nodes
+    parameter or to all daemons, their responses are aggregated.
+    '''
+    def processRequest(self, request):
+        '''
+        Forwards the given parsed request and returns its deferred response.
+
+        :param request: A request
+        :type request: tadek.connection.protocol.Message
+        :return: A response, a deferred response or None
+        :rtype: tadek.connection.protocol.Message
+        '''
+        if request is None:
+            return None
+        if (request.target == protocol.MSG_TARGET_EXTENSION and
+            request.name == NodesExtension.name):
+            return handler.DaemonHandler.processRequest(self, request)
+        params = {}
+        for name in request.getParams():
+            if name not in ROUTING_PARAMS:
+                params[name] = getattr(request, name)
+        data = protocol.create(request.type, request.target, request.name,
+                               **params).marshal()
+        node = getattr(request, "node", None)
+        if node is not None:
+            if node not in _nodes:
+                log.warning("Unknown daemon: %s" % node)
+                return None
+            return _nodes[node].forward(data).chain(_relay)
+        names = getattr(request, "nodes", None) or _names
+        for name in names:
+            if name not in _nodes:
+                log.warning("Unknown daemon: %s" % name)
+                return None
+        deferreds = [_nodes[name].forward(data) for name in names]
+        return loop.gather(deferreds).chain(_aggregate, request, list(names))
+
+def _relay(data):
+    '''
+    Returns a response of the given data relayed without re-marshalling.
+    '''
+    if data is None:
+        return None
+    return isolation.RawResponse(data)
+
+def _aggregate(results, request, names):
+    '''
+    Returns a response of a broadcast request aggregating responses of
+    the daemons. Responses are included in their marshalled form in the order
+    of daemons. The status is True if all the daemons succeeded.
+    '''
+    statuses = []
+    responses = []
+    for data in results:
+        status = False
+        if data is not None:
+            try:
+                status = bool(protocol.parse(data).status)
+            except:
+                log.exception("Invalid response of daemon")
+        statuses.append(status)
+        responses.append(data or '')
+    return protocol.create(protocol.MSG_TYPE_RESPONSE, request.target,
+                           request.name, status=all(statuses), nodes=names,
+                           statuses=statuses, responses=responses)
+
+
+class NodesExtension(protocol.Extension):
+    '''
+    A protocol extension that returns downstream daemons of a gateway.
+    '''
+    name = "nodes"
+
+    def request(self, **params):
+        '''
+        Returns parameters of a nodes request.
+        '''
+        return {}
+
+    def response(self, **params):
+        '''
+        Returns names of downstream daemons and their connection states.
+
+        :return: A status and response parameters
+        :rtype: tuple
+        '''
+        names = nodes()
+        return True, {"nodes": names,
+                      "connected": [_nodes[name].connected()
+                                    for name in names]}
+
+protocol.registerExtension(NodesExtension())
+
+
+class Gateway(daemon.Daemon):
+    '''
+    A gateway that accepts client connections and forwards or broadcasts
+    their requests to downstream daemons over persistent connections.
+    '''
+    handlerClass = GatewayHandler
+    section = 'gateway'
+    defaultPort = DEFAULT_PORT
+    local = False
+
+    def __init__(self, conf=None):
+        '''
+        Initializes a gateway and connects to downstream daemons.
+
+        :param conf: A path to a daemon configuration file
+        :type conf: string
+        '''
+        daemon.Daemon.__init__(self, conf)
+        configure()
+        if not _nodes:
+            log.warning("No daemons in gateway configuration")
+        for node in _nodes.itervalues():
+            node.connect()
+        timeout = config.getInt('daemon', 'gateway', 'timeout')
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+        loop.callEvery(1.0, _check, timeout / 1000.0)
+
+
+def main(conf=None):
+    '''
+    Runs a gateway.
+
+    :param conf: A path to daemon configuration file
+    :type conf: string
+    '''
+    log.debug(locals())
+    try:
+        g = Gateway(conf)
+    except:
+        msg = "Gateway starting failure"
+        print >> sys.stderr, msg
+        log.exception(msg)
+        sys.exit(1)
+    print "Gateway is running at %s" % ", ".join(g.addresses())
+    g.run()
+
+stats.describe("gateway_requests_total",
+               "Number of requests forwarded to downstream daemons")
+stats.describe("gateway_disconnects_total",
+               "Number of lost connections to downstream daemons")
@@ -34,12 +34,104 @@
 ##                                                                            ##
 ################################################################################
 
+import time
+import socket
+from collections import deque
+
 from tadek.core import log
+from tadek.core import config
 from tadek.connection import protocol
 from tadek.connection import server
 
+import loop
+import stats
+import output
+import tracing
+import profiler
+import timeline
+import scheduler
+import singleflight
 import processor
 
+#: Default size of queued output that pauses a connection
+DEFAULT_HIGH_WATER = 1048576
+#: Default size of queued output that resumes a paused connection
+DEFAULT_LOW_WATER = 262144
+#: Default maximum size of queued output of a connection, if it is exceeded
+#: then the connection is closed
+DEFAULT_MAX_OUTPUT = 67108864
+#: Default maximum size of a request, if it is exceeded then the connection
+#: is closed
+DEFAULT_MAX_REQUEST = 16777216
+#: Default maximum number of received requests of a connection waiting for
+#: processing, if it is reached then reading requests is paused
+DEFAULT_MAX_BACKLOG = 64
+
+# Handlers of all open connections
+_handlers = set()
+# Maximum number of open connections, 0 if not limited
+_maxConnections = 0
+# Time in seconds after which idle connections are closed, 0 if never
+_idleTimeout = 0
+# A timer of closing idle connections
+_reaper = None
+
+def accepting():
+    '''
+    Checks if new connections can be accepted, i.e. the maximum number of
+    open connections is not reached.
+
+    :rtype: boolean
+    '''
+    return not _maxConnections or len(_handlers) < _maxConnections
+
+def reapIdle(*args):
+    '''
+    Closes connections those have not received nor sent anything for
+    the idle timeout and have no requests in progress.
+    '''
+    if not _idleTimeout:
+        return
+    limit = time.time() - _idleTimeout
+    for handler in [h for h in _handlers if h.idleSince() < limit]:
+        log.info("Closing idle connection with %s" % str(handler.client))
+        stats.count("idle_connections_closed_total")
+        handler.handle_close()
+
+def configure():
+    '''
+    Applies connection limits of the [connection] section of the daemon
+    configuration.
+    '''
+    global _maxConnections, _idleTimeout, _reaper
+    _maxConnections = max(config.getInt('daemon', 'connection',
+                                        'max_connections') or 0, 0)
+    _idleTimeout = max(config.getInt('daemon', 'connection',
+                                     'idle_timeout') or 0, 0) / 1000.0
+    if _reaper is not None:
+        _reaper.cancel()
+        _reaper = None
+    if _idleTimeout:
+        _reaper = loop.callEvery(min(max(_idleTimeout / 4, 0.1), 10.0),
+                                 reapIdle)
+
+def queuedOutput():
+    '''
+    Returns a total size of output data queued in all open connections.
+
+    :rtype: integer
+    '''
+    return sum([len(handler._output) for handler in _handlers])
+
+stats.gauge("active_connections", lambda: len(_handlers))
+stats.gauge("queued_output_bytes", queuedOutput)
+stats.describe("idle_connections_closed_total",
+               "Number of connections closed after the idle timeout")
+stats.describe("oversized_requests_total",
+               "Number of connections closed for too large requests")
+stats.describe("output_overflows_total",
+               "Number of connections closed for too large queued output")
+
 class DaemonHandler(server.Handler):
     '''
     A class responsible for direct communication with client, receiving
@@ -58,16 +150,322 @@ class DaemonHandler(server.Handler):
         server.Handler.__init__(self, socket, client)
         log.info("Accepted connection from %s on %s" % (client, self))
         self._processor = processor.Processor()
+        self._input = []
+        # Parsed requests waiting for processing as
+        # (request, response, time, deadline)
+        self._backlog = deque()
+        self._deferred = None
+        # A request of the deferred response and its deadline
+        self._current = None
+        # True if the request of the deferred response is profiled
+        self._profiled = False
+        self._scheduled = False
+        highWater = config.getInt('daemon', 'output', 'high_water')
+        if highWater is None:
+            highWater = DEFAULT_HIGH_WATER
+        lowWater = config.getInt('daemon', 'output', 'low_water')
+        if lowWater is None:
+            lowWater = DEFAULT_LOW_WATER
+        self._output = output.OutputQueue(highWater, lowWater)
+        self._maxOutput = config.getInt('daemon', 'output', 'max_size')
+        if self._maxOutput is None:
+            self._maxOutput = DEFAULT_MAX_OUTPUT
+        self._maxRequest = config.getInt('daemon', 'connection',
+                                         'max_request_size')
+        if self._maxRequest is None:
+            self._maxRequest = DEFAULT_MAX_REQUEST
+        self._maxBacklog = config.getInt('daemon', 'connection',
+                                         'max_backlog')
+        if self._maxBacklog is None:
+            self._maxBacklog = DEFAULT_MAX_BACKLOG
+        self._inputSize = 0
+        # True if received data is dropped until the connection is closed
+        self._discarding = False
+        # A time of the last received or sent message
+        self._activity = time.time()
+        _handlers.add(self)
+
+    def recv(self, size):
+        '''
+        Receives a chunk of data from the socket.
+        '''
+        with timeline.span("recv", "handler"):
+            return server.Handler.recv(self, size)
+
+    def handle_read(self):
+        '''
+        Reads received data and closes the connection if a request is too
+        large. Data received with the request is not processed.
+        '''
+        server.Handler.handle_read(self)
+        if self._discarding:
+            self.handle_close()
+
+    def collect_incoming_data(self, data):
+        '''
+        Collects a chunk of received request data.
+
+        :param data: A chunk of request data
+        :type data: string
+        '''
+        if self._discarding:
+            return
+        self._input.append(data)
+        self._inputSize += len(data)
+        stats.count("received_bytes_total", value=len(data))
+        if self._maxRequest and self._inputSize > self._maxRequest:
+            log.warning("Request from %s exceeds %d bytes, closing connection"
+                        % (str(self.client), self._maxRequest))
+            stats.count("oversized_requests_total")
+            self._input = []
+            self._discarding = True
+
+    def found_terminator(self):
+        '''
+        Parses a complete request and schedules it for processing. Requests
+        of the connection are processed in arrival order, except for cancel
+        requests which are handled immediately.
+        '''
+        if self._discarding:
+            return
+        data = ''.join(self._input)
+        self._input = []
+        self._inputSize = 0
+        self._activity = time.time()
+        request, response = self.parseRequest(data)
+        if request is None and response is None:
+            return
+        if scheduler.isCancel(request):
+            self._cancel(request)
+            return
+        deadline = scheduler.Deadline(getattr(request, "deadline", None))
+        self._backlog.append((request, response, time.time(), deadline))
+        self._schedule()
+
+    def _cancel(self, request):
+        '''
+        Cancels a request of the connection given by the cancel request and
+        pushes a response of the cancel request.
+        '''
+        found = self.cancel(getattr(request, "requestId", None))
+        self._pushResponse(request, protocol.create(protocol.MSG_TYPE_RESPONSE,
+                                                    request.target,
+                                                    request.name,
+                                                    status=found))
+
+    def cancel(self, requestId):
+        '''
+        Cancels a request of the connection of the given id.
+
+        :param requestId: An id of a request to cancel
+        :type requestId: integer
+        :return: True if the request is found
+        :rtype: boolean
+        '''
+        found = False
+        entries = list(self._backlog)
+        if self._current is not None:
+            entries.append(self._current)
+        for entry in entries:
+            if (requestId is not None and
+                getattr(entry[0], "id", None) == requestId):
+                entry[-1].cancel()
+                found = True
+        if not found:
+            log.info("Request to cancel not found: %s" % requestId)
+        return found
+
+    def _schedule(self):
+        '''
+        Schedules the next request of the connection unless it is already
+        scheduled or a response is deferred.
+        '''
+        if (self._backlog and not self._scheduled and self._deferred is None
+            and self.connected):
+            self._scheduled = True
+            scheduler.scheduler.schedule(self)
+
+    def nextPriority(self):
+        '''
+        Returns a priority class of the next request of the connection.
+
+        :rtype: integer
+        '''
+        return scheduler.classify(self._backlog[0][0])
+
+    def runNext(self):
+        '''
+        Processes the next request of the connection and pushes its response
+        followed by the terminator.
+        '''
+        self._scheduled = False
+        request, response, arrived, deadline = self._backlog.popleft()
+        scheduler.recordWait(scheduler.classify(request), arrived)
+        if request is not None and deadline.expired():
+            # Expired or cancelled before processing
+            response = protocol.create(protocol.MSG_TYPE_RESPONSE,
+                                       request.target, request.name,
+                                       status=False, incomplete=True)
+        tracing.beginRequest()
+        profiling = profiler.active
+        if profiling:
+            profiler.begin()
+        try:
+            with timeline.span("request", "handler"):
+                self._processor.deadline = deadline
+                self._handleRequest(request, response, deadline)
+        finally:
+            self._processor.deadline = None
+            if profiling:
+                if self._deferred is not None:
+                    # Tasks of the request are profiled until it is done
+                    self._profiled = profiler.suspend()
+                else:
+                    profiler.end()
+            tracing.endRequest()
+            if timeline.enabled:
+                timeline.flush()
+        self._schedule()
+
+    def _handleRequest(self, request, response, deadline):
+        '''
+        Processes the given parsed request and pushes its response.
+        '''
+        if response is None:
+            response = self.processRequest(request)
+        if isinstance(response, loop.Deferred):
+            self._deferred = response
+            self._current = (request, deadline)
+            response.addCallback(self._onDeferredResponse, request)
+            return
+        self._pushResponse(request, response)
+
+    def _onDeferredResponse(self, response, request):
+        '''
+        Pushes the deferred response of the given request and schedules
+        requests received in the meantime.
+        '''
+        self._deferred = None
+        self._current = None
+        if self._profiled:
+            self._profiled = False
+            profiler.end()
+        if not self.connected:
+            return
+        self._pushResponse(request, response)
+        self._schedule()
+
+    def _pushResponse(self, request, response):
+        '''
+        Marshals and pushes the given response of the request.
+        '''
+        if response is None:
+            if request is None:
+                return
+            response = protocol.create(protocol.MSG_TYPE_RESPONSE,
+                                       request.target, request.name,
+                                       status=False)
+        with timeline.span("marshal", "handler"):
+            data = response.marshal()
+        with timeline.span("push", "handler", size=len(data)):
+            self.pushMessage(data)
+        self._activity = time.time()
+        if self._maxOutput and len(self._output) > self._maxOutput:
+            log.warning("Output to %s exceeds %d bytes, closing connection"
+                        % (str(self.client), self._maxOutput))
+            stats.count("output_overflows_total")
+            self.handle_close()
+
+    def idleSince(self):
+        '''
+        Returns a time since the connection is idle, i.e. it has not received
+        nor sent anything and has no requests in progress.
+
+        :rtype: float
+        '''
+        if (self._backlog or self._deferred is not None or self._output or
+            self._input):
+            return time.time()
+        return self._activity
+
+    def pushMessage(self, data):
+        '''
+        Pushes the given message data followed by the terminator.
+
+        :param data: Message data
+        :type data: string
+        '''
+        tracing.debug("handler", "Sending response:\n%s", data)
+        terminator = self.get_terminator()
+        self._output.append(data)
+        self._output.append(terminator)
+        stats.count("sent_bytes_total", value=len(data) + len(terminator))
+        self.initiate_send()
 
     def push(self, data):
         '''
-        Pushes the given response data to a corresponding client.
+        Pushes the given response data to a corresponding client. The data is
+        queued as is, without copying or splitting it.
 
         :param data: Response data
         :type data: string
         '''
-        log.debug("Sending response:\n%s", data)
-        server.Handler.push(self, data)
+        tracing.debug("handler", "Sending response:\n%s", data)
+        self._output.append(data)
+        stats.count("sent_bytes_total", value=len(data))
+        self.initiate_send()
+
+    def push_with_producer(self, producer):
+        '''
+        Pushes the given producer of response data to a corresponding client.
+        The producer is asked for data only while the connection is not
+        backed up.
+
+        :param producer: A producer of response data
+        :type producer: object
+        '''
+        self._output.appendProducer(producer)
+        self.initiate_send()
+
+    def initiate_send(self):
+        '''
+        Sends a chunk of queued output data.
+        '''
+        if not self.connected:
+            return
+        if not self._output:
+            # Handle requests queued by the base class, e.g. close_when_done()
+            if self.producer_fifo:
+                server.Handler.initiate_send(self)
+            return
+        try:
+            self._output.send(self.send)
+        except socket.error:
+            self.handle_error()
+
+    def discard_buffers(self):
+        '''
+        Discards all buffered input and output data.
+        '''
+        server.Handler.discard_buffers(self)
+        self._input = []
+        self._output.clear()
+
+    def readable(self):
+        '''
+        Stops reading requests while the output of the connection is backed
+        up or too many requests wait for processing, so a slow client cannot
+        make the queues grow without limit.
+        '''
+        return (not self._output.paused and
+                len(self._backlog) < self._maxBacklog and
+                server.Handler.readable(self))
+
+    def writable(self):
+        '''
+        Checks if there is any output data to send.
+        '''
+        return bool(self._output) or server.Handler.writable(self)
 
     def onRequest(self, data):
         '''
@@ -78,27 +476,62 @@ class DaemonHandler(server.Handler):
         :return: Processed request and generated response instances
         :rtype: tuple
         '''
-        log.debug("Handling request:\n%s", data)
-        request, response = server.Handler.onRequest(self, data)
+        request, response = self.parseRequest(data)
         if response is None:
+            response = self.processRequest(request)
+        return request, response
+
+    def parseRequest(self, data):
+        '''
+        Parses the received request data.
+
+        :param data: Request data
+        :type data: string
+        :return: A parsed request and an error response or None
+        :rtype: tuple
+        '''
+        tracing.debug("handler", "Handling request:\n%s", data)
+        with timeline.span("parse", "handler", size=len(data)):
+            return server.Handler.onRequest(self, data)
+
+    def processRequest(self, request):
+        '''
+        Processes the given parsed request and returns its response.
+
+        :param request: A request
+        :type request: tadek.connection.protocol.Message
+        :return: A response, a deferred response or None
+        :rtype: tadek.connection.protocol.Message
+        '''
+        response = None
+        if request is not None:
             try:
                 if request.type != protocol.MSG_TYPE_REQUEST:
+                    # Not counted by the processor
+                    stats.count("request_errors_total",
+                                stats.requestLabels(request))
                     raise protocol.UnsupportedMessageError(request.type,
                                                            request.target,
                                                            request.name,
                                                            *request.getParams())
-                response = self._processor(request)
+                response = singleflight.group(request, self._processor)
             except protocol.UnsupportedMessageError, err:
                 log.error(err)
             except:
                 log.exception("Request processing failure")
-        return request, response
+        return response
 
     def onClose(self):
         '''
         Function called when socket is closed.
         '''
         log.info("Closing connection with %s on %s." % (str(self.client), self))
+        _handlers.discard(self)
+        self._backlog.clear()
+        scheduler.scheduler.remove(self)
+        if self._current is not None:
+            # Abort the work for the closed connection
+            self._current[-1].abort()
 
     def onError(self, exception):
         '''
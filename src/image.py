@@ -0,0 +1,251 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import base64
+import hashlib
+from cStringIO import StringIO
+
+from tadek.core import log
+from tadek.core import config
+from tadek.core.accessible import Path
+from tadek.connection import protocol
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+import pool
+import stats
+import timeline
+import providers
+
+#: Supported image formats
+FORMATS = {
+    "png": "PNG",
+    "jpeg": "JPEG"
+}
+
+#: Default quality of JPEG images
+DEFAULT_QUALITY = 85
+
+
+def grabScreen(rect):
+    '''
+    Grabs the given region of the screen.
+
+    :param rect: A region as x, y, width and height
+    :type rect: tuple
+    :return: A pixbuf of the region or None
+    :rtype: gtk.gdk.Pixbuf
+    '''
+    try:
+        import gtk.gdk
+    except Exception:
+        log.warning("Screen grabbing requires PyGTK")
+        return None
+    root = gtk.gdk.get_default_root_window()
+    x, y, width, height = rect
+    pixbuf = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, False, 8, width, height)
+    return pixbuf.get_from_drawable(root, root.get_colormap(),
+                                    x, y, 0, 0, width, height)
+
+def pixels(image):
+    '''
+    Gets pixel data of the given image returned by an accessibility or
+    by the screen grabbing. It is called in the event loop, as images
+    of toolkits cannot be accessed from other threads.
+
+    :param image: A PIL image or a pixbuf
+    :type image: object
+    :return: A mode, a size, pixel data and a row stride
+    :rtype: tuple
+    '''
+    if hasattr(image, "get_pixels"):
+        mode = "RGBA" if image.get_has_alpha() else "RGB"
+        return (mode, (image.get_width(), image.get_height()),
+                image.get_pixels(), image.get_rowstride())
+    return (image.mode, image.size, image.tobytes(), 0)
+
+def encode(data, crop, scale, format, quality, previous):
+    '''
+    Crops, downscales and encodes the given pixel data. It is called in
+    a worker thread.
+
+    :param data: Pixel data returned by pixels()
+    :type data: tuple
+    :param crop: A region of the image as x, y, width and height or None
+    :type crop: tuple
+    :param scale: A scale factor of the image, up to 1.0
+    :type scale: float
+    :param format: A name of an image format
+    :type format: string
+    :param quality: A quality of JPEG images
+    :type quality: integer
+    :param previous: A content hash of a previous image or None
+    :type previous: string
+    :return: A status and response parameters
+    :rtype: tuple
+    '''
+    mode, size, raw, stride = data
+    image = Image.frombuffer(mode, size, raw, "raw", mode, stride, 1)
+    if crop is not None:
+        x, y, width, height = crop
+        image = image.crop((x, y, x + width, y + height))
+    if scale < 1.0:
+        width = max(int(image.size[0] * scale), 1)
+        height = max(int(image.size[1] * scale), 1)
+        image = image.resize((width, height), Image.BILINEAR)
+    digest = hashlib.sha1(image.mode + repr(image.size))
+    digest.update(image.tobytes())
+    digest = digest.hexdigest()
+    extras = {
+        "hash": digest,
+        "size": image.size,
+        "format": format
+    }
+    if digest == previous:
+        extras["unchanged"] = True
+        return True, extras
+    if format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buf = StringIO()
+    if format == "jpeg":
+        image.save(buf, FORMATS[format], quality=quality)
+    else:
+        image.save(buf, FORMATS[format])
+    extras["unchanged"] = False
+    extras["data"] = base64.b64encode(buf.getvalue())
+    return True, extras
+
+def capture(path=None, rect=None, format="png", scale=1.0,
+            quality=DEFAULT_QUALITY, previous=None):
+    '''
+    Captures an image of the accessible of the given path or of a region
+    of the screen. The image is encoded in a worker thread.
+
+    :param path: A path of an accessible or None for the screen
+    :type path: tadek.core.accessible.Path
+    :param rect: A region of the accessible or of the screen as x, y, width
+        and height
+    :type rect: tuple
+    :return: A status and response parameters or a deferred result
+    :rtype: tuple or loop.Deferred
+    '''
+    if Image is None:
+        log.warning("Image capturing requires PIL")
+        return False, {}
+    if format not in FORMATS:
+        log.warning("Unsupported image format: %s" % format)
+        return False, {}
+    if path is None:
+        if rect is None:
+            log.warning("Image capturing request without path and region")
+            return False, {}
+        with timeline.span("grabScreen", "image"):
+            image = grabScreen(rect)
+        rect = None
+    else:
+        a11y, obj = providers.accessible(path)
+        if obj is None:
+            log.info("Get image of requested path failure: %s" % path)
+            return False, {}
+        with timeline.span("getImage", "image"):
+            image = a11y.getImage(obj)
+    if image is None:
+        return False, {}
+    data = pixels(image)
+    stats.count("images_total", (("format", format),))
+    return pool.workers.submit(encode, data, rect, min(float(scale), 1.0),
+                               format, int(quality), previous)
+
+
+class ImageExtension(protocol.Extension):
+    '''
+    A protocol extension that captures images of accessibles or regions
+    of the screen.
+    '''
+    name = "image"
+    #: Requests for accessibles of backends are processed by worker processes
+    isolated = True
+
+    def request(self, path=None, rect=None, format="png", scale=1.0,
+                quality=DEFAULT_QUALITY, previous=None):
+        '''
+        Returns parameters of an image request.
+
+        :param path: A path of an accessible or None for the screen
+        :type path: tadek.core.accessible.Path
+        :param rect: A region of the accessible or of the screen as x, y,
+            width and height
+        :type rect: tuple
+        :param format: An image format, 'png' or 'jpeg'
+        :type format: string
+        :param scale: A scale factor of the image, up to 1.0
+        :type scale: float
+        :param quality: A quality of JPEG images
+        :type quality: integer
+        :param previous: A content hash of an image the client already has,
+            its data is not sent again if the image is unchanged
+        :type previous: string
+        '''
+        params = {"format": format, "scale": scale, "quality": quality}
+        for name, value in (("path", path), ("rect", rect),
+                            ("previous", previous)):
+            if value is not None:
+                params[name] = value
+        return params
+
+    def response(self, path=None, rect=None, format="png", scale=1.0,
+                 quality=DEFAULT_QUALITY, previous=None, **params):
+        '''
+        Returns a deferred image including its content hash, size and format.
+        Encoded image data is sent base64-encoded, as responses carry only
+        text.
+
+        :return: A status and response parameters or a deferred result
+        :rtype: tuple or loop.Deferred
+        '''
+        if path is not None and not hasattr(path, "tuple"):
+            path = Path(*path)
+        return capture(path, rect, format, scale, quality, previous)
+
+protocol.registerExtension(ImageExtension())
+
+stats.describe("images_total", "Number of captured images")
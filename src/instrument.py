@@ -0,0 +1,252 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import time
+import types
+import inspect
+import threading
+
+from tadek.core import log
+
+import accessibility
+from accessibility import IAccessibility
+
+import stats
+import tracing
+import timeline
+
+# Names of public methods of the accessibility interface
+METHODS = frozenset([name for name, attr in vars(IAccessibility).iteritems()
+                     if inspect.isfunction(attr) and not name.startswith('_')])
+
+# True if accessibility backends are instrumented
+enabled = False
+
+
+class Attribution(threading.local):
+    '''
+    An attribution of backend calls of the current thread to a request,
+    threads of the worker pool attribute their calls separately.
+    '''
+    # Labels of a request being processed
+    labels = ()
+    # Backend calls of a request being processed as {method: [count, time]}
+    calls = None
+
+_attribution = Attribution()
+
+def begin(labels):
+    '''
+    Begins attributing backend calls to a request of the given labels.
+
+    :param labels: Metric labels of a request
+    :type labels: tuple
+    '''
+    _attribution.labels = labels
+    _attribution.calls = {}
+
+def end():
+    '''
+    Ends attributing backend calls to the current request.
+
+    :return: Backend calls of the request as {method: [count, time]}
+    :rtype: dictionary
+    '''
+    calls = _attribution.calls
+    _attribution.labels = ()
+    _attribution.calls = None
+    return calls or {}
+
+def suspend():
+    '''
+    Suspends attributing backend calls to the current request, e.g. while
+    its deferred response is in progress.
+
+    :return: An attribution of the request to resume
+    :rtype: tuple
+    '''
+    attribution = (_attribution.labels, _attribution.calls)
+    _attribution.labels = ()
+    _attribution.calls = None
+    return attribution
+
+def resume(attribution):
+    '''
+    Resumes attributing backend calls to a request, e.g. while a task of
+    the request runs.
+
+    :param attribution: An attribution returned by suspend() or current()
+    :type attribution: tuple
+    :return: A suspended attribution of the current request
+    :rtype: tuple
+    '''
+    previous = suspend()
+    _attribution.labels, _attribution.calls = attribution
+    return previous
+
+def current():
+    '''
+    Returns an attribution of the current request.
+
+    :rtype: tuple
+    '''
+    return (_attribution.labels, _attribution.calls)
+
+def merge(attribution, calls):
+    '''
+    Adds the given backend calls recorded by another thread to calls of
+    the attribution. It has to be called in the thread of the loop.
+
+    :param attribution: An attribution of a request
+    :type attribution: tuple
+    :param calls: Backend calls as {method: [count, time]}
+    :type calls: dictionary
+    '''
+    total = attribution[1]
+    if total is None:
+        return
+    for method, (n, t) in calls.iteritems():
+        call = total.get(method)
+        if call is None:
+            total[method] = [n, t]
+        else:
+            call[0] += n
+            call[1] += t
+
+def _record(backend, method, start, duration):
+    '''
+    Records a backend call of the given method, start time and duration.
+    '''
+    if timeline.enabled:
+        timeline.complete(method, "backend", start, duration,
+                          {"backend": backend})
+    attribution = _attribution
+    labels = (("backend", backend), ("method", method)) + attribution.labels
+    stats.count("backend_calls_total", labels)
+    stats.observe("backend_call_duration_seconds", labels, duration)
+    stats.maximum("backend_call_max_seconds", labels, duration)
+    calls = attribution.calls
+    if calls is not None:
+        call = calls.get(method)
+        if call is None:
+            calls[method] = [1, duration]
+        else:
+            call[0] += 1
+            call[1] += duration
+
+def _timedGenerator(backend, method, generator, start, elapsed):
+    '''
+    Yields items of the given generator and records a single call of time
+    spent in all its steps.
+    '''
+    try:
+        while True:
+            begin = time.time()
+            try:
+                item = generator.next()
+            except StopIteration:
+                elapsed += time.time() - begin
+                return
+            elapsed += time.time() - begin
+            yield item
+    finally:
+        _record(backend, method, start, elapsed)
+
+
+class InstrumentedAccessibility(object):
+    '''
+    A proxy of an accessibility implementation that records call counts and
+    latencies of all methods of the accessibility interface.
+    '''
+    def __init__(self, a11y):
+        self._a11y = a11y
+
+    def __getattr__(self, name):
+        attr = getattr(self._a11y, name)
+        if name not in METHODS or not callable(attr):
+            return attr
+        backend = self._a11y.name
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except:
+                _record(backend, name, start, time.time() - start)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return _timedGenerator(backend, name, result, start,
+                                       time.time() - start)
+            _record(backend, name, start, time.time() - start)
+            return result
+        timed.__name__ = name
+        timed.__doc__ = attr.__doc__
+        # Cache the wrapper to skip __getattr__ on next calls
+        self.__dict__[name] = timed
+        return timed
+
+    def __repr__(self):
+        return "<InstrumentedAccessibility of %r>" % self._a11y
+
+
+def enable():
+    '''
+    Wraps all loaded accessibility implementations with instrumented proxies
+    unless they are already wrapped.
+    '''
+    global enabled
+    if enabled:
+        return
+    log.info("Instrumenting accessibility backends")
+    accessibility.wrap(InstrumentedAccessibility)
+    enabled = True
+
+def formatCalls(calls):
+    '''
+    Formats the given backend calls of a request for tracing.
+
+    :param calls: Backend calls as {method: [count, time]}
+    :type calls: dictionary
+    :rtype: string
+    '''
+    return ', '.join(["%s: %d calls in %.3f ms" % (method, n, t * 1000.0)
+                      for method, (n, t) in sorted(calls.iteritems(),
+                                                   key=lambda c: -c[1][1])])
+
+stats.describe("backend_calls_total", "Number of accessibility backend calls")
+stats.describe("backend_call_duration_seconds",
+               "Duration of accessibility backend calls")
+stats.describe("backend_call_max_seconds",
+               "Maximum duration of an accessibility backend call")
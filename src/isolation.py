@@ -0,0 +1,488 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import os
+import sys
+import time
+import socket
+import subprocess
+
+from tadek.core import log
+from tadek.core import config
+from tadek.connection import protocol
+from tadek.connection import server
+
+import loop
+import cache
+import stats
+import providers
+import scheduler
+import accessibility
+
+#: A script run in worker processes
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "worker.py")
+
+#: A file descriptor of the socket connected to the daemon in workers,
+#: the socket is their standard input
+WORKER_FD = 0
+
+#: Default time in milliseconds a worker with pending requests can send
+#: nothing, neither responses nor heartbeats, before it is restarted
+DEFAULT_TIMEOUT = 30000
+
+#: An interval in seconds of heartbeats sent by workers
+HEARTBEAT_INTERVAL = 1.0
+
+#: An id in response headers of heartbeats
+HEARTBEAT_ID = 0
+
+# True if accessibilities run in worker processes
+enabled = False
+
+# Worker processes as {accessibility index: worker}
+_workers = {}
+
+
+class RawResponse(object):
+    '''
+    A response received from a worker process in the marshalled form.
+    '''
+    def __init__(self, data):
+        self._data = data
+
+    def marshal(self):
+        '''
+        Returns marshalled data of the response.
+        '''
+        return self._data
+
+
+class WorkerChannel(server.Handler):
+    '''
+    A connection to a worker process. Requests of all client connections
+    are multiplexed over the connection and the worker processes them
+    concurrently. Each response is preceded by a header message with an id
+    of its request, a header with HEARTBEAT_ID alone is a heartbeat.
+    '''
+    def __init__(self, sock, worker):
+        server.Handler.__init__(self, sock, ("worker", worker.index))
+        self._worker = worker
+        self._input = []
+        self._lastId = 0
+        # An id of the request of the next received message or None if
+        # a header is expected
+        self._responseId = None
+        # Deferred responses as {id: [deferred, deadline]}
+        self.pending = {}
+        # A time of the last data received from the worker
+        self.activity = time.time()
+
+    def forward(self, request, deadline=None):
+        '''
+        Forwards the given request to the worker. The request is sent with
+        an id of the connection and a time left to the given deadline.
+
+        :param request: A request message
+        :type request: tadek.connection.protocol.Message
+        :param deadline: A deadline of the request or None
+        :type deadline: scheduler.Deadline
+        :return: A deferred response
+        :rtype: loop.Deferred
+        '''
+        params = {}
+        for name in request.getParams():
+            params[name] = getattr(request, name)
+        self._lastId += 1
+        params["id"] = self._lastId
+        if deadline is not None and deadline.time is not None:
+            params["deadline"] = max(int((deadline.time - time.time()) * 1000),
+                                     0)
+        request = protocol.create(request.type, request.target, request.name,
+                                  **params)
+        deferred = loop.Deferred()
+        self.pending[self._lastId] = [deferred, deadline]
+        self.push(request.marshal())
+        self.push(self.get_terminator())
+        return deferred
+
+    def cancel(self):
+        '''
+        Cancels requests in the worker those are cancelled or aborted
+        by clients.
+        '''
+        for id, entry in self.pending.iteritems():
+            deadline = entry[1]
+            if deadline is not None and deadline.reached:
+                entry[1] = None
+                request = protocol.create(protocol.MSG_TYPE_REQUEST,
+                                          protocol.MSG_TARGET_EXTENSION,
+                                          scheduler.CancelExtension.name,
+                                          requestId=id)
+                self.push(request.marshal())
+                self.push(self.get_terminator())
+
+    def collect_incoming_data(self, data):
+        self._input.append(data)
+        self.activity = time.time()
+
+    def found_terminator(self):
+        data = ''.join(self._input)
+        self._input = []
+        self.activity = time.time()
+        if self._responseId is None:
+            try:
+                id = int(data)
+            except ValueError:
+                log.warning("Invalid response header of worker %d: %r"
+                            % (self._worker.index, data[:32]))
+                return
+            if id != HEARTBEAT_ID:
+                self._responseId = id
+            return
+        id, self._responseId = self._responseId, None
+        entry = self.pending.pop(id, None)
+        if entry is None:
+            log.warning("Unexpected response of worker %d" % self._worker.index)
+            return
+        entry[0].callback(RawResponse(data))
+
+    def fail(self):
+        '''
+        Fails all pending requests.
+        '''
+        pending = self.pending.values()
+        self.pending.clear()
+        for entry in pending:
+            entry[0].callback(None)
+
+    def handle_close(self):
+        log.warning("Worker %d closed its connection" % self._worker.index)
+        self.close()
+        self.fail()
+
+    def onRequest(self, data):
+        return None, None
+
+    def onClose(self):
+        pass
+
+    def onError(self, exception):
+        log.exception(exception)
+
+
+class Worker(object):
+    '''
+    A worker process that runs an accessibility of the given index.
+    '''
+    def __init__(self, index, name, conf=None):
+        self.index = index
+        self.name = name
+        self.conf = conf
+        self.process = None
+        self.channel = None
+
+    def start(self):
+        '''
+        Starts the worker process connected with a socket pair.
+        '''
+        parent, child = socket.socketpair()
+        args = [sys.executable, WORKER_SCRIPT, str(self.index), self.name,
+                str(WORKER_FD)]
+        if self.conf:
+            args.append(self.conf)
+        # Sockets of the daemon are not inherited by the worker
+        self.process = subprocess.Popen(args, stdin=child.fileno(),
+                                        close_fds=True)
+        child.close()
+        self.channel = WorkerChannel(parent, self)
+        log.info("Started worker %d (%s), pid %d"
+                 % (self.index, self.name, self.process.pid))
+
+    def stop(self):
+        '''
+        Kills the worker process and fails its pending requests.
+        '''
+        if self.channel is not None:
+            self.channel.close()
+            self.channel.fail()
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.channel = None
+
+    def forward(self, request, deadline=None):
+        '''
+        Forwards the given request to the worker process, it is restarted if
+        it is not running.
+
+        :param request: A request message
+        :type request: tadek.connection.protocol.Message
+        :param deadline: A deadline of the request or None
+        :type deadline: scheduler.Deadline
+        :return: A deferred response
+        :rtype: loop.Deferred
+        '''
+        if self.channel is None or not self.channel.connected:
+            self.stop()
+            self.start()
+        stats.count("worker_requests_total", (("worker", self.name),))
+        return self.channel.forward(request, deadline)
+
+    def check(self, timeout):
+        '''
+        Restarts the worker if it has pending requests and it has sent
+        nothing, not even a heartbeat, for the given time, e.g. if its
+        accessibility hung. Long requests of a responsive worker are limited
+        only by their deadlines.
+        '''
+        channel = self.channel
+        if (channel is not None and channel.pending and
+            channel.activity + timeout < time.time()):
+            log.error("Worker %d (%s) is not responding, restarting it"
+                      % (self.index, self.name))
+            stats.count("worker_restarts_total", (("worker", self.name),))
+            self.stop()
+            self.start()
+
+
+def _index(path):
+    '''
+    Returns an index of the accessibility of the given path or None if it is
+    the root.
+    '''
+    path = getattr(path, "tuple", path)
+    if not path:
+        return None
+    return path[0]
+
+def routes(request):
+    '''
+    Checks if the given request is processed by a worker process, i.e.
+    it is an accessibility request or a request of an isolated extension
+    for an accessible of a backend.
+
+    :param request: A request message
+    :type request: tadek.connection.protocol.Message
+    :rtype: boolean
+    '''
+    if not enabled:
+        return False
+    if request.target == protocol.MSG_TARGET_EXTENSION:
+        try:
+            extension = protocol.getExtension(request.name)
+        except:
+            return False
+        if not getattr(extension, "isolated", False):
+            return False
+    elif request.target != protocol.MSG_TARGET_ACCESSIBILITY:
+        return False
+    return _index(getattr(request, "path", None)) in _workers
+
+def indexes():
+    '''
+    Returns indexes of accessibilities run in worker processes.
+
+    :rtype: list
+    '''
+    return sorted(_workers)
+
+def forward(request, deadline=None, index=None):
+    '''
+    Forwards the given request to a worker process of the accessibility
+    of the given index or given by the first element of its path.
+    A cancellation of the request is forwarded to the worker.
+
+    :param request: A request message
+    :type request: tadek.connection.protocol.Message
+    :param deadline: A deadline of the request or None
+    :type deadline: scheduler.Deadline
+    :param index: An index of an accessibility or None
+    :type index: integer
+    :return: A deferred response
+    :rtype: loop.Deferred
+    '''
+    if index is None:
+        index = _index(request.path)
+    return _workers[index].forward(request, deadline)
+
+def _cancel():
+    '''
+    Forwards cancellations of requests to worker processes.
+    '''
+    for worker in _workers.itervalues():
+        if worker.channel is not None and worker.channel.connected:
+            worker.channel.cancel()
+    return False
+
+def _check(timeout, timer):
+    '''
+    Checks all worker processes.
+    '''
+    for worker in _workers.itervalues():
+        worker.check(timeout)
+
+def start(conf=None):
+    '''
+    Starts worker processes of all accessibilities. Accessibility requests
+    for accessibles of a backend are processed by its worker from then on.
+
+    :param conf: A path to a daemon configuration file used by workers
+    :type conf: string
+    '''
+    global enabled
+    for index, a11y in enumerate(accessibility.all()):
+        worker = Worker(index, a11y.name, conf)
+        worker.start()
+        _workers[index] = worker
+    timeout = config.getInt('daemon', 'isolation', 'timeout')
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    loop.callEvery(1.0, _check, timeout / 1000.0)
+    loop.addTask(_cancel)
+    enabled = True
+
+def stop():
+    '''
+    Stops all worker processes.
+    '''
+    global enabled
+    enabled = False
+    for worker in _workers.itervalues():
+        worker.stop()
+    _workers.clear()
+
+def serve(index, name, fd, conf=None):
+    '''
+    Serves requests of the daemon in a worker process.
+
+    :param index: An index of the served accessibility
+    :type index: integer
+    :param name: A name of the served accessibility
+    :type name: string
+    :param fd: A file descriptor of a socket connected to the daemon
+    :type fd: integer
+    :param conf: A path to a daemon configuration file
+    :type conf: string
+    '''
+    import daemon
+    import handler
+    if conf:
+        config.update('daemon', conf)
+    a11ies = accessibility.all()
+    if index >= len(a11ies) or a11ies[index].name != name:
+        log.error("Accessibility %d of worker is not %s" % (index, name))
+        sys.exit(1)
+    daemon.configure()
+    if config.getBool('daemon', 'cache', 'enabled'):
+        cache.enable()
+    sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(fd)
+    # Other accessibilities are not children of the root in the worker
+    providers.served = index
+
+    class WorkerHandler(handler.DaemonHandler):
+        def __init__(self, sock, client):
+            handler.DaemonHandler.__init__(self, sock, client)
+            # Deadlines of requests with deferred responses as {id: deadline}
+            self._running = {}
+            self._heartbeat = loop.callEvery(HEARTBEAT_INTERVAL, self._beat)
+
+        def _beat(self, timer):
+            # Heartbeats tell the daemon the worker is not hung while
+            # its requests are in progress
+            if self.connected:
+                self.pushMessage(str(HEARTBEAT_ID))
+
+        def idleSince(self):
+            # The connection to the daemon is never idle
+            return time.time()
+
+        def _schedule(self):
+            # Requests of the daemon are processed concurrently, next ones
+            # are not held by deferred responses
+            if self._backlog and not self._scheduled and self.connected:
+                self._scheduled = True
+                scheduler.scheduler.schedule(self)
+
+        def _handleRequest(self, request, response, deadline):
+            if response is None:
+                response = self.processRequest(request)
+            if isinstance(response, loop.Deferred):
+                self._running[getattr(request, "id", None)] = deadline
+                response.addCallback(self._onDeferredResponse, request)
+                return
+            self._pushResponse(request, response)
+
+        def _onDeferredResponse(self, response, request):
+            self._running.pop(getattr(request, "id", None), None)
+            if self.connected:
+                self._pushResponse(request, response)
+
+        def _pushResponse(self, request, response):
+            if request is None and response is None:
+                return
+            # A header with an id of the request precedes its response
+            self.pushMessage(str(getattr(request, "id", None) or -1))
+            handler.DaemonHandler._pushResponse(self, request, response)
+
+        def cancel(self, requestId):
+            deadline = self._running.get(requestId)
+            if deadline is None:
+                return handler.DaemonHandler.cancel(self, requestId)
+            deadline.cancel()
+            return True
+
+        def _cancel(self, request):
+            # Cancel requests of the daemon are not responded
+            self.cancel(getattr(request, "requestId", None))
+
+        def onClose(self):
+            handler.DaemonHandler.onClose(self)
+            self._heartbeat.cancel()
+            for deadline in self._running.itervalues():
+                deadline.abort()
+            raise SystemExit(0)
+
+    WorkerHandler(sock, ("daemon", index))
+    log.info("Worker %d (%s) is running" % (index, name))
+    loop.run()
+
+stats.describe("worker_requests_total",
+               "Number of requests forwarded to worker processes")
+stats.describe("worker_restarts_total",
+               "Number of restarts of not responding worker processes")
@@ -0,0 +1,572 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import os
+import time
+import errno
+import fcntl
+import heapq
+import select
+import asyncore
+import itertools
+from collections import deque
+
+from tadek.core import log
+from tadek.core import config
+
+#: Default maximum time in seconds of waiting for socket events
+DEFAULT_TIMEOUT = 30.0
+
+#: Names of available cores of waiting for socket events
+POLLERS = ("select", "poll", "epoll")
+#: A default core of waiting for socket events
+DEFAULT_POLLER = "select"
+
+# The epoll flag of a peer closing its side of a connection
+EPOLLRDHUP = getattr(select, "EPOLLRDHUP", 0x2000)
+
+# Scheduled timers as a heap of (time, sequence, timer)
+_timers = []
+# A sequence of timers used to keep order of timers of the same time
+_sequence = itertools.count()
+
+# Functions called on every iteration of the loop
+_tasks = []
+# True if any task has more work to do
+_busy = False
+# A waker of the loop or None if functions cannot be called from threads
+_waker = None
+# A name of the core of waiting for socket events
+_pollerName = DEFAULT_POLLER
+# An epoll poller or None if asyncore waits for socket events
+_poller = None
+
+#: A time of the last iteration of the loop
+heartbeat = time.time()
+#: A number of iterations of the loop
+iterations = 0
+
+
+class Timer(object):
+    '''
+    A timer that calls a function at the given time, optionally repeated
+    at the given interval.
+    '''
+    __slots__ = ("when", "interval", "function", "args", "cancelled")
+
+    def __init__(self, when, interval, function, args):
+        self.when = when
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        Cancels the timer.
+        '''
+        self.cancelled = True
+
+
+def _schedule(timer):
+    '''
+    Adds the given timer to the heap of scheduled timers.
+    '''
+    heapq.heappush(_timers, (timer.when, _sequence.next(), timer))
+    return timer
+
+def callLater(delay, function, *args):
+    '''
+    Calls the given function with arguments after the delay in seconds.
+
+    :param delay: A delay in seconds
+    :type delay: float
+    :param function: A function to call
+    :type function: callable
+    :return: A timer that can be cancelled
+    :rtype: Timer
+    '''
+    return _schedule(Timer(time.time() + delay, None, function, args))
+
+def callEvery(interval, function, *args):
+    '''
+    Calls the given function with arguments repeatedly at the interval
+    in seconds. The timer is passed to the function as the last argument,
+    so it can check its scheduled time or cancel itself.
+
+    :param interval: An interval in seconds
+    :type interval: float
+    :param function: A function to call
+    :type function: callable
+    :return: A timer that can be cancelled
+    :rtype: Timer
+    '''
+    return _schedule(Timer(time.time() + interval, interval, function, args))
+
+class Deferred(object):
+    '''
+    A result of an operation that is completed later in the event loop.
+    Callbacks are called with the result as the first argument.
+    '''
+    def __init__(self):
+        self.called = False
+        self.result = None
+        self._callbacks = []
+
+    def addCallback(self, function, *args):
+        '''
+        Adds a function called with the result and the given arguments.
+        If the result is already available then the function is called
+        immediately.
+
+        :param function: A function to call
+        :type function: callable
+        '''
+        if self.called:
+            self._call(function, args)
+        else:
+            self._callbacks.append((function, args))
+
+    def callback(self, result):
+        '''
+        Sets the result of the operation and calls all added functions.
+
+        :param result: A result of the operation
+        :type result: object
+        '''
+        self.called = True
+        self.result = result
+        callbacks, self._callbacks = self._callbacks, []
+        for function, args in callbacks:
+            self._call(function, args)
+
+    def chain(self, function, *args):
+        '''
+        Returns a deferred result of the given function called with
+        the result and the given arguments. If the function fails then
+        the result is None.
+
+        :param function: A function to call
+        :type function: callable
+        :rtype: Deferred
+        '''
+        deferred = Deferred()
+        def call(result):
+            try:
+                result = function(result, *args)
+            except:
+                log.exception("Deferred function failure: %r" % function)
+                result = None
+            deferred.callback(result)
+        self.addCallback(call)
+        return deferred
+
+    def _call(self, function, args):
+        '''
+        Calls the given function with the result.
+        '''
+        try:
+            function(self.result, *args)
+        except:
+            log.exception("Deferred callback failure: %r" % function)
+
+def gather(deferreds):
+    '''
+    Returns a deferred list of results of the given deferreds in their order.
+    The list is available when all the results are available.
+
+    :param deferreds: A list of deferred results
+    :type deferreds: list
+    :rtype: Deferred
+    '''
+    deferred = Deferred()
+    results = [None] * len(deferreds)
+    remaining = [len(deferreds)]
+    def collect(result, index):
+        results[index] = result
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            deferred.callback(results)
+    if not deferreds:
+        deferred.callback(results)
+    for index, item in enumerate(deferreds):
+        item.addCallback(collect, index)
+    return deferred
+
+
+class EpollPoller(object):
+    '''
+    A core of waiting for socket events based on edge-triggered epoll.
+    Unlike select and poll, the cost of waiting does not depend on the number
+    of idle sockets. Dispatchers are registered when they are added to
+    the socket map and unregistered when they are removed from it. Their
+    event mask does not depend on readable() and writable(), those are
+    checked only for sockets with events. Events of a socket are kept until
+    its dispatcher is ready to handle them, e.g. a paused connection, so no
+    edge is lost. A handled socket is re-armed, so remaining data or buffer
+    space produce a new event in the next iteration.
+    '''
+    #: An epoll event mask of all sockets
+    MASK = (select.EPOLLIN | select.EPOLLOUT | select.EPOLLPRI | EPOLLRDHUP |
+            select.EPOLLET)
+
+    def __init__(self, map):
+        '''
+        Initializes a poller and registers dispatchers of the given map.
+
+        :param map: A map of dispatchers
+        :type map: dictionary
+        '''
+        self._epoll = select.epoll()
+        # Not handled events as {file descriptor: flags}
+        self._ready = {}
+        for fd in map:
+            self.register(fd)
+
+    def close(self):
+        '''
+        Closes the epoll object.
+        '''
+        self._epoll.close()
+        self._ready.clear()
+
+    def register(self, fd):
+        '''
+        Registers a dispatcher of the given file descriptor.
+        '''
+        self._ready.pop(fd, None)
+        try:
+            self._epoll.register(fd, self.MASK)
+        except (IOError, OSError), err:
+            if err.errno != errno.EEXIST:
+                raise
+            # A reused file descriptor of a closed socket
+            self._epoll.modify(fd, self.MASK)
+
+    def unregister(self, fd):
+        '''
+        Unregisters a dispatcher of the given file descriptor.
+        '''
+        self._ready.pop(fd, None)
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, OSError, ValueError):
+            # Closed file descriptors are unregistered by the kernel
+            pass
+
+    def _rearm(self, fd):
+        '''
+        Re-arms a socket of the given file descriptor, so it is reported
+        again if it is still ready.
+        '''
+        try:
+            self._epoll.modify(fd, self.MASK)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _pending(self, map):
+        '''
+        Checks if any kept event can be handled now.
+        '''
+        for fd, flags in self._ready.iteritems():
+            obj = map.get(fd)
+            if obj is not None and flags & select.EPOLLIN and obj.readable():
+                return True
+        return False
+
+    def poll(self, timeout, map):
+        '''
+        Waits for socket events for the given time at most and handles them.
+
+        :param timeout: A maximum time in seconds of waiting
+        :type timeout: float
+        :param map: A map of dispatchers
+        :type map: dictionary
+        '''
+        if self._pending(map):
+            timeout = 0.0
+        try:
+            events = self._epoll.poll(timeout)
+        except (IOError, OSError), err:
+            if err.errno != errno.EINTR:
+                raise
+            events = []
+        ready = self._ready
+        for fd, flags in events:
+            if flags & EPOLLRDHUP:
+                # Read the end of the stream
+                flags |= select.EPOLLIN
+            ready[fd] = ready.get(fd, 0) | flags
+        for fd in ready.keys():
+            flags = ready.pop(fd)
+            obj = map.get(fd)
+            if obj is None:
+                continue
+            kept = 0
+            handled = flags & (select.EPOLLPRI | select.EPOLLERR |
+                               select.EPOLLHUP)
+            if flags & select.EPOLLIN:
+                if obj.readable():
+                    handled |= select.EPOLLIN
+                else:
+                    kept = select.EPOLLIN
+            if flags & select.EPOLLOUT and obj.writable():
+                handled |= select.EPOLLOUT
+            if handled:
+                asyncore.readwrite(obj, handled)
+            if map.get(fd) is not obj:
+                continue
+            if kept:
+                if obj.readable():
+                    # Resumed while handling other events
+                    asyncore.readwrite(obj, kept)
+                    handled |= kept
+                else:
+                    ready[fd] = kept
+            if handled and map.get(fd) is obj:
+                self._rearm(fd)
+
+def setPoller(name):
+    '''
+    Sets a core of waiting for socket events: select, poll or epoll.
+    If epoll is not available then select is used.
+
+    :param name: A name of the core
+    :type name: string
+    '''
+    global _pollerName, _poller
+    if name not in POLLERS:
+        log.warning("Unknown poller %s, using %s" % (name, DEFAULT_POLLER))
+        name = DEFAULT_POLLER
+    if name == "epoll" and not hasattr(select, "epoll"):
+        log.warning("Epoll is not available, using %s" % DEFAULT_POLLER)
+        name = DEFAULT_POLLER
+    if name == _pollerName:
+        return
+    if _poller is not None:
+        _poller.close()
+        _poller = None
+    if name == "epoll":
+        _poller = EpollPoller(asyncore.socket_map)
+    _pollerName = name
+    log.info("Waiting for socket events using %s" % name)
+
+_addChannel = asyncore.dispatcher.add_channel
+_delChannel = asyncore.dispatcher.del_channel
+
+def addChannel(self, map=None):
+    '''
+    Adds a dispatcher to the map and registers it in the epoll poller if it
+    is the socket map. It replaces asyncore.dispatcher.add_channel().
+    '''
+    if map is None:
+        map = self._map
+    _addChannel(self, map)
+    if _poller is not None and map is asyncore.socket_map:
+        _poller.register(self._fileno)
+
+def delChannel(self, map=None):
+    '''
+    Removes a dispatcher from the map and unregisters it from the epoll
+    poller if it is the socket map. It replaces
+    asyncore.dispatcher.del_channel().
+    '''
+    if map is None:
+        map = self._map
+    fd = self._fileno
+    registered = fd is not None and map.get(fd) is self
+    _delChannel(self, map)
+    if _poller is not None and registered and map is asyncore.socket_map:
+        _poller.unregister(fd)
+
+asyncore.dispatcher.add_channel = addChannel
+asyncore.dispatcher.del_channel = delChannel
+
+def configure():
+    '''
+    Applies settings of the [loop] section of the daemon configuration.
+    '''
+    setPoller(config.get('daemon', 'loop', 'poller') or DEFAULT_POLLER)
+
+
+class Waker(asyncore.file_dispatcher):
+    '''
+    A pipe that wakes the loop up to call functions passed from other
+    threads.
+    '''
+    def __init__(self):
+        rfd, wfd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, rfd)
+        os.close(rfd)
+        flags = fcntl.fcntl(wfd, fcntl.F_GETFL)
+        fcntl.fcntl(wfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._wfd = wfd
+        self._calls = deque()
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except (OSError, IOError):
+            pass
+        while self._calls:
+            function, args = self._calls.popleft()
+            try:
+                function(*args)
+            except:
+                log.exception("Function called from thread failure: %r"
+                              % function)
+
+    def wake(self, function, args):
+        '''
+        Queues the given function and wakes the loop up.
+        '''
+        self._calls.append((function, args))
+        try:
+            os.write(self._wfd, "x")
+        except OSError:
+            # The pipe is full, so the loop is going to wake up anyway
+            pass
+
+def enableWakeups():
+    '''
+    Enables calling functions from other threads. It has to be called in
+    the thread of the loop.
+    '''
+    global _waker
+    if _waker is None:
+        _waker = Waker()
+
+def callFromThread(function, *args):
+    '''
+    Calls the given function with arguments in the thread of the loop.
+    It can be called from any thread once wakeups are enabled.
+
+    :param function: A function to call
+    :type function: callable
+    '''
+    _waker.wake(function, args)
+
+def addTask(function):
+    '''
+    Adds a function called on every iteration of the loop. The function
+    returns True if it has more work to do, then the loop does not wait for
+    socket events in the next iteration.
+
+    :param function: A function to call
+    :type function: callable
+    '''
+    _tasks.append(function)
+
+def runTasks():
+    '''
+    Calls all task functions.
+    '''
+    global _busy
+    _busy = False
+    for function in _tasks:
+        try:
+            if function():
+                _busy = True
+        except:
+            log.exception("Task function failure: %r" % function)
+
+def runTimers():
+    '''
+    Calls functions of all expired timers.
+    '''
+    now = time.time()
+    while _timers and _timers[0][0] <= now:
+        timer = heapq.heappop(_timers)[2]
+        if timer.cancelled:
+            continue
+        try:
+            if timer.interval is None:
+                timer.function(*timer.args)
+            else:
+                timer.function(*(timer.args + (timer,)))
+        except:
+            log.exception("Timer function failure: %r" % timer.function)
+        if timer.interval is not None and not timer.cancelled:
+            timer.when = max(timer.when + timer.interval, now)
+            _schedule(timer)
+
+def timeout(default=DEFAULT_TIMEOUT):
+    '''
+    Returns time in seconds until the nearest timer expires.
+
+    :param default: A time returned if there are no timers
+    :type default: float
+    :rtype: float
+    '''
+    while _timers and _timers[0][2].cancelled:
+        heapq.heappop(_timers)
+    if not _timers:
+        return default
+    return min(max(_timers[0][0] - time.time(), 0.0), default)
+
+def iterate(wait=DEFAULT_TIMEOUT):
+    '''
+    Runs one iteration of the loop: waits for socket events for the given
+    time at most, handles them and calls functions of expired timers and
+    of tasks.
+
+    :param wait: A maximum time of waiting for socket events
+    :type wait: float
+    '''
+    global heartbeat, iterations
+    if _busy:
+        wait = 0.0
+    if _poller is not None:
+        _poller.poll(timeout(wait), asyncore.socket_map)
+    else:
+        asyncore.loop(timeout(wait), use_poll=(_pollerName == "poll"),
+                      count=1)
+    heartbeat = time.time()
+    iterations += 1
+    runTimers()
+    runTasks()
+
+def run():
+    '''
+    Runs the loop while there are any open sockets.
+    '''
+    global heartbeat
+    heartbeat = time.time()
+    while asyncore.socket_map:
+        iterate()
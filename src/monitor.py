@@ -0,0 +1,202 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import sys
+import time
+import thread
+import threading
+import traceback
+
+from tadek.core import log
+from tadek.core import config
+
+import loop
+import stats
+import tracing
+import instrument
+
+#: Default interval in milliseconds of the loop lag probe
+DEFAULT_LAG_INTERVAL = 1000
+#: Default loop lag in milliseconds that is logged as a warning
+DEFAULT_LAG_WARNING = 200
+#: Default duration in milliseconds of requests logged as slow
+DEFAULT_SLOW_REQUEST = 1000
+#: Default time in seconds of a loop stall that dumps thread stacks
+DEFAULT_WATCHDOG = 10
+
+# A loop lag in seconds logged as a warning
+_lagWarning = DEFAULT_LAG_WARNING / 1000.0
+# A duration in seconds of requests logged as slow, 0 means disabled
+_slowRequest = DEFAULT_SLOW_REQUEST / 1000.0
+# A timer of the loop lag probe or None
+_probe = None
+# A watchdog thread or None
+_watchdog = None
+
+def _getInt(option, default):
+    '''
+    Gets an integer option of the [monitor] section.
+    '''
+    value = config.getInt('daemon', 'monitor', option)
+    if value is None:
+        return default
+    return value
+
+def _probeLag(timer):
+    '''
+    Measures a delay between the scheduled and the actual time of calling
+    the probe timer.
+    '''
+    lag = max(time.time() - timer.when, 0.0)
+    stats.observe("loop_lag_seconds", (), lag)
+    stats.maximum("loop_lag_max_seconds", (), lag)
+    if _lagWarning and lag >= _lagWarning:
+        log.warning("Event loop lagged by %.3f s" % lag)
+
+def requestSummary(request):
+    '''
+    Returns a short summary of the given request.
+
+    :param request: A request message
+    :type request: tadek.connection.protocol.Message
+    :rtype: string
+    '''
+    params = []
+    for name in request.getParams():
+        value = getattr(request, name, None)
+        params.append("%s=%s" % (name, tracing.truncate(str(value))))
+    return "%s %s (%s)" % (request.target, request.name, ', '.join(params))
+
+def checkRequest(request, duration, calls):
+    '''
+    Logs the given request if it was processed longer than the threshold of
+    slow requests.
+
+    :param request: A processed request
+    :type request: tadek.connection.protocol.Message
+    :param duration: A duration of processing in seconds
+    :type duration: float
+    :param calls: Backend calls of the request as {method: [count, time]}
+    :type calls: dictionary
+    '''
+    if not _slowRequest or duration < _slowRequest:
+        return
+    stats.count("slow_requests_total", stats.requestLabels(request))
+    msg = "Slow request processed in %.3f s: %s" % (duration,
+                                                    requestSummary(request))
+    if calls:
+        msg = "%s\nBackend calls: %s" % (msg, instrument.formatCalls(calls))
+    log.warning(msg)
+
+
+class Watchdog(threading.Thread):
+    '''
+    A thread that dumps stacks of all threads when the event loop stalls
+    longer than the given time.
+    '''
+    def __init__(self, stall):
+        threading.Thread.__init__(self, name="watchdog")
+        self.setDaemon(True)
+        self._stall = stall
+        self._stopped = threading.Event()
+
+    def stop(self):
+        '''
+        Stops the watchdog thread.
+        '''
+        self._stopped.set()
+
+    def run(self):
+        dumped = None
+        while not self._stopped.isSet():
+            self._stopped.wait(min(self._stall / 2.0, 1.0))
+            heartbeat = loop.heartbeat
+            if time.time() - heartbeat < self._stall or dumped == heartbeat:
+                continue
+            # Dump stacks only once per stall
+            dumped = heartbeat
+            stats.count("loop_stalls_total")
+            log.error("Event loop stalled for %.1f s, stacks of threads:\n%s"
+                      % (time.time() - heartbeat, dumpStacks()))
+
+
+def dumpStacks():
+    '''
+    Returns formatted stacks of all threads.
+
+    :rtype: string
+    '''
+    names = dict([(t.ident, t.name) for t in threading.enumerate()])
+    current = thread.get_ident()
+    lines = []
+    for ident, frame in sys._current_frames().iteritems():
+        if ident == current:
+            continue
+        lines.append("Thread %s (%d):\n" % (names.get(ident, "unknown"),
+                                            ident))
+        lines.extend(traceback.format_stack(frame))
+    return ''.join(lines)
+
+def start():
+    '''
+    Starts the loop lag probe and the watchdog configured in the [monitor]
+    section of the daemon configuration.
+    '''
+    global _lagWarning, _slowRequest, _probe, _watchdog
+    _lagWarning = _getInt('lag_warning', DEFAULT_LAG_WARNING) / 1000.0
+    _slowRequest = _getInt('slow_request', DEFAULT_SLOW_REQUEST) / 1000.0
+    if _probe is not None:
+        _probe.cancel()
+        _probe = None
+    interval = _getInt('lag_interval', DEFAULT_LAG_INTERVAL)
+    stall = _getInt('watchdog', DEFAULT_WATCHDOG)
+    if interval <= 0 and stall > 0:
+        # The watchdog needs the loop to wake up regularly
+        interval = stall * 500
+    if interval > 0:
+        _probe = loop.callEvery(interval / 1000.0, _probeLag)
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
+    if stall > 0:
+        _watchdog = Watchdog(stall)
+        _watchdog.start()
+
+stats.describe("loop_lag_seconds", "Scheduling delay of the event loop")
+stats.describe("loop_lag_max_seconds",
+               "Maximum scheduling delay of the event loop")
+stats.describe("loop_stalls_total", "Number of detected event loop stalls")
+stats.describe("slow_requests_total", "Number of slow requests")
@@ -0,0 +1,205 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+from itertools import islice
+from collections import deque
+
+#: A size of the largest chunk of data passed to a single send call
+SEND_SIZE = 65536
+#: Buffers smaller than this size are coalesced before sending
+COALESCE_SIZE = 4096
+
+class OutputQueue(object):
+    '''
+    A queue of outgoing data buffers of a connection.
+
+    Queued strings are never joined or sliced. They are sent using memory
+    views, so large payloads are passed to the socket without copying them.
+    Only small adjacent buffers (e.g. a short response and its terminator) are
+    coalesced, to avoid a separate send call for each of them.
+
+    Buffers and producers are sent in the order they are appended, a buffer
+    appended after a producer waits until the producer is exhausted.
+
+    The queue implements flow control by means of high and low water marks.
+    It gets paused when the size of queued data exceeds the high water mark
+    and gets resumed when the size drops to the low water mark. Producers
+    are not asked for more data while the queue is paused.
+    '''
+    def __init__(self, highWater, lowWater):
+        '''
+        Initializes an output queue.
+
+        :param highWater: A size of queued data that pauses the queue
+        :type highWater: integer
+        :param lowWater: A size of queued data that resumes the queue
+        :type lowWater: integer
+        '''
+        self.highWater = highWater
+        self.lowWater = min(lowWater, highWater)
+        self.paused = False
+        self.size = 0
+        # Buffers ready to send
+        self._buffers = deque()
+        # Producers and buffers appended after them
+        self._producers = deque()
+        self._offset = 0
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        return bool(self._buffers or self._producers)
+
+    def append(self, data):
+        '''
+        Appends the given data buffer to the queue.
+
+        :param data: Data to send
+        :type data: string
+        '''
+        if not data:
+            return
+        if self._producers:
+            # Sent when the queued producers are exhausted
+            self._producers.append(data)
+        else:
+            self._buffers.append(data)
+        self.size += len(data)
+        if self.size > self.highWater:
+            self.paused = True
+
+    def appendProducer(self, producer):
+        '''
+        Appends the given producer to the queue. A producer has to provide
+        the more() method that returns a next chunk of data or an empty
+        string if it is exhausted.
+
+        :param producer: A producer of data to send
+        :type producer: object
+        '''
+        self._producers.append(producer)
+        self._produce()
+
+    def clear(self):
+        '''
+        Discards all queued buffers and producers.
+        '''
+        self._buffers.clear()
+        self._producers.clear()
+        self._offset = 0
+        self.size = 0
+        self.paused = False
+
+    def send(self, send):
+        '''
+        Sends a chunk of queued data using the given send function.
+
+        :param send: A function that sends data and returns a number of sent
+            bytes
+        :type send: callable
+        :return: A number of sent bytes
+        :rtype: integer
+        '''
+        if not self._buffers:
+            self._produce()
+            if not self._buffers:
+                return 0
+        first = self._buffers[0]
+        if (len(self._buffers) > 1 and
+            len(first) - self._offset < COALESCE_SIZE):
+            data = self._coalesce()
+        else:
+            data = memoryview(first)[self._offset:self._offset+SEND_SIZE]
+        sent = send(data)
+        if sent:
+            self._consume(sent)
+        return sent
+
+    def _coalesce(self):
+        '''
+        Joins small buffers from the head of the queue into a single chunk.
+        '''
+        chunks = [self._buffers[0][self._offset:]]
+        size = len(chunks[0])
+        for data in islice(self._buffers, 1, None):
+            if size + len(data) > COALESCE_SIZE:
+                break
+            chunks.append(data)
+            size += len(data)
+        if len(chunks) == 1:
+            return memoryview(self._buffers[0])[self._offset:]
+        return ''.join(chunks)
+
+    def _consume(self, sent):
+        '''
+        Removes the given number of sent bytes from the head of the queue.
+        '''
+        self.size -= sent
+        while sent:
+            remaining = len(self._buffers[0]) - self._offset
+            if sent < remaining:
+                self._offset += sent
+                break
+            sent -= remaining
+            self._buffers.popleft()
+            self._offset = 0
+        if self.paused and self.size <= self.lowWater:
+            self.paused = False
+        if not self._buffers:
+            self._produce()
+
+    def _produce(self):
+        '''
+        Pulls data from producers until the high water mark is reached and
+        moves buffers appended after exhausted producers. Data is pulled
+        regardless of the mark if there is nothing else to send.
+        '''
+        while self._producers:
+            producer = self._producers[0]
+            if isinstance(producer, str):
+                self._buffers.append(self._producers.popleft())
+                continue
+            if self.paused and self._buffers:
+                break
+            data = producer.more()
+            if data:
+                self._buffers.append(data)
+                self.size += len(data)
+                if self.size > self.highWater:
+                    self.paused = True
+            else:
+                self._producers.popleft()
@@ -0,0 +1,150 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import Queue
+import threading
+
+from tadek.core import log
+from tadek.core import config
+
+import loop
+import stats
+import instrument
+import accessibility
+
+#: Default number of worker threads
+DEFAULT_WORKERS = 2
+
+
+class WorkerPool(object):
+    '''
+    A pool of worker threads those run blocking functions, e.g. encoding,
+    outside of the event loop. Results are delivered back in the loop.
+    Backend calls of a function are recorded by its thread and attributed
+    to the request that submitted it when the result is delivered.
+    '''
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        '''
+        Starts missing worker threads.
+        '''
+        loop.enableWakeups()
+        self._threads = [thread for thread in self._threads
+                         if thread.isAlive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work,
+                                      name="worker-%d" % len(self._threads))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        '''
+        Runs queued functions until the worker is stopped.
+        '''
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            deferred, function, args, attribution = item
+            instrument.resume((attribution[0], {}))
+            try:
+                result = function(*args)
+            except:
+                log.exception("Worker function failure: %r" % function)
+                result = None
+            calls = instrument.end()
+            loop.callFromThread(self._deliver, deferred, result, attribution,
+                                calls)
+
+    def _deliver(self, deferred, result, attribution, calls):
+        '''
+        Delivers the given result of a function in the thread of the loop.
+        '''
+        instrument.merge(attribution, calls)
+        # Snapshots of the function do not outlive it
+        accessibility.expireSnapshots()
+        deferred.callback(result)
+
+    def submit(self, function, *args):
+        '''
+        Runs the given function with arguments in a worker thread. It has to
+        be called in the thread of the loop.
+
+        :param function: A function to run
+        :type function: callable
+        :return: A deferred result of the function, None if it fails
+        :rtype: loop.Deferred
+        '''
+        if len(self._threads) < self.workers:
+            self._start()
+        deferred = loop.Deferred()
+        self._queue.put((deferred, function, args, instrument.current()))
+        return deferred
+
+    def resize(self, workers):
+        '''
+        Sets the number of worker threads. Surplus workers are stopped after
+        finishing their current functions.
+
+        :param workers: A number of worker threads
+        :type workers: integer
+        '''
+        workers = max(workers, 1)
+        for i in xrange(len(self._threads) - workers):
+            self._queue.put(None)
+            self._threads.pop()
+        self.workers = workers
+
+# Worker threads shared by all connections
+workers = WorkerPool()
+
+
+def configure():
+    '''
+    Applies settings of the [pool] section of the daemon configuration.
+    '''
+    workers.resize(config.getInt('daemon', 'pool', 'workers') or
+                   DEFAULT_WORKERS)
+
+stats.gauge("pool_queued_functions", lambda: len(workers))
@@ -36,29 +36,129 @@
 
 import os
 import re
+import time
+import functools
 import subprocess
 
 from tadek.core import log
 from tadek.connection import protocol
 from tadek.core.accessible import Path, Accessible, Relation
 
+import loop
+import pool
+import cache
+import stats
+import monitor
+import tracing
+import timeline
 import providers
+import scheduler
+import instrument
+import spatial
+import isolation
+import accessibility
 
 # An action name used to grab focus on accessibles
 A11Y_ACTION_FOCUS = u"FOCUS"
 
+# Names of accessible parameters those can be included in a dump
+A11Y_FIELDS = ("name", "description", "role", "count", "position", "size",
+               "text", "value", "actions", "states", "attributes", "relations")
+
+def projectFields(include):
+    '''
+    Converts the given list of included accessible parameters into
+    a dictionary of dump parameters.
+
+    :param include: A list of names of accessible parameters
+    :type include: list
+    :rtype: dictionary
+    '''
+    include = set([str(param) for param in include])
+    return dict([(field, field in include) for field in A11Y_FIELDS])
+
 class Processor(object):
     '''
     A class of simple request processors.
     '''
     def __init__(self):
         self.cache = None
+        # A deadline of the processed request or None
+        self.deadline = None
 
     def __call__(self, request):
+        '''
+        Processes the given request and records its metrics. Metrics of
+        a deferred response are recorded when it is ready.
+        '''
+        labels = stats.requestLabels(request)
+        instrument.begin(labels)
+        providers.paths.begin()
+        # Snapshots of tasks of previous requests are not used by the request
+        accessibility.expireSnapshots()
+        start = time.time()
+        try:
+            with timeline.span("process", "processor", target=request.target,
+                               request=request.name):
+                response = self._process(request)
+        except:
+            stats.count("request_errors_total", labels)
+            self._record(request, labels, start, instrument.end())
+            raise
+        finally:
+            accessibility.expireSnapshots()
+        if isinstance(response, loop.Deferred):
+            # Tasks of the request attribute backend calls to it
+            return response.chain(self._finish, request, labels, start,
+                                  instrument.suspend())
+        return self._finish(response, request, labels, start,
+                            instrument.suspend())
+
+    def _finish(self, response, request, labels, start, attribution):
+        '''
+        Records metrics of the given response of the request.
+        '''
+        accessibility.expireSnapshots()
+        self._record(request, labels, start, attribution[1] or {})
+        stats.count("requests_total", labels)
+        if not getattr(response, "status", True):
+            stats.count("request_errors_total", labels)
+        return response
+
+    def _record(self, request, labels, start, calls):
+        '''
+        Records a duration and backend calls of the given request.
+        '''
+        duration = time.time() - start
+        stats.observe("request_duration_seconds", labels, duration)
+        if calls and tracing.enabled("backend"):
+            tracing.debug("backend", "Backend calls of %s %s request: %s",
+                          request.target, request.name,
+                          instrument.formatCalls(calls))
+        monitor.checkRequest(request, duration, calls)
+
+    def _process(self, request):
         '''
         Processes the given request.
         '''
-        log.debug(locals())
+        tracing.debug("processor", "%s", locals())
+        if isolation.routes(request):
+            # Processed by a worker process of the accessibility
+            return isolation.forward(request, self.deadline)
+        if isolation.enabled and isRoot(request):
+            if (request.target == protocol.MSG_TARGET_ACCESSIBILITY and
+                request.name == protocol.MSG_NAME_SEARCH):
+                # Accessibilities are searched by their worker processes
+                self.cache = None
+                deferred = forwardSearch(request.path, request.method,
+                                         self.deadline, **request.predicates)
+                return deferred.chain(self._forwardedResponse, request,
+                                      self.deadline)
+            elif (request.target == protocol.MSG_TARGET_EXTENSION and
+                  request.name == spatial.HitTestExtension.name):
+                # Accessibilities are hit-tested by their worker processes
+                deferred = forwardHitTest(request, self.deadline)
+                return deferred.chain(self._deferredResponse, request)
         extras = {
             "status": False
         }
@@ -67,21 +167,47 @@ class Processor(object):
                 params = {}
                 for param in request.include:
                     params[str(param)] = True
-                status, accessible = accessibilityGet(self, request.path,
-                                                      request.depth,
-                                                      **params)
-                extras = {
-                    "status": status,
-                    "accessible": accessible
-                }
+                # Optional parameters included for consecutive levels
+                # of descendants of the demanded accessible
+                projection = getattr(request, "projection", None)
+                if projection:
+                    params["projection"] = [projectFields(include)
+                                            for include in projection]
+                # Optional window of children of the demanded accessible
+                params["offset"] = getattr(request, "offset", 0) or 0
+                params["limit"] = getattr(request, "limit", None)
+                params["deadline"] = self.deadline
+                if isParallel(request.path, request.depth):
+                    # Dump subtrees of accessibilities in parallel
+                    self.cache = None
+                    deferred = parallelGet(request.path, request.depth,
+                                           **params)
+                    return deferred.chain(self._accessibleResponse, request,
+                                          self.deadline)
+                if scheduler.classify(request) == scheduler.BULK:
+                    # Dump the tree in time slices of the event loop
+                    steps = iterGet(self, request.path, request.depth,
+                                    **params)
+                    deferred = scheduler.scheduler.spawn(steps, self.deadline)
+                    return deferred.chain(self._accessibleResponse, request,
+                                          self.deadline)
+                result = accessibilityGet(self, request.path, request.depth,
+                                          **params)
+                return self._accessibleResponse(result, request, self.deadline)
             elif request.name == protocol.MSG_NAME_SEARCH:
-                status, accessible = accessibilitySearch(self, request.path,
-                                                         request.method,
-                                                         **request.predicates)
-                extras = {
-                    "status": status,
-                    "accessible": accessible
-                }
+                if scheduler.classify(request) == scheduler.BULK:
+                    # Search the tree in time slices of the event loop
+                    steps = iterSearch(self, request.path, request.method,
+                                       deadline=self.deadline,
+                                       **request.predicates)
+                    deferred = scheduler.scheduler.spawn(steps, self.deadline)
+                    return deferred.chain(self._accessibleResponse, request,
+                                          self.deadline)
+                result = accessibilitySearch(self, request.path,
+                                             request.method,
+                                             deadline=self.deadline,
+                                             **request.predicates)
+                return self._accessibleResponse(result, request, self.deadline)
             elif request.name == protocol.MSG_NAME_PUT:
                 if hasattr(request, 'text'):
                     status = accessibilityPutText(self, request.path,
@@ -101,6 +227,14 @@ class Processor(object):
                 if hasattr(request, 'action'):
                     status = accessibilityExecAction(self, request.path,
                                                      request.action)
+                elif hasattr(request, 'events') or hasattr(request, 'string'):
+                    status = accessibilityExecEvents(self, request.path,
+                                            getattr(request, 'events', None),
+                                            getattr(request, 'string', None),
+                                            getattr(request, 'delay', 0))
+                    if isinstance(status, loop.Deferred):
+                        # Events are generated later in the event loop
+                        return status.chain(self._deferredResponse, request)
                 elif (hasattr(request, 'keycode') and
                       hasattr(request, 'modifiers')):
                     status = accessibilityExecKeyboard(self, request.path,
@@ -158,11 +292,15 @@ class Processor(object):
             try:
                 ext = protocol.getExtension(request.name)
             except:
-                protocol.UnsupportedMessageError(request.type,
-                                                 request.target,
-                                                 request.name,
-                                                 *request.getParams())
-            status, extras = ext.response(**params)
+                raise protocol.UnsupportedMessageError(request.type,
+                                                       request.target,
+                                                       request.name,
+                                                       *request.getParams())
+            result = ext.response(**params)
+            if isinstance(result, loop.Deferred):
+                # The response is completed later in the event loop
+                return result.chain(self._deferredResponse, request)
+            status, extras = result
             extras["status"] = status
         else:
             raise protocol.UnsupportedMessageError(request.type,
@@ -172,13 +310,69 @@ class Processor(object):
         return protocol.create(protocol.MSG_TYPE_RESPONSE, request.target,
                                request.name, **extras)
 
+    def _accessibleResponse(self, result, request, deadline=None):
+        '''
+        Creates a response of the given request from its result, a status
+        and an accessible. If the deadline of the request expired then
+        the response is marked as incomplete.
+        '''
+        status, accessible = result or (False, Accessible(request.path))
+        extras = {
+            "status": status,
+            "accessible": accessible
+        }
+        if deadline is not None and deadline.reached:
+            extras["incomplete"] = True
+        return protocol.create(protocol.MSG_TYPE_RESPONSE, request.target,
+                               request.name, **extras)
+
+    def _forwardedResponse(self, response, request, deadline=None):
+        '''
+        Returns the given response of a worker process or a failure response
+        of the request if it is None.
+        '''
+        if response is None:
+            return self._accessibleResponse(None, request, deadline)
+        return response
+
+    def _deferredResponse(self, result, request):
+        '''
+        Creates a response of the given request from its deferred result,
+        a status or a status and response parameters.
+        '''
+        if isinstance(result, tuple):
+            status, extras = result
+        else:
+            status, extras = bool(result), {}
+        extras["status"] = status
+        return protocol.create(protocol.MSG_TYPE_RESPONSE, request.target,
+                               request.name, **extras)
+
 # ACCESSIBILITY
 
-def dumpAccessible(a11y, obj, path, depth, name, description, role, count,
-                                           position, size, text, value, actions,
-                                           states, attributes, relations):
+def dumpAccessible(*args, **kwargs):
     '''
     Dumps the given accessible object and returns it as an Accessible instance.
+    It takes the same parameters as iterDump().
+
+    :return: A dumped accessible object
+    :rtype: tadek.core.accessible.Accessible
+    '''
+    return scheduler.complete(iterDump(*args, **kwargs))
+
+def iterDump(a11y, obj, path, depth, name, description, role, count,
+                                     position, size, text, value, actions,
+                                     states, attributes, relations,
+                                     offset=0, limit=None, projection=None,
+                                     deadline=None):
+    '''
+    Dumps the given accessible object step by step. It is a generator that
+    yields None after each dumped accessible and finally the dumped accessible
+    object as an Accessible instance, so a dump can be suspended and resumed.
+    If the deadline expires then the dump ends with accessibles dumped so far.
+    If a window of children is given, only the children of the window are
+    dumped and the total number of children is always included. Descendants
+    are dumped with the same parameters unless a projection is given.
 
     :param a11y: An accessibility releated to a given accessible object
     :type a11y: ModuleType
@@ -212,40 +406,64 @@ def dumpAccessible(a11y, obj, path, depth, name, description, role, count,
     :type attributes: boolean
     :param relations: True if the dump should include accessible relations
     :type relations: bool
-    :return: A dumped accessible object
-    :rtype: tadek.core.accessible.Accessible
+    :param offset: An index of the first child to dump
+    :type offset: integer
+    :param limit: A maximum number of children to dump or None for all
+    :type limit: integer
+    :param projection: A list of dump parameters of consecutive levels of
+        descendants, the last one is used for all deeper levels
+    :type projection: list
+    :param deadline: A deadline of the dump or None
+    :type deadline: scheduler.Deadline
+    :return: A generator of steps of the dump
+    :rtype: generator
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     def getPath(a11y, obj, path):
         '''
         Gets a path of the given accessible object.
         '''
-        # Insert indexes of accessibility and application of the object
-        path = [path.tuple[0], path.tuple[1]]
-        while obj is not None:
-            path.insert(2, a11y.getIndex(obj))
-            obj = a11y.getParent(obj)
-        return path
+        # Prepend indexes of accessibility and application of the object
+        with timeline.span("getPath", "processor"):
+            indexes = providers.paths.path(a11y, obj)
+        return [path.tuple[0], path.tuple[1]] + list(indexes)
     if obj is None and len(path.tuple) > 1:
         # Invalid accessible object
-        return Accessible(path)
+        yield Accessible(path)
+        return
+    yield None
     try:
         children = []
         if depth != 0:
-            for a, o, p in providers.Children(a11y, obj, path):
-                children.append(dumpAccessible(a, o, p, depth-1, name,
-                                description, role, count, position, size, text,
-                                value, actions, states, attributes, relations))
+            if projection:
+                fields = projection[0]
+                projection = projection[1:] or projection
+            else:
+                fields = dict(name=name, description=description, role=role,
+                              count=count, position=position, size=size,
+                              text=text, value=value, actions=actions,
+                              states=states, attributes=attributes,
+                              relations=relations)
+            for a, o, p in providers.Children(a11y, obj, path, offset, limit):
+                if deadline is not None and deadline.expired():
+                    break
+                for step in iterDump(a, o, p, depth-1, projection=projection,
+                                     deadline=deadline, **fields):
+                    if step is None:
+                        yield None
+                    else:
+                        children.append(step)
         acc = Accessible(path, children)
+        paged = offset or limit is not None
         if a11y is None:
-            if count:
+            if count or paged:
                 acc.count = providers.a11yCount
         elif obj is None:
             # Accessibility might have only name and numer of children
             if name:
                 acc.name = a11y.name
-            if count:
-                acc.count = a11y.countChildren()
+            if count or paged:
+                acc.count = a11y.childCount()
         else:
             if name:
                 acc.name = a11y.getName(obj)
@@ -253,8 +471,8 @@ def dumpAccessible(a11y, obj, path, depth, name, description, role, count,
                 acc.description = a11y.getDescription(obj)
             if role:
                 acc.role = a11y.getRoleName(obj)
-            if count:
-                acc.count = a11y.countChildren(obj)
+            if count or paged:
+                acc.count = a11y.childCount(obj)
             if position:
                 acc.position = a11y.getPosition(obj)
             if size:
@@ -281,19 +499,36 @@ def dumpAccessible(a11y, obj, path, depth, name, description, role, count,
                         targets = [Path(*getPath(a11y, t, path))
                                    for t in a11y.relationTargets(obj, relation)]
                         acc.relations.append(Relation(name, targets))
+    except GeneratorExit:
+        raise
     except:
         log.exception("Dumping accessible object error: %s" % path)
         acc = Accessible(path)
-    return acc
+    yield acc
 
 
-def accessibilityGet(processor, path, depth, name=False, description=False,
-                     role=False, count=False, position=False, size=False,
-                     text=False,  value=False, actions=False, states=False,
-                     attributes=False, relations=False):
+def accessibilityGet(*args, **kwargs):
     '''
     Gets an accessible of the given path and depth including specified
-    accessible parameters.
+    accessible parameters. It takes the same parameters as iterGet().
+
+    :return: A getting accessible status and an accessible of the given path
+    :rtype: tuple
+    '''
+    return scheduler.complete(iterGet(*args, **kwargs))
+
+def iterGet(processor, path, depth, name=False, description=False,
+              role=False, count=False, position=False, size=False,
+              text=False,  value=False, actions=False, states=False,
+              attributes=False, relations=False, offset=0, limit=None,
+              projection=None, deadline=None):
+    '''
+    Gets an accessible of the given path and depth including specified
+    accessible parameters step by step. It is a generator that yields None
+    after each dumped accessible and finally a result. Children of
+    the accessible can be limited to a window starting at the given offset.
+    Descendants of the accessible can include other parameters given as
+    a projection.
 
     :param processor: A processor object calling the function
     :type processor: Processor
@@ -325,34 +560,289 @@ def accessibilityGet(processor, path, depth, name=False, description=False,
     :type attributes: boolean
     :param relations: True if a demanded accessible should include relations
     :type relations: bool
-    :return: A getting accessible status and an accessible of the given path
-    :rtype: tuple
+    :param offset: An index of the first child of a demanded accessible
+    :type offset: integer
+    :param limit: A maximum number of children of a demanded accessible
+    :type limit: integer
+    :param projection: A list of dictionaries of included parameters of
+        consecutive levels of descendants of a demanded accessible
+    :type projection: list
+    :param deadline: A deadline of the request or None
+    :type deadline: scheduler.Deadline
+    :return: A generator of steps, the last one is a getting accessible status
+        and an accessible of the given path
+    :rtype: generator
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     # Reset the processor cache
     processor.cache = None
     try:
         a11y, obj = providers.accessible(path)
         if a11y is None and path.tuple:
             log.info("Get accessible of requested path failure: %s" % path)
-            return False, Accessible(path)
+            yield False, Accessible(path)
+            return
         processor.cache = (a11y, obj, path)
-        return True, dumpAccessible(a11y, obj, path, depth=depth, name=name,
-                                description=description, role=role, count=count,
-                                position=position, size=size, text=text,
-                                value=value, actions=actions, states=states,
-                                attributes=attributes, relations=relations)
+        steps = iterDump(a11y, obj, path, depth=depth, name=name,
+                         description=description, role=role, count=count,
+                         position=position, size=size, text=text,
+                         value=value, actions=actions, states=states,
+                         attributes=attributes, relations=relations,
+                         offset=offset, limit=limit, projection=projection,
+                         deadline=deadline)
+        for acc in steps:
+            if acc is None:
+                yield None
+    except GeneratorExit:
+        raise
     except:
         log.exception("Get accessible of requested path error: %s" % path)
-        return False, Accessible(path)
+        yield False, Accessible(path)
+        return
+    yield True, acc
 
 
-def accessibilitySearch(processor, path, method, name=None, description=None,
-                        role=None, index=None, count=None, action=None,
-                        relation=None, state=None, text=None, nth=0):
+def isParallel(path, depth):
+    '''
+    Checks if subtrees of a dump of the given path and depth can be dumped
+    in parallel, i.e. it is a dump of the root with its descendants and
+    accessibilities are isolated or some of them allow concurrent access.
+
+    :param path: A path of a demanded accessible
+    :type path: tadek.core.accessible.Path
+    :param depth: A depth of a demanded accessible tree
+    :type depth: integer
+    :rtype: boolean
+    '''
+    if path.tuple or depth == 0:
+        return False
+    if isolation.enabled:
+        return True
+    for a11y in accessibility.all():
+        if a11y.concurrent:
+            return True
+    return False
+
+def parallelGet(path, depth, offset=0, limit=None, projection=None,
+                deadline=None, **fields):
+    '''
+    Gets the root accessible of the given depth dumping subtrees of
+    accessibilities in parallel. Isolated accessibilities are dumped by their
+    worker processes, applications of accessibilities those allow concurrent
+    access are dumped in the worker pool and other accessibilities in time
+    slices of the event loop. Dumped subtrees are merged in index order.
+    It takes the same parameters as iterGet().
+
+    :return: A deferred getting accessible status and the root accessible
+    :rtype: loop.Deferred
+    '''
+    tracing.debug("processor", "%s", locals())
+    fields = dict([(field, fields.get(field, False)) for field in A11Y_FIELDS])
+    if projection:
+        childFields = projection[0]
+        projection = projection[1:] or projection
+    else:
+        childFields = fields
+    paths = []
+    deferreds = []
+    for a11y, obj, p in providers.Children(None, None, path, offset, limit):
+        paths.append(p)
+        if isolation.enabled:
+            deferreds.append(_forwardDump(p, depth-1, childFields, projection,
+                                          deadline))
+        elif a11y.concurrent and depth-1 != 0:
+            deferreds.append(_concurrentDump(a11y, p, depth-1, childFields,
+                                             projection, deadline))
+        else:
+            steps = iterDump(a11y, None, p, depth-1, projection=projection,
+                             deadline=deadline, **childFields)
+            deferreds.append(scheduler.scheduler.spawn(steps, deadline))
+    def merge(children):
+        children = [child or Accessible(p) for child, p in zip(children, paths)]
+        acc = Accessible(path, children)
+        if fields["count"] or offset or limit is not None:
+            acc.count = providers.a11yCount
+        return True, acc
+    return loop.gather(deferreds).chain(merge)
+
+def _forwardDump(path, depth, fields, projection, deadline):
+    '''
+    Dumps an accessibility of the given path in its worker process.
+    '''
+    def include(fields):
+        return [field for field in A11Y_FIELDS if fields[field]]
+    params = {
+        "path": path,
+        "depth": depth,
+        "include": include(fields)
+    }
+    if projection:
+        params["projection"] = [include(level) for level in projection]
+    request = protocol.create(protocol.MSG_TYPE_REQUEST,
+                              protocol.MSG_TARGET_ACCESSIBILITY,
+                              protocol.MSG_NAME_GET, **params)
+    def accessible(response):
+        if response is None:
+            return None
+        response = protocol.parse(response.marshal())
+        if not response.status:
+            return None
+        return response.accessible
+    return isolation.forward(request, deadline).chain(accessible)
+
+def _concurrentDump(a11y, path, depth, fields, projection, deadline):
+    '''
+    Dumps an accessibility of the given path dumping its applications
+    in the worker pool.
+    '''
+    if projection:
+        childFields = projection[0]
+        projection = projection[1:] or projection
+    else:
+        childFields = fields
+    paths = []
+    deferreds = []
+    for a, obj, p in providers.Children(a11y, None, path):
+        paths.append(p)
+        dump = functools.partial(dumpAccessible, a, obj, p, depth-1,
+                                 projection=projection, deadline=deadline,
+                                 **childFields)
+        deferreds.append(pool.workers.submit(dump))
+    def merge(children):
+        children = [child or Accessible(p) for child, p in zip(children, paths)]
+        acc = Accessible(path, children)
+        if fields["name"]:
+            acc.name = a11y.name
+        if fields["count"]:
+            acc.count = a11y.childCount()
+        return acc
+    return loop.gather(deferreds).chain(merge)
+
+
+def isRoot(request):
+    '''
+    Checks if the given request is a request for the root accessible.
+
+    :param request: A request message
+    :type request: tadek.connection.protocol.Message
+    :rtype: boolean
+    '''
+    path = getattr(request, "path", None)
+    return path is not None and not getattr(path, "tuple", path)
+
+def forwardSearch(path, method, deadline=None, nth=0, **predicates):
+    '''
+    Searches descendants of the root in worker processes of isolated
+    accessibilities. Each worker searches its accessibility, then the match
+    which comes first in the search order is taken and the next match
+    is searched by its worker until the nth match is found. It takes
+    the same parameters as iterSearch().
+
+    :return: A deferred response of the worker that found the accessible
+        or None
+    :rtype: loop.Deferred
+    '''
+    result = loop.Deferred()
+    matches = []
+    taken = [0]
+    def search(index, n):
+        params = {
+            "path": path,
+            "method": method,
+            "predicates": dict(predicates, nth=n)
+        }
+        request = protocol.create(protocol.MSG_TYPE_REQUEST,
+                                  protocol.MSG_TARGET_ACCESSIBILITY,
+                                  protocol.MSG_NAME_SEARCH, **params)
+        deferred = isolation.forward(request, deadline, index)
+        return deferred.chain(match, index, n)
+    def match(response, index, n):
+        if response is None:
+            return None
+        found = protocol.parse(response.marshal())
+        if not found.status:
+            return None
+        if method == protocol.MHD_SEARCH_BACKWARDS:
+            order = (-index,)
+        else:
+            # Descendants are searched level by level
+            order = (len(found.accessible.path.tuple), index)
+        return order, index, n, response
+    def advance(found):
+        if found is not None:
+            matches.append(found)
+        if not matches or (deadline is not None and deadline.expired()):
+            result.callback(None)
+            return
+        matches.sort()
+        order, index, n, response = matches.pop(0)
+        if taken[0] == nth:
+            result.callback(response)
+            return
+        taken[0] += 1
+        search(index, n + 1).addCallback(advance)
+    def start(found):
+        matches.extend([item for item in found if item is not None])
+        advance(None)
+    deferreds = [search(index, 0) for index in isolation.indexes()]
+    loop.gather(deferreds).addCallback(start)
+    return result
+
+def forwardHitTest(request, deadline=None):
+    '''
+    Hit-tests accessibilities of the root in their worker processes and
+    merges found accessibles.
+
+    :param request: A hit-testing request for the root
+    :type request: tadek.connection.protocol.Message
+    :param deadline: A deadline of the request or None
+    :type deadline: scheduler.Deadline
+    :return: A deferred status and response parameters
+    :rtype: loop.Deferred
+    '''
+    params = {}
+    for name in request.getParams():
+        params[name] = getattr(request, name)
+    params["all"] = True
+    def found(response):
+        if response is None:
+            return None
+        response = protocol.parse(response.marshal())
+        if not response.status:
+            return None
+        return response.accessibles
+    deferreds = []
+    for index in isolation.indexes():
+        params["path"] = Path(index)
+        hitTest = protocol.create(protocol.MSG_TYPE_REQUEST,
+                                  protocol.MSG_TARGET_EXTENSION, request.name,
+                                  **params)
+        deferreds.append(isolation.forward(hitTest, deadline,
+                                           index).chain(found))
+    def merge(founds):
+        return True, {"accessibles": spatial.merge(founds,
+                                                   getattr(request, "all",
+                                                           False))}
+    return loop.gather(deferreds).chain(merge)
+
+def accessibilitySearch(*args, **kwargs):
     '''
     Searches an accessible using the given method according to specified
-    accessible parameters.
+    accessible parameters. It takes the same parameters as iterSearch().
+
+    :return: A searching accessible status and an found accessible
+    :rtype: tuple
+    '''
+    return scheduler.complete(iterSearch(*args, **kwargs))
+
+def iterSearch(processor, path, method, name=None, description=None,
+               role=None, index=None, count=None, action=None,
+               relation=None, state=None, text=None, nth=0, deadline=None):
+    '''
+    Searches an accessible using the given method according to specified
+    accessible parameters step by step. It is a generator that yields None
+    after each visited accessible and finally a result. If the deadline
+    expires then the search ends with the last visited accessible.
 
     :param processor: A processor object calling the function
     :type processor: Processor
@@ -380,10 +870,13 @@ def accessibilitySearch(processor, path, method, name=None, description=None,
     :type text: string or NoneType
     :param nth: A nth matched accessible
     :type nth: integer
-    :return: A searching accessible status and an accessible of the given path
-    :rtype: tuple
+    :param deadline: A deadline of the request or None
+    :type deadline: scheduler.Deadline
+    :return: A generator of steps, the last one is a searching accessible
+        status and an found accessible
+    :rtype: generator
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     def matchString(pattern, string):
         '''
         Checks if the give string matches the regular expression pattern.
@@ -402,7 +895,8 @@ def accessibilitySearch(processor, path, method, name=None, description=None,
         processor.cache = None
         if a11y is None and path.tuple:
             log.info("Accessible of requested path not found: %s" % path)
-            return False, Accessible(path)
+            yield False, Accessible(path)
+            return
         if method == protocol.MHD_SEARCH_SIMPLE:
             provider = providers.Children
         elif method == protocol.MHD_SEARCH_BACKWARDS:
@@ -411,7 +905,8 @@ def accessibilitySearch(processor, path, method, name=None, description=None,
             provider = providers.Descendants
         else:
             log.error("Unknown search method: %s" % method)
-            return False, Accessible(Path())
+            yield False, Accessible(Path())
+            return
         if name and name[0] == '&':
             name = re.compile(name[1:], re.DOTALL)
             cmpName = matchString
@@ -429,12 +924,16 @@ def accessibilitySearch(processor, path, method, name=None, description=None,
             cmpText = lambda pattern, string: pattern == string
         i = 0
         for a11y, obj, path in provider(a11y, obj, path):
+            yield None
+            if deadline is not None and deadline.expired():
+                yield False, Accessible(path)
+                return
             if index is not None and index != path.index():
                 continue
             if obj is None:
                 if name is not None and not cmpName(name, a11y.name):
                     continue
-                if count is not None and a11y.countChildren() != count:
+                if count is not None and a11y.childCount() != count:
                     continue
             else:
                 if name is not None and not cmpName(name, a11y.getName(obj)):
@@ -444,7 +943,7 @@ def accessibilitySearch(processor, path, method, name=None, description=None,
                     continue
                 if role is not None and a11y.getRoleName(obj) != role:
                     continue
-                if count is not None and a11y.countChildren(obj) != count:
+                if count is not None and a11y.childCount(obj) != count:
                     continue
                 if action is not None:
                     found = False
@@ -470,18 +969,22 @@ def accessibilitySearch(processor, path, method, name=None, description=None,
             i += 1
             if nth < i:
                 processor.cache = (a11y, obj, path)
-                return True, dumpAccessible(a11y, obj, path, depth=0, name=True,
+                yield True, dumpAccessible(a11y, obj, path, depth=0, name=True,
                                         description=True, role=True, count=True,
                                         position=True, size=True, text=True,
                                         value=True, actions=True, states=True,
                                         attributes=True, relations=True)
+                return
+    except GeneratorExit:
+        raise
     except:
         log.exception("Search an accessible of specified parmaters error")
         # Reset the processor cache before leaving
         processor.cache = None
-        return False, Accessible(path)
+        yield False, Accessible(path)
+        return
     log.info("Search an accessible of specified parmaters failure")
-    return False, Accessible(path)
+    yield False, Accessible(path)
 
 
 def accessibilityPutText(processor, path, text):
@@ -497,7 +1000,7 @@ def accessibilityPutText(processor, path, text):
     :return: True if success, False otherwise
     :rtype: boolean
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     try:
         # Get object from the processor cache or from the accessible provider
         if processor.cache and processor.cache[-1] == path:
@@ -510,6 +1013,7 @@ def accessibilityPutText(processor, path, text):
             log.warning("Attempt of setting text for non-accessible")
             return False
         status = a11y.setText(obj, text)
+        cache.invalidate(a11y, obj)
     except:
         log.exception("Set accessible text error: %s" % path)
         # Reset the processor cache before leaving
@@ -533,7 +1037,7 @@ def accessibilityPutValue(processor, path, value):
     :return: True if success, False otherwise
     :rtype: boolean
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     try:
         # Get object from the processor cache or from the accessible provider
         if processor.cache and processor.cache[-1] == path:
@@ -546,6 +1050,7 @@ def accessibilityPutValue(processor, path, value):
             log.warning("Attempt of setting value for non-accessible")
             return False
         status = a11y.setValue(obj, value)
+        cache.invalidate(a11y, obj)
     except:
         log.exception("Set accessible value error: %s" % path)
         # Reset the processor cache before leaving
@@ -569,7 +1074,7 @@ def accessibilityExecAction(processor, path, action):
     :return: True if success, False otherwise
     :rtype: boolean
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     try:
         # Get object from the processor cache or from the accessible provider
         if processor.cache and processor.cache[-1] == path:
@@ -585,6 +1090,7 @@ def accessibilityExecAction(processor, path, action):
             status = a11y.grabFocus(obj)
         else:
             status = a11y.doAction(obj, getattr(a11y.actionset, action, action))
+        cache.invalidate(a11y, obj, volatile=True)
     except:
         log.exception("Execute accessible action error: %s" % path)
         # Reset the processor cache before leaving
@@ -610,7 +1116,7 @@ def accessibilityExecKeyboard(processor, path, keycode, modifiers):
     :return: True if success, False otherwise
     :rtype: boolean
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     try:
         # Get object from the processor cache or from the accessible provider
         if processor.cache and processor.cache[-1] == path:
@@ -624,6 +1130,7 @@ def accessibilityExecKeyboard(processor, path, keycode, modifiers):
                         " event on non-accessible")
             return False
         a11y.keyboardEvent(keycode, modifiers)
+        cache.invalidate(a11y, obj, volatile=True)
     except:
         log.exception("Generate keyboard event error: %s" % path)
         # Reset the processor cache before leaving
@@ -650,7 +1157,7 @@ def accessibilityExecMouse(processor, path, event, button, coordinates):
     :return: True if success, False otherwise
     :rtype: boolean
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     try:
         # Get object from the processor cache or from the accessible provider
         if processor.cache and processor.cache[-1] == path:
@@ -662,22 +1169,9 @@ def accessibilityExecMouse(processor, path, event, button, coordinates):
         if a11y is None:
             log.warning("Attempt of generating mouse event on non-accessible")
             return False
-        button = getattr(a11y.buttonset, button, button)
-        if event == 'CLICK':
-            a11y.mouseClick(button=button, *coordinates)
-        elif event == 'DOUBLE_CLICK':
-            a11y.mouseDoubleClick(button=button, *coordinates)
-        elif event == 'PRESS':
-            a11y.mousePress(button=button, *coordinates)
-        elif event == 'RELEASE':
-            a11y.mouseRelease(button=button, *coordinates)
-        elif event == 'ABSOLUTE_MOTION':
-            a11y.mouseAbsoluteMotion(*coordinates)
-        elif event == 'RELATIVE_MOTION':
-            a11y.mouseRelativeMotion(*coordinates)
-        else:
-            log.warning("Unknown mouse event: %s", event)
+        if not mouseEvent(a11y, event, button, coordinates):
             return False
+        cache.invalidate(a11y, obj, volatile=True)
     except:
         log.exception("Generate mouse event failure: %s" % path)
         # Reset the processor cache before leaving
@@ -685,6 +1179,151 @@ def accessibilityExecMouse(processor, path, event, button, coordinates):
         return False
     return True
 
+def mouseEvent(a11y, event, button, coordinates):
+    '''
+    Generates the given mouse event at the given coordinates using
+    the specified mouse button.
+
+    :param a11y: An accessibility to generate the event with
+    :type a11y: IAccessibility
+    :param event: A mouse event to generate
+    :type event: string
+    :param button: A mouse button to use
+    :type button: string
+    :param coordinates: A a mouse event coordinates
+    :type coordinates: list
+    :return: True if the event is known, False otherwise
+    :rtype: boolean
+    '''
+    button = getattr(a11y.buttonset, button, button)
+    if event == 'CLICK':
+        a11y.mouseClick(button=button, *coordinates)
+    elif event == 'DOUBLE_CLICK':
+        a11y.mouseDoubleClick(button=button, *coordinates)
+    elif event == 'PRESS':
+        a11y.mousePress(button=button, *coordinates)
+    elif event == 'RELEASE':
+        a11y.mouseRelease(button=button, *coordinates)
+    elif event == 'ABSOLUTE_MOTION':
+        a11y.mouseAbsoluteMotion(*coordinates)
+    elif event == 'RELATIVE_MOTION':
+        a11y.mouseRelativeMotion(*coordinates)
+    else:
+        log.warning("Unknown mouse event: %s" % event)
+        return False
+    return True
+
+
+class EventSequence(object):
+    '''
+    A sequence of keyboard and mouse events generated on an accessible.
+    Delays between events are scheduled in the event loop.
+    '''
+    def __init__(self, a11y, obj, path, events, delay=0):
+        self._a11y = a11y
+        self._obj = obj
+        self._path = path
+        self._events = events
+        self._delay = delay
+        self._index = 0
+        self._waited = False
+        self._deferred = None
+
+    def run(self):
+        '''
+        Generates events of the sequence until the first delay.
+
+        :return: A status of the sequence or a deferred status if there
+            are any delays
+        :rtype: boolean or loop.Deferred
+        '''
+        while self._index < len(self._events):
+            event = self._events[self._index]
+            delay = event.get("delay", self._index and self._delay)
+            if delay > 0 and not self._waited:
+                self._waited = True
+                if self._deferred is None:
+                    self._deferred = loop.Deferred()
+                loop.callLater(delay / 1000.0, self.run)
+                return self._deferred
+            self._waited = False
+            self._index += 1
+            if not self._generate(event):
+                return self._finish(False)
+        return self._finish(True)
+
+    def _generate(self, event):
+        '''
+        Generates the given event.
+        '''
+        try:
+            if event["type"] == "key":
+                self._a11y.keyboardEvent(event["keycode"],
+                                         event.get("modifiers", ()))
+                return True
+            elif event["type"] == "mouse":
+                return mouseEvent(self._a11y, event["event"],
+                                  event.get("button", "LEFT"),
+                                  event["coordinates"])
+            log.warning("Unknown input event: %s" % event["type"])
+        except:
+            log.exception("Generate input event error: %s" % self._path)
+        return False
+
+    def _finish(self, status):
+        '''
+        Finishes the sequence with the given status.
+        '''
+        cache.invalidate(self._a11y, self._obj, volatile=True)
+        if self._deferred is None:
+            return status
+        self._deferred.callback(status)
+        return self._deferred
+
+def accessibilityExecEvents(processor, path, events=None, string=None,
+                            delay=0):
+    '''
+    Generates a sequence of keyboard and mouse events or types a string for
+    an accessible of the given path. Each event is a dictionary of a type,
+    'key' or 'mouse', and parameters of keyboard or mouse events, it can
+    include a delay before the event.
+
+    :param processor: A processor object calling the function
+    :type processor: Processor
+    :param path: A path of the accessible
+    :type path: tadek.core.accessible.Path
+    :param events: A list of events
+    :type events: list
+    :param string: A string to type, if events are not given
+    :type string: string
+    :param delay: A default delay in milliseconds between events
+    :type delay: integer
+    :return: True if success, False otherwise or a deferred status if there
+        are any delays
+    :rtype: boolean or loop.Deferred
+    '''
+    tracing.debug("processor", "%s", locals())
+    try:
+        # Get object from the processor cache or from the accessible provider
+        if processor.cache and processor.cache[-1] == path:
+            a11y, obj, path = processor.cache
+        else:
+            a11y, obj = providers.accessible(path)
+        # Reset the processor cache
+        processor.cache = None
+        if a11y is None:
+            log.warning("Attempt of generating input events on non-accessible")
+            return False
+        if events is None:
+            events = [{"type": "key", "keycode": ord(char)}
+                      for char in string or '']
+        return EventSequence(a11y, obj, path, events, delay).run()
+    except:
+        log.exception("Generate input events error: %s" % path)
+        # Reset the processor cache before leaving
+        processor.cache = None
+        return False
+
 # SYSTEM
 
 def systemGet(processor, path):
@@ -698,7 +1337,7 @@ def systemGet(processor, path):
     :return: The file content data or None
     :rtype: string
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     # Reset the processor cache
     processor.cache = None
     if not os.path.exists(path):
@@ -727,7 +1366,7 @@ def systemPut(processor, path, data):
     :return: True if success, False otherwise
     :rtype: boolean
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     # Reset the processor cache
     processor.cache = None
     fd = None
@@ -759,7 +1398,7 @@ def systemExec(processor, command, wait=True):
     :return: The command execution status, output and error
     :rtype: tuple
     '''
-    log.debug(str(locals()))
+    tracing.debug("processor", "%s", locals())
     # Reset the processor cache
     processor.cache = None
     stdout, stderr = '', ''
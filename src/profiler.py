@@ -0,0 +1,353 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import time
+import base64
+import signal
+import marshal
+import cProfile
+
+from tadek.core import log
+from tadek.connection import protocol
+
+#: Profiling modes
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLE = "sample"
+
+#: Default interval in seconds between samples of the sampling profiler
+DEFAULT_INTERVAL = 0.005
+
+# True if any requests are being profiled, it is the only thing checked
+# in the request path while profiling is off
+active = False
+
+# A profiling session or None
+_session = None
+# A result of the last finished profiling session or None
+_result = None
+# True while a request is being profiled
+_profiling = False
+
+
+class Session(object):
+    '''
+    A base class of profiling sessions those profile the given number of
+    requests or requests processed in the given time.
+    '''
+    def __init__(self, requests=0, seconds=0):
+        self.requests = requests
+        self.deadline = seconds and time.time() + seconds or None
+
+    def expired(self):
+        '''
+        Checks if the session should be finished.
+        '''
+        if self.deadline is not None and time.time() >= self.deadline:
+            return True
+        return self.deadline is None and self.requests <= 0
+
+    def begin(self):
+        '''
+        Starts profiling of a request.
+        '''
+        self.resume()
+
+    def end(self):
+        '''
+        Stops profiling of a request.
+        '''
+        self.suspend()
+        self.requests -= 1
+
+    def resume(self):
+        '''
+        Resumes profiling of a request.
+        '''
+        raise NotImplementedError
+
+    def suspend(self):
+        '''
+        Suspends profiling of a request.
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        '''
+        Releases resources of the session.
+        '''
+        pass
+
+    def result(self):
+        '''
+        Returns a profiling result.
+
+        :return: A format and data of a result
+        :rtype: tuple
+        '''
+        raise NotImplementedError
+
+
+class ProfileSession(Session):
+    '''
+    A profiling session using the deterministic cProfile profiler. Its result
+    is marshalled pstats data, the same as written by pstats.dump_stats(),
+    encoded in base64 as responses carry only text.
+    '''
+    def __init__(self, requests=0, seconds=0):
+        Session.__init__(self, requests, seconds)
+        self._profile = cProfile.Profile()
+
+    def resume(self):
+        self._profile.enable()
+
+    def suspend(self):
+        self._profile.disable()
+
+    def result(self):
+        self._profile.create_stats()
+        return "pstats", base64.b64encode(marshal.dumps(self._profile.stats))
+
+
+class SampleSession(Session):
+    '''
+    A profiling session using a statistical profiler that samples the stack
+    of the main thread on the SIGPROF signal. Samples are recorded only
+    while a request is profiled. Its result is a collapsed-stack file which
+    can be converted into a flame graph.
+    '''
+    def __init__(self, requests=0, seconds=0, interval=DEFAULT_INTERVAL):
+        Session.__init__(self, requests, seconds)
+        self._stacks = {}
+        self._sampling = False
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+    def _sample(self, signum, frame):
+        '''
+        Records the stack of the given interrupted frame.
+        '''
+        if not self._sampling:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (code.co_name, code.co_filename,
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        stack = ';'.join(stack)
+        self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    def resume(self):
+        self._sampling = True
+
+    def suspend(self):
+        self._sampling = False
+
+    def close(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def result(self):
+        lines = ["%s %d" % item for item in sorted(self._stacks.iteritems())]
+        lines.append('')
+        return "collapsed", '\n'.join(lines)
+
+
+def start(mode=MODE_CPROFILE, requests=0, seconds=0):
+    '''
+    Starts profiling of the given number of next requests or of requests
+    processed in the given number of seconds.
+
+    :param mode: A profiling mode
+    :type mode: string
+    :param requests: A number of requests to profile
+    :type requests: integer
+    :param seconds: A profiling time in seconds
+    :type seconds: float
+    :return: True if success, False otherwise
+    :rtype: boolean
+    '''
+    global active, _session
+    stop()
+    if requests <= 0 and seconds <= 0:
+        log.warning("Profiling of no requests requested")
+        return False
+    if mode == MODE_CPROFILE:
+        _session = ProfileSession(requests, seconds)
+    elif mode == MODE_SAMPLE and hasattr(signal, "setitimer"):
+        _session = SampleSession(requests, seconds)
+    else:
+        log.warning("Unsupported profiling mode: %s" % mode)
+        return False
+    log.info("Started profiling in %s mode" % mode)
+    active = True
+    return True
+
+def stop():
+    '''
+    Stops a running profiling session and stores its result.
+    '''
+    global active, _session, _result
+    if _session is None:
+        return
+    active = False
+    _session.close()
+    try:
+        _result = _session.result()
+    except:
+        log.exception("Getting profiling result failure")
+        _result = None
+    _session = None
+    log.info("Stopped profiling")
+
+def begin():
+    '''
+    Starts profiling of a request if profiling is active.
+    '''
+    global _profiling
+    if _session.expired():
+        stop()
+    else:
+        _session.begin()
+        _profiling = True
+
+def end():
+    '''
+    Stops profiling of a request.
+    '''
+    global _profiling
+    _profiling = False
+    if _session is None:
+        return
+    _session.end()
+    if _session.expired():
+        stop()
+
+def suspend():
+    '''
+    Suspends profiling of the current request, e.g. while its deferred
+    response is in progress.
+
+    :return: True if the request is profiled
+    :rtype: boolean
+    '''
+    global _profiling
+    profiled = _profiling
+    _profiling = False
+    if profiled and _session is not None:
+        _session.suspend()
+    return profiled
+
+def resume(profiled):
+    '''
+    Resumes profiling of a request suspended by suspend(), e.g. while a task
+    of the request runs.
+
+    :param profiled: True if the request is profiled
+    :type profiled: boolean
+    '''
+    global _profiling
+    if profiled and _session is not None:
+        _session.resume()
+        _profiling = True
+
+def profiling():
+    '''
+    Checks if the current request is being profiled.
+
+    :rtype: boolean
+    '''
+    return _profiling
+
+def result():
+    '''
+    Returns a result of the last finished profiling session.
+
+    :return: A format and data of a result or (None, None)
+    :rtype: tuple
+    '''
+    if _session is not None and _session.expired():
+        stop()
+    return _result or (None, None)
+
+
+class ProfileExtension(protocol.Extension):
+    '''
+    A protocol extension that controls profiling of a running daemon.
+    '''
+    name = "profile"
+
+    def request(self, command, mode=MODE_CPROFILE, requests=0, seconds=0):
+        '''
+        Returns parameters of a profiling request.
+
+        :param command: One of 'start', 'stop' and 'result'
+        :type command: string
+        :param mode: A profiling mode, 'cprofile' or 'sample'
+        :type mode: string
+        :param requests: A number of requests to profile
+        :type requests: integer
+        :param seconds: A profiling time in seconds
+        :type seconds: float
+        '''
+        return {"command": command, "mode": mode,
+                "requests": requests, "seconds": seconds}
+
+    def response(self, command, mode=MODE_CPROFILE, requests=0, seconds=0,
+                 **params):
+        '''
+        Starts or stops profiling or returns a profiling result. Data of
+        results in the 'pstats' format is base64-encoded.
+
+        :return: A status and response parameters
+        :rtype: tuple
+        '''
+        if command == "start":
+            return start(mode, int(requests), float(seconds)), {}
+        elif command == "stop":
+            stop()
+            return True, {}
+        elif command == "result":
+            format, data = result()
+            if format is None:
+                return False, {}
+            return True, {"format": format, "data": data,
+                          "active": active}
+        log.warning("Unknown profiling command: %s" % command)
+        return False, {}
+
+protocol.registerExtension(ProfileExtension())
@@ -34,11 +34,22 @@
 ##                                                                            ##
 ################################################################################
 
+import threading
+from collections import OrderedDict
+
+import timeline
 import accessibility
 
 # Number of all available accessibilities
 a11yCount = len(accessibility.all())
 
+# An index of the only accessibility provided as a child of the root, e.g.
+# in a worker process, or None if all accessibilities are provided
+served = None
+
+#: Default maximum number of memoised paths of accessible objects
+DEFAULT_MAX_PATHS = 4096
+
 def accessible(path):
     '''
     Gets an accessible object of the given path.
@@ -56,15 +67,139 @@ def accessible(path):
         return None, None
     obj = None
     try:
-        for index in path.tuple[1:]:
-            obj = a11y.getChild(obj, index)
-            if obj is None:
-                return None, None
+        with timeline.span("resolve", "providers", path=str(path)):
+            for index in path.tuple[1:]:
+                with timeline.span("step", "providers", index=index):
+                    obj = a11y.getChild(obj, index)
+                if obj is None:
+                    return None, None
     except IndexError:
         return None, None
     return a11y, obj
 
 
+class PathMemo(object):
+    '''
+    A bounded memo of paths of accessible objects. A path is memoised as
+    a tuple of indexes of an object and its ancestors. Paths memoised during
+    the current request are reused as they are, older ones only if a parent
+    of the object did not change.
+    '''
+    def __init__(self, maxEntries=DEFAULT_MAX_PATHS):
+        self.maxEntries = maxEntries
+        self._paths = OrderedDict()
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def begin(self):
+        '''
+        Begins a new request. Paths memoised so far have to be validated
+        before they are reused.
+        '''
+        self._generation += 1
+
+    def clear(self):
+        '''
+        Removes all memoised paths.
+        '''
+        with self._lock:
+            self._paths.clear()
+
+    def resize(self, maxEntries):
+        '''
+        Sets the maximum number of memoised paths.
+
+        :param maxEntries: A maximum number of paths, if 0 then paths are
+            not memoised
+        :type maxEntries: integer
+        '''
+        with self._lock:
+            self.maxEntries = maxEntries
+            while len(self._paths) > max(maxEntries, 0):
+                self._paths.popitem(last=False)
+
+    def path(self, a11y, obj):
+        '''
+        Gets indexes of the given accessible object and its ancestors starting
+        from the topmost one. Paths of the ancestors are memoised as well.
+
+        :param a11y: An accessibility of the object
+        :type a11y: IAccessibility
+        :param obj: An accessible object
+        :type obj: accessible
+        :return: A tuple of indexes
+        :rtype: tuple
+        '''
+        with self._lock:
+            indexes = ()
+            chain = []
+            while obj is not None:
+                key = self._key(a11y, obj)
+                entry = None
+                if key is not None:
+                    entry = self._paths.pop(key, None)
+                parent = None
+                if entry is not None:
+                    if entry[2] == self._generation:
+                        indexes = entry[1]
+                    else:
+                        parent = a11y.getParent(obj)
+                        if parent == entry[0]:
+                            indexes = entry[1]
+                        else:
+                            entry = None
+                if entry is not None:
+                    self._store(key, entry[0], indexes)
+                    break
+                if parent is None:
+                    parent = a11y.getParent(obj)
+                chain.append((key, parent, a11y.getIndex(obj)))
+                obj = parent
+            for key, parent, index in reversed(chain):
+                indexes += (index,)
+                if key is not None:
+                    self._store(key, parent, indexes)
+            return indexes
+
+    def _key(self, a11y, obj):
+        '''
+        Returns a memo key of the given accessible object or None if the object
+        cannot be used as a key.
+        '''
+        if self.maxEntries <= 0:
+            return None
+        key = (a11y.name, obj)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _store(self, key, parent, indexes):
+        '''
+        Memoises a path of an accessible object of the given key.
+        '''
+        self._paths[key] = (parent, indexes, self._generation)
+        while len(self._paths) > self.maxEntries:
+            self._paths.popitem(last=False)
+
+# Memo of paths of accessible objects shared by all connections
+paths = PathMemo()
+
+
+def _roots():
+    '''
+    Returns a range of indexes of accessibilities provided as children
+    of the root as the first index and the index past the last one.
+    '''
+    if served is None:
+        return 0, a11yCount
+    return served, served + 1
+
+
 class Provider(object):
     '''
     A base class of iterators those iterate through children/descendants of
@@ -85,25 +220,42 @@ class Provider(object):
 class Children(Provider):
     '''
     A class of iterators those iterate only through direct children of a given
-    accessible.
+    accessible. Iteration can be limited to a window of children starting at
+    the given offset. The window is accessed directly, without fetching
+    preceding children.
     '''
-    def __init__(self, a11y, obj, path):
+    def __init__(self, a11y, obj, path, offset=0, limit=None):
         Provider.__init__(self, a11y, obj, path)
-        self._index = 0
+        self._index = max(offset, 0)
+        self._children = None
         if self._a11y is None:
-            self._children = iter(accessibility.all())
+            first, end = _roots()
+            self._children = accessibility.all()[:end]
+            self._count = end
+            self._index = max(self._index, first)
+        elif offset or limit is not None:
+            # Get children of the window one by one
+            self._count = self._a11y.childCount(obj)
         else:
-            self._children = self._a11y.children(obj)
+            self._children = self._a11y.getChildren(obj)
+            self._count = len(self._children)
+        if limit is not None:
+            self._count = min(self._count, self._index + max(limit, 0))
 
     def next(self):
+        if self._index >= self._count:
+            raise StopIteration
         path = self._path.child(self._index)
-        self._index += 1
         if self._a11y is None:
-            a11y = self._children.next()
+            a11y = self._children[self._index]
             obj = None
         else:
             a11y = self._a11y
-            obj = self._children.next()
+            if self._children is None:
+                obj = self._a11y.getChild(self._obj, self._index)
+            else:
+                obj = self._children[self._index]
+        self._index += 1
         return a11y, obj, path
 
 
@@ -114,25 +266,25 @@ class ChildrenBackwards(Provider):
     '''
     def __init__(self, a11y, obj, path):
         Provider.__init__(self, a11y, obj, path)
+        self._first = 0
         if self._a11y is None:
-            self._index = a11yCount
+            self._first, end = _roots()
+            self._children = accessibility.all()[:end]
         else:
-            self._index = self._a11y.countChildren(obj)
+            self._children = self._a11y.getChildren(obj)
+        self._index = len(self._children)
 
     def next(self):
         self._index -= 1
-        if self._index < 0:
+        if self._index < self._first:
             raise StopIteration
         path = self._path.child(self._index)
-        try:
-            if self._a11y is None:
-                a11y = accessibility.all()[self._index]
-                obj = None
-            else:
-                a11y = self._a11y
-                obj = self._a11y.getChild(self._obj, self._index)
-        except IndexError:
-            raise StopIteration
+        if self._a11y is None:
+            a11y = self._children[self._index]
+            obj = None
+        else:
+            a11y = self._a11y
+            obj = self._children[self._index]
         return a11y, obj, path
 
 
@@ -145,26 +297,27 @@ class Descendants(Provider):
         Provider.__init__(self, a11y, obj, path)
         self._index = 0
         if self._a11y is None:
-            self._count = a11yCount
+            self._index, end = _roots()
+            self._children = accessibility.all()[:end]
         else:
-            self._count = self._a11y.countChildren(self._obj)
+            self._children = self._a11y.getChildren(self._obj)
         self._queue = []
 
     def next(self):
-        if self._a11y is None and self._index < self._count:
-            a11y = accessibility.all()[self._index]
+        if self._a11y is None and self._index < len(self._children):
+            a11y = self._children[self._index]
             obj = None
-            count = a11y.countChildren()
+            count = a11y.childCount()
         else:
-            if self._index >= self._count:
+            while self._index >= len(self._children):
                 if not self._queue:
                     raise StopIteration
                 self._a11y, self._obj, self._path = self._queue.pop(0)
                 self._index = 0
-                self._count = self._a11y.countChildren(self._obj)
+                self._children = self._a11y.getChildren(self._obj)
             a11y = self._a11y
-            obj = self._a11y.getChild(self._obj, self._index)
-            count = self._a11y.countChildren(obj)
+            obj = self._children[self._index]
+            count = self._a11y.childCount(obj)
         path = self._path.child(self._index)
         if count:
             self._queue.append((a11y, obj, path))
@@ -0,0 +1,433 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import time
+from collections import deque
+
+from tadek.core import log
+from tadek.core import config
+from tadek.connection import protocol
+
+import loop
+import stats
+import timeline
+import profiler
+import instrument
+import accessibility
+
+#: Priority classes of requests, from the highest priority
+INPUT = 0
+POINT = 1
+BULK = 2
+SYSTEM = 3
+
+#: Names of priority classes
+CLASSES = ("input", "point", "bulk", "system")
+
+#: Default number of bulk and system requests processed per loop iteration
+DEFAULT_BULK = 1
+#: Default maximum number of steps of a task per loop iteration
+DEFAULT_SLICE_STEPS = 200
+#: Default maximum time in milliseconds of a task per loop iteration
+DEFAULT_SLICE_TIME = 20
+
+def classify(request):
+    '''
+    Returns a priority class of the given request. Input events are the most
+    latency-sensitive, followed by reads of single accessibles, traversals
+    of accessible trees and system requests.
+
+    :param request: A request message or None if it cannot be parsed
+    :type request: tadek.connection.protocol.Message
+    :rtype: integer
+    '''
+    if request is None:
+        return POINT
+    if request.target == protocol.MSG_TARGET_ACCESSIBILITY:
+        if request.name == protocol.MSG_NAME_EXEC:
+            return INPUT
+        elif request.name == protocol.MSG_NAME_GET:
+            depth = getattr(request, "depth", 0)
+            if depth < 0 or depth > 1:
+                return BULK
+        elif request.name == protocol.MSG_NAME_SEARCH:
+            if getattr(request, "method", None) == protocol.MHD_SEARCH_DEEP:
+                return BULK
+    elif request.target == protocol.MSG_TARGET_SYSTEM:
+        return SYSTEM
+    return POINT
+
+
+class Deadline(object):
+    '''
+    A deadline of a request. A request can be also cancelled by a client,
+    then it ends as if the deadline expired, or aborted when its connection
+    is closed, then its result is dropped.
+    '''
+    __slots__ = ("time", "reached", "aborted")
+
+    def __init__(self, timeout=None):
+        '''
+        Initializes a deadline.
+
+        :param timeout: A time in milliseconds since now or None if there is
+            no deadline
+        :type timeout: integer
+        '''
+        self.time = None
+        if timeout is not None:
+            self.time = time.time() + timeout / 1000.0
+        self.reached = False
+        self.aborted = False
+
+    def expired(self):
+        '''
+        Checks if the deadline expired or the request was cancelled.
+
+        :rtype: boolean
+        '''
+        if not self.reached and self.time is not None:
+            self.reached = time.time() >= self.time
+        return self.reached
+
+    def cancel(self):
+        '''
+        Cancels the request, it returns its partial result.
+        '''
+        self.reached = True
+
+    def abort(self):
+        '''
+        Aborts the request, its result is dropped.
+        '''
+        self.reached = True
+        self.aborted = True
+
+
+class SharedDeadline(object):
+    '''
+    A deadline of an execution shared by identical requests. It expires when
+    deadlines of all the requests expire and it is aborted when all
+    the requests are aborted.
+    '''
+    __slots__ = ("deadlines",)
+
+    def __init__(self, deadlines=()):
+        '''
+        Initializes a shared deadline.
+
+        :param deadlines: Deadlines of the requests
+        :type deadlines: list
+        '''
+        self.deadlines = list(deadlines)
+
+    @property
+    def time(self):
+        '''
+        The latest time of the deadlines or None if any request has no
+        deadline.
+        '''
+        times = [deadline.time for deadline in self.deadlines]
+        if not times or None in times:
+            return None
+        return max(times)
+
+    @property
+    def reached(self):
+        '''
+        True if deadlines of all the requests expired.
+        '''
+        return all([deadline.reached for deadline in self.deadlines])
+
+    @property
+    def aborted(self):
+        '''
+        True if all the requests are aborted.
+        '''
+        return all([deadline.aborted for deadline in self.deadlines])
+
+    def expired(self):
+        '''
+        Checks if deadlines of all the requests expired.
+
+        :rtype: boolean
+        '''
+        return all([deadline.expired() for deadline in self.deadlines])
+
+    def cancel(self):
+        '''
+        Cancels all the requests.
+        '''
+        for deadline in self.deadlines:
+            deadline.cancel()
+
+    def abort(self):
+        '''
+        Aborts all the requests.
+        '''
+        for deadline in self.deadlines:
+            deadline.abort()
+
+def complete(steps):
+    '''
+    Runs all steps of a resumable task and returns its result.
+
+    :param steps: A generator that yields None after each step and finally
+        a result
+    :type steps: generator
+    :return: The result of the task
+    :rtype: object
+    '''
+    result = None
+    for result in steps:
+        pass
+    return result
+
+
+class Task(object):
+    '''
+    A resumable task, e.g. a traversal of an accessible tree, advanced
+    by the scheduler in slices. Backend calls of its slices are attributed
+    to the request that spawned it and they are profiled with the request.
+    '''
+    __slots__ = ("steps", "deferred", "result", "deadline", "attribution",
+                 "profiled")
+
+    def __init__(self, steps, deadline=None):
+        self.steps = steps
+        self.deferred = loop.Deferred()
+        self.result = None
+        self.deadline = deadline
+        self.attribution = instrument.current()
+        self.profiled = profiler.profiling()
+
+    def advance(self, steps, duration):
+        '''
+        Advances the task for the given number of steps or time at most.
+
+        :param steps: A maximum number of steps
+        :type steps: integer
+        :param duration: A maximum time in seconds
+        :type duration: float
+        :return: True if the task is finished
+        :rtype: boolean
+        '''
+        if self.deadline is not None and self.deadline.aborted:
+            self.steps.close()
+            self.result = None
+            return True
+        deadline = time.time() + duration
+        try:
+            for i in xrange(steps):
+                result = self.steps.next()
+                if result is not None:
+                    self.result = result
+                if time.time() >= deadline:
+                    break
+        except StopIteration:
+            return True
+        except:
+            log.exception("Task failure")
+            self.result = None
+            return True
+        return False
+
+
+class Scheduler(object):
+    '''
+    A scheduler of requests of all connections. On every loop iteration all
+    input and point requests are processed, while bulk and system requests
+    are limited, so the loop gets back to sockets and new input events are
+    served first. Requests of a connection are processed in arrival order,
+    a connection is scheduled by a class of its next request and connections
+    of the same class are served round-robin. Resumable tasks, e.g. dumps
+    of deep accessible trees, are advanced round-robin in slices of bounded
+    number of steps and time.
+
+    Connections implement nextPriority() and runNext(), the latter processes
+    the next request and schedules the connection again if needed.
+    '''
+    def __init__(self, bulk=DEFAULT_BULK, sliceSteps=DEFAULT_SLICE_STEPS,
+                 sliceTime=DEFAULT_SLICE_TIME / 1000.0):
+        self.bulk = bulk
+        self.sliceSteps = sliceSteps
+        self.sliceTime = sliceTime
+        self._ready = [deque() for name in CLASSES]
+        self._tasks = deque()
+
+    def __len__(self):
+        return sum([len(ready) for ready in self._ready]) + len(self._tasks)
+
+    def spawn(self, steps, deadline=None):
+        '''
+        Schedules a resumable task of the given steps.
+
+        :param steps: A generator that yields None after each step and finally
+            a result
+        :type steps: generator
+        :param deadline: A deadline of the task, if it is aborted the task
+            is closed and its result is None
+        :type deadline: Deadline
+        :return: A deferred result of the task
+        :rtype: loop.Deferred
+        '''
+        task = Task(steps, deadline)
+        self._tasks.append(task)
+        return task.deferred
+
+    def schedule(self, connection):
+        '''
+        Schedules the next request of the given connection.
+        '''
+        self._ready[connection.nextPriority()].append(connection)
+
+    def remove(self, connection):
+        '''
+        Removes the given connection from the scheduler.
+        '''
+        for ready in self._ready:
+            if connection in ready:
+                ready.remove(connection)
+
+    def run(self):
+        '''
+        Processes scheduled requests and advances each task by one slice.
+
+        :return: True if there are more requests or tasks to process
+        :rtype: boolean
+        '''
+        bulk = 0
+        while True:
+            for priority, ready in enumerate(self._ready):
+                if ready:
+                    break
+            else:
+                break
+            if priority >= BULK:
+                if bulk >= self.bulk:
+                    break
+                bulk += 1
+            ready.popleft().runNext()
+        for i in xrange(len(self._tasks)):
+            task = self._tasks.popleft()
+            attribution = instrument.resume(task.attribution)
+            profiler.resume(task.profiled)
+            try:
+                with timeline.span("slice", "scheduler"):
+                    finished = task.advance(self.sliceSteps, self.sliceTime)
+            finally:
+                profiler.suspend()
+                instrument.resume(attribution)
+            if finished:
+                # Snapshots of the task do not outlive it
+                accessibility.expireSnapshots()
+                task.deferred.callback(task.result)
+            else:
+                self._tasks.append(task)
+        return len(self) > 0
+
+# A scheduler of requests of all connections
+scheduler = Scheduler()
+loop.addTask(scheduler.run)
+
+class CancelExtension(protocol.Extension):
+    '''
+    A protocol extension that cancels a request of the same connection.
+    A cancelled request returns its partial result marked as incomplete.
+    Cancel requests are handled by connections on arrival, before requests
+    received earlier.
+    '''
+    name = "cancel"
+
+    def request(self, requestId):
+        '''
+        Returns parameters of a cancel request.
+
+        :param requestId: An id of a request to cancel
+        :type requestId: integer
+        '''
+        return {"requestId": requestId}
+
+    def response(self, requestId, **params):
+        '''
+        Returns a status of a cancel request not handled by a connection.
+
+        :return: A status and response parameters
+        :rtype: tuple
+        '''
+        return False, {}
+
+protocol.registerExtension(CancelExtension())
+
+def isCancel(request):
+    '''
+    Checks if the given request is a cancel request.
+
+    :param request: A request message or None
+    :type request: tadek.connection.protocol.Message
+    :rtype: boolean
+    '''
+    return (request is not None and
+            request.target == protocol.MSG_TARGET_EXTENSION and
+            request.name == CancelExtension.name)
+
+def recordWait(priority, arrived):
+    '''
+    Records a time the request of the given priority class waited in a queue.
+
+    :param priority: A priority class of the request
+    :type priority: integer
+    :param arrived: A time of arrival of the request
+    :type arrived: float
+    '''
+    stats.observe("request_wait_seconds", (("class", CLASSES[priority]),),
+                  time.time() - arrived)
+
+def configure():
+    '''
+    Applies settings of the [scheduler] section of the daemon configuration.
+    '''
+    scheduler.bulk = (config.getInt('daemon', 'scheduler', 'bulk') or
+                      DEFAULT_BULK)
+    scheduler.sliceSteps = (config.getInt('daemon', 'scheduler', 'slice_steps')
+                            or DEFAULT_SLICE_STEPS)
+    sliceTime = config.getInt('daemon', 'scheduler', 'slice_time')
+    if sliceTime is None:
+        sliceTime = DEFAULT_SLICE_TIME
+    scheduler.sliceTime = sliceTime / 1000.0
+
+stats.describe("request_wait_seconds",
+               "Time requests waited for processing by priority class")
@@ -0,0 +1,316 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import time
+
+from tadek.core import config
+from tadek.connection import protocol
+
+import loop
+import stats
+import scheduler
+
+#: Default time in milliseconds a response is shared with identical requests
+#: after it is sent, by default only executions in progress are shared
+DEFAULT_WINDOW = 0
+
+# Expiration time of executions in progress
+INFINITY = float("inf")
+
+#: Read-only requests those can be coalesced as {target: names}
+READ_ONLY = {
+    protocol.MSG_TARGET_ACCESSIBILITY: (protocol.MSG_NAME_GET,
+                                        protocol.MSG_NAME_SEARCH)
+}
+
+#: Requests those can change results of read-only requests as
+#: {target: names}
+WRITES = {
+    protocol.MSG_TARGET_ACCESSIBILITY: (protocol.MSG_NAME_PUT,
+                                        protocol.MSG_NAME_EXEC),
+    protocol.MSG_TARGET_SYSTEM: (protocol.MSG_NAME_PUT,
+                                 protocol.MSG_NAME_EXEC)
+}
+
+#: Request parameters those do not change a result of a request
+IGNORED_PARAMS = frozenset(["id", "deadline"])
+
+
+class SharedResponse(object):
+    '''
+    A response shared by identical requests. It is marshalled only once.
+    '''
+    def __init__(self, response):
+        self._response = response
+        self._data = None
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def marshal(self):
+        '''
+        Returns marshalled data of the response, marshalling it only once.
+        '''
+        if self._data is None:
+            self._data = self._response.marshal()
+        return self._data
+
+
+class Flight(object):
+    '''
+    An execution of a request shared by identical requests. While it is
+    in progress, it has a shared deadline of all waiting requests.
+    '''
+    __slots__ = ("request", "response", "expires", "deadline", "waiting")
+
+    def __init__(self, request, response, expires):
+        self.request = request
+        self.response = response
+        self.expires = expires
+        self.deadline = None
+        # Deadlines and deferred responses of waiting requests
+        self.waiting = []
+
+
+def _freeze(value):
+    '''
+    Converts the given request parameter value into a hashable one.
+    '''
+    if hasattr(value, "tuple"):
+        # An accessible path
+        return ("path",) + tuple(value.tuple)
+    elif isinstance(value, (list, tuple)):
+        return tuple([_freeze(item) for item in value])
+    elif isinstance(value, dict):
+        return tuple(sorted([(k, _freeze(v)) for k, v in value.iteritems()]))
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+def key(request):
+    '''
+    Returns a key identifying a result of the given request or None if
+    the request is not read-only.
+
+    :param request: A request message
+    :type request: tadek.connection.protocol.Message
+    :rtype: tuple
+    '''
+    if request.name not in READ_ONLY.get(request.target, ()):
+        return None
+    params = [(name, _freeze(getattr(request, name, None)))
+              for name in sorted(request.getParams())
+              if name not in IGNORED_PARAMS]
+    return (request.target, request.name, tuple(params))
+
+
+class Group(object):
+    '''
+    A group of shared executions of identical read-only requests. A result
+    of a request is shared with identical requests received while it is
+    processed, if it is deferred, and within the given window after it is
+    sent, if the window is positive. Requests those change state of
+    the system end all shared executions.
+    '''
+    def __init__(self, window):
+        '''
+        Initializes a group.
+
+        :param window: A time in seconds a response is shared
+        :type window: float
+        '''
+        self.window = window
+        self._flights = {}
+        # Executions in progress
+        self._inFlight = set()
+
+    def __call__(self, request, processor):
+        '''
+        Processes the given request using the processor or returns a shared
+        response of an identical request.
+
+        :param request: A request to process
+        :type request: tadek.connection.protocol.Message
+        :param processor: A processor of the calling connection
+        :type processor: Processor
+        :return: A response
+        :rtype: tadek.connection.protocol.Message
+        '''
+        k = key(request)
+        if k is None:
+            if request.name in WRITES.get(request.target, ()):
+                self._flights.clear()
+            return processor(request)
+        now = time.time()
+        flight = self._flights.get(k)
+        if flight is not None and flight.expires > now:
+            stats.count("shared_responses_total", stats.requestLabels(request))
+            # The connection did not resolve any object
+            processor.cache = None
+            if flight.deadline is not None:
+                # Join the execution in progress
+                deadline = processor.deadline or scheduler.Deadline()
+                flight.deadline.deadlines.append(deadline)
+                return self._wait(flight, deadline)
+            return flight.response
+        if len(self._flights) > 0:
+            self._expire(now)
+        deadline = processor.deadline
+        flight = Flight(request, None, INFINITY)
+        # The execution ends when deadlines of all waiting requests expire
+        flight.deadline = scheduler.SharedDeadline([deadline or
+                                                    scheduler.Deadline()])
+        processor.deadline = flight.deadline
+        try:
+            response = processor(request)
+        finally:
+            processor.deadline = deadline
+        if isinstance(response, loop.Deferred):
+            # Identical requests join the execution until it lands
+            response.addCallback(self._land, k, flight)
+            self._flights[k] = flight
+            self._inFlight.add(flight)
+            return self._wait(flight, flight.deadline.deadlines[0])
+        elif (self.window > 0 and response is not None and
+              not getattr(response, "incomplete", False)):
+            response = SharedResponse(response)
+            flight.response = response
+            flight.expires = time.time() + self.window
+            flight.deadline = None
+            self._flights[k] = flight
+        return response
+
+    def _wait(self, flight, deadline):
+        '''
+        Returns a deferred response of a request of the given deadline
+        waiting for the execution in progress.
+        '''
+        deferred = loop.Deferred()
+        flight.waiting.append((deadline, deferred))
+        if deadline.time is not None:
+            # Respond to the request on its own deadline
+            loop.callLater(max(deadline.time - time.time(), 0), self.check)
+        return deferred
+
+    def _land(self, response, k, flight):
+        '''
+        Passes the deferred response of the given execution to waiting
+        requests and shares it within the window, unless the execution was
+        cancelled, aborted or its deadline expired.
+        '''
+        self._inFlight.discard(flight)
+        waiting = flight.waiting
+        flight.waiting = []
+        if (self.window <= 0 or response is None or
+            flight.deadline.reached or getattr(response, "incomplete", False)):
+            if self._flights.get(k) is flight:
+                del self._flights[k]
+        else:
+            response = SharedResponse(response)
+            flight.response = response
+            flight.expires = time.time() + self.window
+        flight.deadline = None
+        for deadline, deferred in waiting:
+            if deadline.aborted:
+                deferred.callback(None)
+            else:
+                deferred.callback(response)
+
+    def check(self):
+        '''
+        Responds to requests whose deadlines expired while they wait for
+        executions in progress. An execution goes on for the other waiting
+        requests, if all of them expired it ends with a partial result.
+
+        :return: False, checks have no more work to do
+        :rtype: boolean
+        '''
+        for flight in list(self._inFlight):
+            expired = [deadline.expired() for deadline, deferred
+                       in flight.waiting]
+            if all(expired) or not any(expired):
+                continue
+            waiting = []
+            for (deadline, deferred), reached in zip(flight.waiting, expired):
+                if not reached:
+                    waiting.append((deadline, deferred))
+                elif deadline.aborted:
+                    deferred.callback(None)
+                else:
+                    request = flight.request
+                    deferred.callback(protocol.create(
+                                              protocol.MSG_TYPE_RESPONSE,
+                                              request.target, request.name,
+                                              status=False, incomplete=True))
+            flight.waiting = waiting
+            flight.deadline.deadlines = [deadline for deadline, deferred
+                                         in waiting]
+        return False
+
+    def _expire(self, now):
+        '''
+        Removes expired executions.
+        '''
+        for k, flight in self._flights.items():
+            if flight.expires <= now:
+                del self._flights[k]
+
+    def clear(self):
+        '''
+        Ends all shared executions.
+        '''
+        self._flights.clear()
+
+
+#: The group of shared executions of all connections
+group = Group(DEFAULT_WINDOW / 1000.0)
+loop.addTask(group.check)
+
+def configure():
+    '''
+    Applies settings of the [singleflight] section of the daemon
+    configuration.
+    '''
+    window = config.getInt('daemon', 'singleflight', 'window')
+    if window is None:
+        window = DEFAULT_WINDOW
+    group.window = window / 1000.0
+    group.clear()
+
+stats.describe("shared_responses_total",
+               "Number of requests served with a shared response")
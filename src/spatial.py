@@ -0,0 +1,499 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import time
+from collections import OrderedDict
+
+from tadek.core import log
+from tadek.core import config
+from tadek.core.accessible import Path, Accessible
+from tadek.connection import protocol
+
+import loop
+import stats
+import providers
+import scheduler
+
+#: Default time in milliseconds a spatial index is used before it is rebuilt
+DEFAULT_TTL = 1000
+#: Default size in pixels of a cell of a spatial index
+DEFAULT_CELL_SIZE = 64
+#: Default maximum number of accessibles in a spatial index
+DEFAULT_MAX_NODES = 20000
+#: Maximum number of spatial indexes of different subtrees
+MAX_INDEXES = 8
+#: Maximum absolute coordinate in pixels of indexed geometry, accessibles
+#: are clamped to it
+MAX_COORDINATE = 32768
+
+
+class Node(object):
+    '''
+    An accessible object stored in a spatial index together with its geometry.
+    '''
+    __slots__ = ("path", "obj", "depth", "order", "rect")
+
+    def __init__(self, path, obj, depth, order, rect):
+        self.path = path
+        self.obj = obj
+        self.depth = depth
+        self.order = order
+        self.rect = rect
+
+    def contains(self, x, y):
+        '''
+        Checks if the node contains the given point.
+        '''
+        nx, ny, nw, nh = self.rect
+        return nx <= x < nx + nw and ny <= y < ny + nh
+
+    def intersects(self, x, y, w, h):
+        '''
+        Checks if the node intersects the given rectangle.
+        '''
+        nx, ny, nw, nh = self.rect
+        return nx < x + w and x < nx + nw and ny < y + h and y < ny + nh
+
+
+def geometry(a11y, obj):
+    '''
+    Gets a rectangle of the given accessible object or None if the object
+    has no area.
+
+    :return: A tuple of x, y, width and height
+    :rtype: tuple
+    '''
+    position = a11y.getPosition(obj)
+    size = a11y.getSize(obj)
+    if not position or not size or size[0] <= 0 or size[1] <= 0:
+        return None
+    return (position[0], position[1], size[0], size[1])
+
+
+class GridIndex(object):
+    '''
+    A spatial index of accessibles of a subtree. The screen is divided into
+    square cells and each accessible is stored in all cells it overlaps.
+    Geometry of accessibles found by a lookup is validated and moved
+    accessibles are reindexed.
+    '''
+    def __init__(self, a11y, cellSize):
+        self.a11y = a11y
+        self.cellSize = cellSize
+        self.created = time.time()
+        self._cells = {}
+        limit = MAX_COORDINATE // cellSize
+        # Cells of the screen extent as the first and the last column and row
+        self._screen = (-limit, -limit, limit, limit)
+        # Cells of the grid extent, i.e. overlapped by indexed accessibles
+        self._grid = (0, 0, -1, -1)
+
+    def __len__(self):
+        return sum([len(nodes) for nodes in self._cells.itervalues()])
+
+    def _range(self, x, y, w, h, bounds):
+        '''
+        Returns cells overlapped by the given rectangle clamped to the given
+        bounds of cells as the first and the last column and row.
+        '''
+        size = self.cellSize
+        left, top, right, bottom = bounds
+        for cx in xrange(max(int(x) // size, left),
+                         min(int(x + w - 1) // size, right) + 1):
+            for cy in xrange(max(int(y) // size, top),
+                             min(int(y + h - 1) // size, bottom) + 1):
+                yield cx, cy
+
+    def add(self, node):
+        '''
+        Adds the given node to the index.
+        '''
+        cells = list(self._range(*node.rect, bounds=self._screen))
+        if not cells:
+            return
+        for cell in cells:
+            self._cells.setdefault(cell, []).append(node)
+        left, top, right, bottom = self._grid
+        if left > right:
+            self._grid = cells[0] + cells[-1]
+        else:
+            self._grid = (min(left, cells[0][0]), min(top, cells[0][1]),
+                          max(right, cells[-1][0]), max(bottom, cells[-1][1]))
+
+    def remove(self, node):
+        '''
+        Removes the given node from the index.
+        '''
+        for cell in self._range(*node.rect, bounds=self._screen):
+            nodes = self._cells.get(cell)
+            if nodes is not None and node in nodes:
+                nodes.remove(node)
+                if not nodes:
+                    del self._cells[cell]
+
+    def _candidates(self, x, y, w, h):
+        '''
+        Returns nodes stored in cells overlapped by the given rectangle.
+        '''
+        found = set()
+        for cell in self._range(x, y, w, h, self._grid):
+            found.update(self._cells.get(cell, ()))
+        return found
+
+    def _validate(self, node):
+        '''
+        Updates geometry of the given node and returns True if it is
+        unchanged.
+        '''
+        try:
+            rect = geometry(self.a11y, node.obj)
+        except:
+            rect = None
+        if rect == node.rect:
+            return True
+        self.remove(node)
+        if rect is not None:
+            node.rect = rect
+            self.add(node)
+        stats.count("spatial_reindexed_total")
+        return False
+
+    def lookup(self, x, y, w=1, h=1):
+        '''
+        Returns nodes intersecting the given rectangle ordered by their
+        depth and position in the tree.
+
+        :rtype: list
+        '''
+        nodes = []
+        for node in self._candidates(x, y, w, h):
+            if node.intersects(x, y, w, h) and (self._validate(node) or
+                                                node.intersects(x, y, w, h)):
+                nodes.append(node)
+        nodes.sort(key=lambda node: (node.depth, node.order))
+        return nodes
+
+
+def build(*args, **kwargs):
+    '''
+    Builds a spatial index of the subtree of the given accessible object.
+    It takes the same parameters as iterBuild().
+
+    :rtype: GridIndex
+    '''
+    return scheduler.complete(iterBuild(*args, **kwargs))
+
+def iterBuild(a11y, obj, path, cellSize, maxNodes):
+    '''
+    Builds a spatial index of the subtree of the given accessible object
+    step by step. It is a generator that yields None after each visited
+    accessible and finally the index.
+
+    :param a11y: An accessibility of the object
+    :type a11y: IAccessibility
+    :param obj: An accessible object or None
+    :type obj: accessible
+    :param path: A path of the object
+    :type path: tadek.core.accessible.Path
+    :param cellSize: A size in pixels of a cell of the index
+    :type cellSize: integer
+    :param maxNodes: A maximum number of indexed accessibles
+    :type maxNodes: integer
+    :rtype: generator
+    '''
+    index = GridIndex(a11y, cellSize)
+    root = len(path.tuple)
+    order = 0
+    for a, o, p in providers.Descendants(a11y, obj, path):
+        if order >= maxNodes:
+            log.warning("Spatial index of %s truncated to %d accessibles"
+                        % (path, maxNodes))
+            break
+        try:
+            rect = geometry(a, o)
+        except:
+            yield None
+            continue
+        if rect is not None:
+            index.add(Node(p, o, len(p.tuple) - root, order, rect))
+        order += 1
+        yield None
+    index.created = time.time()
+    stats.count("spatial_builds_total")
+    yield index
+
+
+class SpatialIndexes(object):
+    '''
+    Spatial indexes of subtrees of accessibles those are rebuilt after
+    the given time to live.
+    '''
+    def __init__(self, ttl=DEFAULT_TTL / 1000.0, cellSize=DEFAULT_CELL_SIZE,
+                 maxNodes=DEFAULT_MAX_NODES):
+        self.ttl = ttl
+        self.cellSize = cellSize
+        self.maxNodes = maxNodes
+        self._indexes = OrderedDict()
+        self._building = {}
+
+    def clear(self):
+        '''
+        Removes all spatial indexes, e.g. after an action or an input event.
+        Indexes being built are not stored, their results are passed only
+        to requests waiting for them.
+        '''
+        self._indexes.clear()
+        self._building.clear()
+
+    def get(self, path):
+        '''
+        Gets a spatial index of a subtree of the given path. An index is
+        built in time slices of the event loop. An index older than its time
+        to live is used until the new one is built, geometry of accessibles
+        found by its lookups is validated anyway.
+
+        :param path: A path of a root of the subtree
+        :type path: tadek.core.accessible.Path
+        :return: A spatial index, a deferred index if the subtree has no
+            index yet or None if the path is invalid
+        :rtype: GridIndex or loop.Deferred
+        '''
+        key = path.tuple
+        index = self._indexes.pop(key, None)
+        if index is not None:
+            self._indexes[key] = index
+            if index.created + self.ttl > time.time():
+                return index
+        deferred = self._building.get(key)
+        if deferred is None:
+            a11y, obj = providers.accessible(path)
+            if a11y is None:
+                return None
+            steps = iterBuild(a11y, obj, path, self.cellSize, self.maxNodes)
+            deferred = scheduler.scheduler.spawn(steps)
+            self._building[key] = deferred
+            deferred.addCallback(self._built, key, deferred)
+        if index is not None:
+            return index
+        return deferred
+
+    def _built(self, index, key, deferred):
+        '''
+        Stores the given built index unless indexes were removed meanwhile.
+        '''
+        if self._building.get(key) is not deferred:
+            return
+        del self._building[key]
+        if index is None:
+            return
+        self._indexes.pop(key, None)
+        self._indexes[key] = index
+        while len(self._indexes) > MAX_INDEXES:
+            self._indexes.popitem(last=False)
+
+# Spatial indexes shared by all connections
+indexes = SpatialIndexes()
+
+
+def hitTest(path, point=None, rect=None, all=False):
+    '''
+    Finds accessibles of a subtree of the given path those contain the point
+    or intersect the rectangle.
+
+    :param path: A path of a root of the subtree
+    :type path: tadek.core.accessible.Path
+    :param point: A point as x and y
+    :type point: tuple
+    :param rect: A rectangle as x, y, width and height
+    :type rect: tuple
+    :param all: If True all found accessibles are returned, otherwise only
+        the deepest one
+    :type all: boolean
+    :return: A list of found accessibles, a deferred list if the spatial
+        index is being built or None if the path is invalid
+    :rtype: list or loop.Deferred
+    '''
+    if not path.tuple:
+        # Hit-test all accessibilities
+        founds = [hitTest(Path(i), point, rect, True)
+                  for i in xrange(providers.a11yCount)]
+        if not [found for found in founds
+                if isinstance(found, loop.Deferred)]:
+            return merge(founds, all)
+        deferreds = []
+        for found in founds:
+            if not isinstance(found, loop.Deferred):
+                deferred = loop.Deferred()
+                deferred.callback(found)
+                found = deferred
+            deferreds.append(found)
+        return loop.gather(deferreds).chain(merge, all)
+    index = indexes.get(path)
+    if isinstance(index, loop.Deferred):
+        return index.chain(lookup, point, rect, all)
+    return lookup(index, point, rect, all)
+
+def lookup(index, point=None, rect=None, all=False):
+    '''
+    Finds accessibles of the given spatial index those contain the point
+    or intersect the rectangle. It takes the same parameters as hitTest().
+
+    :param index: A spatial index or None
+    :type index: GridIndex
+    :return: A list of found accessibles or None if there is no index
+    :rtype: list
+    '''
+    if index is None:
+        return None
+    if rect is not None:
+        nodes = index.lookup(*rect)
+    else:
+        nodes = index.lookup(point[0], point[1])
+    if not all:
+        nodes = nodes[-1:]
+    found = []
+    for node in nodes:
+        acc = Accessible(node.path)
+        acc.position = node.rect[:2]
+        acc.size = node.rect[2:]
+        try:
+            acc.name = index.a11y.getName(node.obj)
+            acc.role = index.a11y.getRoleName(node.obj)
+        except:
+            log.exception("Dumping accessible object error: %s" % node.path)
+        found.append(acc)
+    return found
+
+
+def merge(founds, all=False):
+    '''
+    Merges accessibles found in accessibilities in their index order.
+
+    :param founds: Lists of accessibles found in accessibilities or None
+    :type founds: list
+    :param all: If True all found accessibles are returned, otherwise only
+        the deepest one
+    :type all: boolean
+    :rtype: list
+    '''
+    found = []
+    for accessibles in founds:
+        found.extend(accessibles or [])
+    found.sort(key=lambda acc: len(acc.path.tuple))
+    if not all:
+        found = found[-1:]
+    return found
+
+
+class HitTestExtension(protocol.Extension):
+    '''
+    A protocol extension that finds accessibles at a point of the screen
+    or in a rectangle.
+    '''
+    name = "hittest"
+    #: Requests for accessibles of backends are processed by worker processes
+    isolated = True
+
+    def request(self, path, point=None, rect=None, all=False):
+        '''
+        Returns parameters of a hit-testing request.
+
+        :param path: A path of a searched subtree, e.g. of an application
+        :type path: tadek.core.accessible.Path
+        :param point: A point as x and y
+        :type point: tuple
+        :param rect: A rectangle as x, y, width and height
+        :type rect: tuple
+        :param all: If True all found accessibles are returned, otherwise only
+            the deepest one
+        :type all: boolean
+        '''
+        params = {"path": path, "all": all}
+        if point is not None:
+            params["point"] = point
+        if rect is not None:
+            params["rect"] = rect
+        return params
+
+    def response(self, path, point=None, rect=None, all=False, **params):
+        '''
+        Returns found accessibles including their name, role, position
+        and size.
+
+        :return: A status and response parameters
+        :rtype: tuple
+        '''
+        if not hasattr(path, "tuple"):
+            path = Path(*path)
+        if point is None and rect is None:
+            log.warning("Hit-testing request without point and rectangle")
+            return False, {}
+        found = hitTest(path, point, rect, all)
+        if isinstance(found, loop.Deferred):
+            # The spatial index is being built
+            return found.chain(self._response, path)
+        return self._response(found, path)
+
+    def _response(self, found, path):
+        '''
+        Returns a status and response parameters of the given found
+        accessibles.
+        '''
+        if found is None:
+            log.info("Hit-testing of requested path failure: %s" % path)
+            return False, {}
+        return True, {"accessibles": found}
+
+protocol.registerExtension(HitTestExtension())
+
+
+def configure():
+    '''
+    Applies settings of the [spatial] section of the daemon configuration.
+    '''
+    ttl = config.getInt('daemon', 'spatial', 'ttl')
+    if ttl is None:
+        ttl = DEFAULT_TTL
+    indexes.ttl = ttl / 1000.0
+    indexes.cellSize = (config.getInt('daemon', 'spatial', 'cell_size') or
+                        DEFAULT_CELL_SIZE)
+    indexes.maxNodes = (config.getInt('daemon', 'spatial', 'max_nodes') or
+                        DEFAULT_MAX_NODES)
+    indexes.clear()
+
+stats.describe("spatial_builds_total", "Number of built spatial indexes")
+stats.describe("spatial_reindexed_total",
+               "Number of accessibles moved in spatial indexes")
@@ -0,0 +1,406 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import os
+import socket
+import bisect
+import threading
+import asyncore
+import asynchat
+
+from tadek.core import log
+from tadek.core import config
+from tadek.connection import protocol
+
+import loop
+
+#: Upper bounds in seconds of buckets of latency histograms
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: A prefix of names of all exported metrics
+PREFIX = "tadekd_"
+
+#: Default interval in seconds of writing the metrics file
+DEFAULT_FILE_INTERVAL = 10
+#: Default IP address of the metrics HTTP listener
+DEFAULT_HTTP_ADDRESS = "127.0.0.1"
+
+class Histogram(object):
+    '''
+    A histogram of latencies with fixed buckets.
+    '''
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        '''
+        Adds the given value to the histogram.
+
+        :param value: A value in seconds
+        :type value: float
+        '''
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Counters as {(metric, labels): value}
+_counters = {}
+# Histograms as {(metric, labels): Histogram}
+_histograms = {}
+# Maximum values as {(metric, labels): value}
+_maxima = {}
+# Gauges as {metric: function}
+_gauges = {}
+# Descriptions of metrics as {metric: description}
+_descriptions = {}
+# A lock of counters, histograms and maximum values, they are also updated
+# by threads of the worker pool
+_lock = threading.Lock()
+
+def describe(metric, description):
+    '''
+    Sets a description of the given metric used in reports.
+
+    :param metric: A name of a metric
+    :type metric: string
+    :param description: A description of the metric
+    :type description: string
+    '''
+    _descriptions[metric] = description
+
+def count(metric, labels=(), value=1):
+    '''
+    Increments the given counter metric.
+
+    :param metric: A name of a metric
+    :type metric: string
+    :param labels: Labels of the metric as ((name, value), ...)
+    :type labels: tuple
+    :param value: A value to add to the counter
+    :type value: integer
+    '''
+    key = (metric, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(metric, labels, value):
+    '''
+    Adds the given value to the histogram metric.
+
+    :param metric: A name of a metric
+    :type metric: string
+    :param labels: Labels of the metric as ((name, value), ...)
+    :type labels: tuple
+    :param value: A value in seconds
+    :type value: float
+    '''
+    key = (metric, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+def maximum(metric, labels, value):
+    '''
+    Updates the given maximum metric with the value if it is greater than
+    the current one.
+
+    :param metric: A name of a metric
+    :type metric: string
+    :param labels: Labels of the metric as ((name, value), ...)
+    :type labels: tuple
+    :param value: A value in seconds
+    :type value: float
+    '''
+    key = (metric, labels)
+    with _lock:
+        if value > _maxima.get(key, 0.0):
+            _maxima[key] = value
+
+def gauge(metric, function):
+    '''
+    Registers a gauge metric which value is returned by the given function.
+
+    :param metric: A name of a metric
+    :type metric: string
+    :param function: A function that returns a current value of the metric
+    :type function: callable
+    '''
+    _gauges[metric] = function
+
+def requestLabels(request):
+    '''
+    Returns metric labels of the given request.
+
+    :param request: A request message
+    :type request: tadek.connection.protocol.Message
+    :return: Labels as ((name, value), ...)
+    :rtype: tuple
+    '''
+    return (("target", str(request.target)), ("name", str(request.name)))
+
+def clear():
+    '''
+    Clears all counters, histograms and maximum values.
+    '''
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _maxima.clear()
+
+def _labels(labels, *extra):
+    '''
+    Formats the given labels in the Prometheus text format.
+    '''
+    labels = labels + extra
+    if not labels:
+        return ''
+    return "{%s}" % ','.join(['%s="%s"' % (name, str(value).replace('"', r'\"'))
+                              for name, value in labels])
+
+def _header(lines, metric, type):
+    '''
+    Appends a header of the given metric to report lines.
+    '''
+    name = PREFIX + metric
+    if metric in _descriptions:
+        lines.append("# HELP %s %s" % (name, _descriptions[metric]))
+    lines.append("# TYPE %s %s" % (name, type))
+
+def report():
+    '''
+    Returns a report of all metrics in the Prometheus text format.
+
+    :return: A metrics report
+    :rtype: string
+    '''
+    with _lock:
+        lines = _report()
+    for metric in sorted(_gauges):
+        try:
+            value = _gauges[metric]()
+        except:
+            log.exception("Getting value of gauge failure: %s" % metric)
+            continue
+        _header(lines, metric, "gauge")
+        lines.append("%s%s %s" % (PREFIX, metric, value))
+    lines.append('')
+    return '\n'.join(lines)
+
+def _report():
+    '''
+    Returns report lines of counters, histograms and maximum values.
+    '''
+    lines = []
+    last = None
+    for metric, labels in sorted(_counters):
+        if metric != last:
+            _header(lines, metric, "counter")
+            last = metric
+        lines.append("%s%s%s %d" % (PREFIX, metric, _labels(labels),
+                                    _counters[(metric, labels)]))
+    last = None
+    for metric, labels in sorted(_histograms):
+        if metric != last:
+            _header(lines, metric, "histogram")
+            last = metric
+        histogram = _histograms[(metric, labels)]
+        total = 0
+        for bound, n in zip(BUCKETS + ("+Inf",), histogram.counts):
+            total += n
+            lines.append("%s%s_bucket%s %d" % (PREFIX, metric,
+                                    _labels(labels, ("le", bound)), total))
+        lines.append("%s%s_sum%s %f" % (PREFIX, metric, _labels(labels),
+                                        histogram.sum))
+        lines.append("%s%s_count%s %d" % (PREFIX, metric, _labels(labels),
+                                          histogram.count))
+    last = None
+    for metric, labels in sorted(_maxima):
+        if metric != last:
+            _header(lines, metric, "gauge")
+            last = metric
+        lines.append("%s%s%s %f" % (PREFIX, metric, _labels(labels),
+                                    _maxima[(metric, labels)]))
+    return lines
+
+# METRICS FILE
+
+# A path of the metrics file or None
+_file = None
+# An interval of writing the metrics file
+_fileInterval = DEFAULT_FILE_INTERVAL
+# A timer writing the metrics file or None
+_fileTimer = None
+
+def update(timer=None):
+    '''
+    Writes the metrics file if it is enabled. It is called by a timer at
+    the interval of the file, also while no requests are processed.
+    '''
+    if _file is None:
+        return
+    tmp = '.'.join([_file, "tmp"])
+    fd = None
+    try:
+        fd = open(tmp, 'w')
+        fd.write(report())
+        fd.close()
+        fd = None
+        os.rename(tmp, _file)
+    except:
+        log.exception("Write metrics file failure: %s" % _file)
+    finally:
+        if fd:
+            fd.close()
+
+# METRICS HTTP LISTENER
+
+class MetricsHandler(asynchat.async_chat):
+    '''
+    A class of handlers those respond to HTTP requests of the metrics
+    listener with the metrics report.
+    '''
+    def __init__(self, sock):
+        asynchat.async_chat.__init__(self, sock)
+        self.set_terminator("\r\n\r\n")
+
+    def collect_incoming_data(self, data):
+        pass
+
+    def found_terminator(self):
+        body = report()
+        self.push(''.join(["HTTP/1.0 200 OK\r\n",
+                           "Content-Type: text/plain; version=0.0.4\r\n",
+                           "Content-Length: %d\r\n\r\n" % len(body), body]))
+        self.close_when_done()
+
+    def handle_error(self):
+        log.exception("Metrics request failure")
+        self.close()
+
+
+class MetricsListener(asyncore.dispatcher):
+    '''
+    A class of local HTTP listeners those serve the metrics report.
+    '''
+    def __init__(self, address):
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(5)
+        self.address = self.socket.getsockname()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            MetricsHandler(pair[0])
+
+    def handle_error(self):
+        log.exception("Metrics listener failure")
+
+
+def start():
+    '''
+    Starts exporting of metrics configured in the [stats] section of
+    the daemon configuration.
+    '''
+    global _file, _fileInterval, _fileTimer
+    _file = config.get('daemon', 'stats', 'file') or None
+    interval = config.getInt('daemon', 'stats', 'file_interval')
+    if interval is not None:
+        _fileInterval = max(interval, 1)
+    if _fileTimer is not None:
+        _fileTimer.cancel()
+        _fileTimer = None
+    if _file is not None:
+        _fileTimer = loop.callEvery(_fileInterval, update)
+    port = config.getInt('daemon', 'stats', 'http_port')
+    if port:
+        address = (config.get('daemon', 'stats', 'http_address') or
+                   DEFAULT_HTTP_ADDRESS)
+        try:
+            listener = MetricsListener((address, port))
+        except:
+            log.exception("Starting metrics listener failure")
+        else:
+            log.info("Serving metrics at %s:%d" % listener.address)
+
+# PROTOCOL EXTENSION
+
+class StatsExtension(protocol.Extension):
+    '''
+    A protocol extension that returns a report of daemon metrics.
+    '''
+    name = "stats"
+
+    def request(self, reset=False):
+        '''
+        Returns parameters of a metrics request.
+
+        :param reset: If True metrics are reset after reporting
+        :type reset: boolean
+        '''
+        return {"reset": reset}
+
+    def response(self, reset=False, **params):
+        '''
+        Returns a metrics report in the Prometheus text format.
+
+        :param reset: If True metrics are reset after reporting
+        :type reset: boolean
+        :return: A status and response parameters
+        :rtype: tuple
+        '''
+        data = report()
+        if reset:
+            clear()
+        return True, {"data": data}
+
+protocol.registerExtension(StatsExtension())
+
+describe("requests_total", "Number of processed requests")
+describe("request_errors_total", "Number of failed requests")
+describe("request_duration_seconds", "Duration of request processing")
+describe("received_bytes_total", "Number of received bytes")
+describe("sent_bytes_total", "Number of bytes queued for sending")
@@ -0,0 +1,215 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+import os
+import time
+import json
+import thread
+
+from tadek.core import log
+from tadek.core import config
+
+#: Default path of the trace file
+DEFAULT_FILE = "/tmp/tadekd-trace.json"
+#: Default maximum number of events in one trace file
+DEFAULT_MAX_EVENTS = 100000
+#: Default number of rotated trace files to keep
+DEFAULT_FILES = 5
+#: Number of buffered events written to the trace file at once
+FLUSH_EVENTS = 1000
+
+# True if spans are recorded, it is the only thing checked while tracing
+# is off
+enabled = False
+
+# A path of the trace file
+_file = DEFAULT_FILE
+# A maximum number of events in one trace file
+_maxEvents = DEFAULT_MAX_EVENTS
+# A number of rotated trace files to keep
+_files = DEFAULT_FILES
+# Buffered events
+_events = []
+# A trace file being written or None
+_fd = None
+# A number of events written to the current trace file
+_written = 0
+# An identifier of the daemon process
+_pid = os.getpid()
+
+
+class Span(object):
+    '''
+    A context manager that records a complete event of its duration.
+    '''
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        complete(self.name, self.category, self.start,
+                 time.time() - self.start, self.args)
+        return False
+
+
+class _NullSpan(object):
+    '''
+    A context manager used while tracing is off.
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name, category, **args):
+    '''
+    Returns a context manager that records a span of the given name and
+    category.
+
+    :param name: A name of a span
+    :type name: string
+    :param category: A category of a span, e.g. a subsystem
+    :type category: string
+    :return: A span context manager
+    :rtype: Span
+    '''
+    if not enabled:
+        return _NULL_SPAN
+    return Span(name, category, args)
+
+def complete(name, category, start, duration, args=None):
+    '''
+    Records a complete event of the given start time and duration.
+
+    :param name: A name of an event
+    :type name: string
+    :param category: A category of an event
+    :type category: string
+    :param start: A start time of an event in seconds
+    :type start: float
+    :param duration: A duration of an event in seconds
+    :type duration: float
+    :param args: Additional arguments of an event
+    :type args: dictionary
+    '''
+    if not enabled:
+        return
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": int(start * 1000000),
+        "dur": int(duration * 1000000),
+        "pid": _pid,
+        "tid": thread.get_ident()
+    }
+    if args:
+        event["args"] = args
+    _events.append(event)
+    if len(_events) >= FLUSH_EVENTS:
+        flush()
+
+def flush():
+    '''
+    Writes all buffered events to the trace file rotating it if necessary.
+    '''
+    global _events, _written
+    events, _events = _events, []
+    try:
+        for event in events:
+            if _fd is None or _written >= _maxEvents:
+                _rotate()
+            if _written:
+                _fd.write(",\n")
+            _fd.write(json.dumps(event, default=str))
+            _written += 1
+        if _fd is not None:
+            _fd.flush()
+    except:
+        log.exception("Write trace file failure: %s" % _file)
+
+def _close():
+    '''
+    Closes the current trace file.
+    '''
+    global _fd
+    if _fd is not None:
+        _fd.write("\n]\n")
+        _fd.close()
+        _fd = None
+
+def _rotate():
+    '''
+    Closes the current trace file, shifts rotated files and opens a new one.
+    '''
+    global _fd, _written
+    _close()
+    for n in xrange(_files - 1, 0, -1):
+        src = _file if n == 1 else "%s.%d" % (_file, n - 1)
+        if os.path.exists(src):
+            os.rename(src, "%s.%d" % (_file, n))
+    _fd = open(_file, 'w')
+    _fd.write("[\n")
+    _written = 0
+
+def configure():
+    '''
+    Applies settings of the [timeline] section of the daemon configuration.
+    '''
+    global enabled, _file, _maxEvents, _files
+    flush()
+    _close()
+    enabled = bool(config.getBool('daemon', 'timeline', 'enabled'))
+    _file = config.get('daemon', 'timeline', 'file') or DEFAULT_FILE
+    maxEvents = config.getInt('daemon', 'timeline', 'max_events')
+    _maxEvents = max(maxEvents or DEFAULT_MAX_EVENTS, 1)
+    files = config.getInt('daemon', 'timeline', 'files')
+    _files = max(files or DEFAULT_FILES, 1)
+    if enabled:
+        log.info("Writing trace events to: %s" % _file)
@@ -0,0 +1,209 @@
+################################################################################
+##                                                                            ##
+## This file is a part of TADEK.                                              ##
+##                                                                            ##
+## TADEK - Test Automation in a Distributed Environment                       ##
+## (http://tadek.comarch.com)                                                 ##
+##                                                                            ##
+## Copyright (C) 2011 Comarch S.A.                                            ##
+## All rights reserved.                                                       ##
+##                                                                            ##
+## TADEK is free software for non-commercial purposes. For commercial ones    ##
+## we offer a commercial license. Please check http://tadek.comarch.com for   ##
+## details or write to tadek-licenses@comarch.com                             ##
+##                                                                            ##
+## You can redistribute it and/or modify it under the terms of the            ##
+## GNU General Public License as published by the Free Software Foundation,   ##
+## either version 3 of the License, or (at your option) any later version.    ##
+##                                                                            ##
+## TADEK is distributed in the hope that it will be useful,                   ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of             ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              ##
+## GNU General Public License for more details.                               ##
+##                                                                            ##
+## You should have received a copy of the GNU General Public License          ##
+## along with TADEK bundled with this file in the file LICENSE.               ##
+## If not, see http://www.gnu.org/licenses/.                                  ##
+##                                                                            ##
+## Please notice that Contributor Agreement applies to any contribution       ##
+## you make to TADEK. The Agreement must be completed, signed and sent        ##
+## to Comarch before any contribution is made. You should have received       ##
+## a copy of Contribution Agreement along with TADEK bundled with this file   ##
+## in the file CONTRIBUTION_AGREEMENT.pdf or see http://tadek.comarch.com     ##
+## or write to tadek-licenses@comarch.com                                     ##
+##                                                                            ##
+################################################################################
+
+from tadek.core import log
+from tadek.core import config
+
+#: Trace levels
+DEBUG = 10
+INFO = 20
+OFF = 100
+
+#: Names of trace levels used in the configuration
+LEVELS = {
+    "debug": DEBUG,
+    "info": INFO,
+    "off": OFF
+}
+
+#: Subsystems of the daemon those have their own trace levels
+SUBSYSTEMS = ("daemon", "handler", "processor", "providers", "backend")
+
+#: Default maximum length of a traced payload
+DEFAULT_TRUNCATE = 1024
+
+# A level used by subsystems without their own level
+_default = OFF
+# Levels of subsystems as {subsystem: level}
+_levels = {}
+# Lowest enabled level of all subsystems
+_lowest = OFF
+# Trace 1 in N requests
+_sample = 1
+# A number of requests began so far
+_requests = 0
+# True if the current request is traced
+_sampled = True
+# A maximum length of traced payloads, 0 means no limit
+_truncate = DEFAULT_TRUNCATE
+
+def _getLevel(option):
+    '''
+    Gets a trace level of the given option of the configuration.
+    '''
+    name = config.get('daemon', 'tracing', option)
+    if name is None:
+        return None
+    level = LEVELS.get(name.strip().lower())
+    if level is None:
+        log.warning("Unknown trace level '%s' of option: %s" % (name, option))
+    return level
+
+def configure():
+    '''
+    Applies tracing settings from the daemon configuration.
+    '''
+    global _default, _sample, _truncate
+    _default = _getLevel('level') or OFF
+    _levels.clear()
+    for subsystem in SUBSYSTEMS:
+        level = _getLevel(subsystem)
+        if level is not None:
+            _levels[subsystem] = level
+    sample = config.getInt('daemon', 'tracing', 'sample')
+    _sample = max(sample or 1, 1)
+    truncate = config.getInt('daemon', 'tracing', 'truncate')
+    if truncate is None:
+        truncate = DEFAULT_TRUNCATE
+    _truncate = max(truncate, 0)
+    _update()
+
+def setLevel(subsystem, level):
+    '''
+    Sets a trace level of the given subsystem. If subsystem is None then
+    the default level is set.
+
+    :param subsystem: A name of a subsystem or None
+    :type subsystem: string
+    :param level: A trace level
+    :type level: integer
+    '''
+    global _default
+    if subsystem is None:
+        _default = level
+    else:
+        _levels[subsystem] = level
+    _update()
+
+def setSampling(sample):
+    '''
+    Sets tracing of 1 in the given number of requests.
+
+    :param sample: A number of requests per one traced request
+    :type sample: integer
+    '''
+    global _sample
+    _sample = max(sample, 1)
+
+def _update():
+    '''
+    Updates the lowest enabled level used for the fast path checks.
+    '''
+    global _lowest
+    _lowest = min([_default] + _levels.values())
+
+def beginRequest():
+    '''
+    Decides if a request that begins is sampled for tracing.
+    '''
+    global _requests, _sampled
+    _requests += 1
+    _sampled = _requests % _sample == 0
+
+def endRequest():
+    '''
+    Marks the end of the current request.
+    '''
+    global _sampled
+    _sampled = True
+
+def enabled(subsystem, level=DEBUG):
+    '''
+    Checks if messages of the given level and subsystem are traced.
+
+    :param subsystem: A name of a subsystem
+    :type subsystem: string
+    :param level: A trace level
+    :type level: integer
+    :rtype: boolean
+    '''
+    if level < _lowest or not _sampled:
+        return False
+    return level >= _levels.get(subsystem, _default)
+
+def truncate(data):
+    '''
+    Truncates the given payload according to the tracing settings.
+
+    :param data: A payload to truncate
+    :type data: string
+    :return: The truncated payload
+    :rtype: string
+    '''
+    if _truncate and len(data) > _truncate:
+        return "%s... [%d more bytes]" % (data[:_truncate],
+                                          len(data) - _truncate)
+    return data
+
+def _format(msg, args):
+    '''
+    Formats the given message truncating all its payloads.
+    '''
+    args = tuple([truncate(arg) if isinstance(arg, basestring) else arg
+                  for arg in args])
+    if args:
+        msg = msg % args
+    return truncate(msg)
+
+def debug(subsystem, msg, *args):
+    '''
+    Traces a debug message of the given subsystem. The message is formatted
+    using the given arguments only if it is actually traced.
+    '''
+    if DEBUG < _lowest or not _sampled:
+        return
+    if DEBUG >= _levels.get(subsystem, _default):
+        log.debug(_format(msg, args))
+
+def info(subsystem, msg, *args):
+    '''
+    Traces an info message of the given subsystem. The message is formatted
+    using the given arguments only if it is actually traced.
+    '''
+    if INFO < _lowest or not _sampled:
+        return
+    if INFO >= _levels.get(subsystem, _default):
+        log.info(_format(msg, args))